@@ -42,6 +42,34 @@ ALLOWED_HOSTS = []
 
 GEOSERVER_URL = env('GEOSERVER_URL')
 GEOSERVER_WORKSPACE = env('GEOSERVER_WORKSPACE')
+# Publish uploaded GeoJSON tables as GeoServer layers (disabled by `manage.py benchmark`).
+GEOSERVER_PUBLISH = env.bool('GEOSERVER_PUBLISH', default=True)
+# Pixels added around a bbox filter on the /api/ endpoints when a zoom level is given.
+API_BBOX_BUFFER_PIXELS = env.int('API_BBOX_BUFFER_PIXELS', default=16)
+
+# Stream /api/ responses through a server-side cursor by default (?stream= overrides).
+API_STREAMING = env.bool('API_STREAMING', default=False)
+API_STREAM_CHUNK_SIZE = env.int('API_STREAM_CHUNK_SIZE', default=2000)
+# Largest ?limit= accepted by the keyset paginated /api/ endpoints.
+API_MAX_PAGE_SIZE = env.int('API_MAX_PAGE_SIZE', default=10000)
+
+# Line levels of detail as (max_zoom, ST_SimplifyPreserveTopology tolerance in degrees).
+# Zoom levels above the last entry are served at full resolution.
+LINE_LOD_LEVELS = [
+    (3, 0.05),
+    (5, 0.02),
+    (7, 0.005),
+    (9, 0.001),
+]
+# Generator and storage clusters as (max_zoom, grid size in degrees), served by
+# /api/clusters/<layer>/. Zoom levels above the last entry get the individual points.
+CLUSTER_ZOOM_LEVELS = [
+    (2, 5.0),
+    (4, 2.0),
+    (6, 0.5),
+    (8, 0.1),
+]
+
 GDAL_LIBRARY_PATH = r'C:\Users\ramir\miniconda3\Library\bin\gdal.dll'
 
 INSTALLED_APPS = [
@@ -57,6 +85,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'geojson.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,6 +126,18 @@ DATABASES = {
 }
 
 DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
+# Keep connections open across requests instead of reconnecting each time, and check
+# them before reuse so a restarted PostGIS does not surface as request errors.
+DATABASES['default']['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=600)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = env.bool('CONN_HEALTH_CHECKS', default=True)
+
+# Process-wide SQLAlchemy pool used by the ingestion code.
+SQLALCHEMY_DATABASE_URL = env('DATABASE_URL')
+DB_POOL_SIZE = env.int('DB_POOL_SIZE', default=5)
+DB_POOL_MAX_OVERFLOW = env.int('DB_POOL_MAX_OVERFLOW', default=10)
+# Seconds after which a pooled connection is replaced, and to wait for a free one.
+DB_POOL_RECYCLE = env.int('DB_POOL_RECYCLE', default=1800)
+DB_POOL_TIMEOUT = env.int('DB_POOL_TIMEOUT', default=30)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -118,6 +159,64 @@ TIME_ZONE = 'UTC'
 USE_I18N = True
 USE_TZ = True
 
+# Uploads are loaded by `manage.py run_ingestion_worker`; disable to load them in the request.
+INGESTION_ASYNC = env.bool('INGESTION_ASYNC', default=True)
+INGESTION_POLL_INTERVAL = env.float('INGESTION_POLL_INTERVAL', default=2.0)
+# Running jobs older than this many seconds are requeued when a worker starts.
+INGESTION_JOB_TIMEOUT = env.int('INGESTION_JOB_TIMEOUT', default=6 * 60 * 60)
+# Uploads larger than this are read and loaded chunk by chunk, each chunk sized so the
+# worker stays within the memory budget.
+INGESTION_STREAMING_MIN_MB = env.int('INGESTION_STREAMING_MIN_MB', default=100)
+INGESTION_MEMORY_BUDGET_MB = env.int('INGESTION_MEMORY_BUDGET_MB', default=512)
+# Worker processes loading the components of an imported PyPSA network in parallel.
+PYPSA_IMPORT_WORKERS = env.int('PYPSA_IMPORT_WORKERS', default=4)
+
+# Names of the uploads the view tables behind the /api/ endpoints are built from. Their
+# tables are named like every upload: geojson_<name> for the buses (a GeoJSON upload),
+# json_<name> for the others, with __<scenario> appended outside the default scenario.
+MATVIEW_SOURCE_UPLOADS = {
+    'buses': env('MATVIEW_BUSES_UPLOAD', default='buses'),
+    'generators': env('MATVIEW_GENERATORS_UPLOAD', default='generators'),
+    'storage_units': env('MATVIEW_STORAGE_UNITS_UPLOAD', default='storage_units'),
+    'lines': env('MATVIEW_LINES_UPLOAD', default='lines'),
+}
+
+# Polygons used for the region breakdown of /api/capacity/summary, and their key column.
+API_REGIONS_TABLE = env('API_REGIONS_TABLE', default='gadm_shapes')
+API_REGIONS_KEY = env('API_REGIONS_KEY', default='GADM_ID')
+
+# Samples returned by /api/timeseries/ after downsampling, by default and at most.
+TIMESERIES_DEFAULT_POINTS = env.int('TIMESERIES_DEFAULT_POINTS', default=1000)
+TIMESERIES_MAX_POINTS = env.int('TIMESERIES_MAX_POINTS', default=10000)
+
+# Line loading frames: the time series attributes read as p0, in order of preference,
+# and the loading mapped to the top of the 8-bit scale (1.5 = 150% of s_nom_opt).
+LINE_LOADING_ATTRIBUTES = env.list('LINE_LOADING_ATTRIBUTES', default=['p0', 'value'])
+LINE_LOADING_MAX = env.float('LINE_LOADING_MAX', default=1.5)
+
+# Files generated for the FlatGeobuf, GeoParquet and Arrow API exports, written in
+# batches of this many rows.
+EXPORT_DIR = env('EXPORT_DIR', default=os.path.join(BASE_DIR, 'exports'))
+EXPORT_BATCH_ROWS = env.int('EXPORT_BATCH_ROWS', default=50000)
+
+# Caching proxy in front of GeoServer's WMS/WFS, served under /geoserver/<workspace>/.
+# With OWS_PROXY enabled the map requests its layers from this site instead of
+# GEOSERVER_URL; by default it keeps talking to GEOSERVER_URL directly.
+OWS_PROXY = env.bool('OWS_PROXY', default=False)
+OWS_UPSTREAM_URL = env('OWS_UPSTREAM_URL', default=f'{GEOSERVER_URL}/geoserver')
+OWS_TIMEOUT = env.int('OWS_TIMEOUT', default=60)
+# Disk cache of tiles and documents, least recently used entries evicted past the size.
+OWS_CACHE_DIR = env('OWS_CACHE_DIR', default=os.path.join(BASE_DIR, 'ows_cache'))
+OWS_CACHE_MAX_MB = env.int('OWS_CACHE_MAX_MB', default=2048)
+# Seconds after which a worker recounts the cache size written by the other workers.
+OWS_CACHE_SCAN_INTERVAL = env.int('OWS_CACHE_SCAN_INTERVAL', default=300)
+OWS_CACHE_CONTROL = env('OWS_CACHE_CONTROL', default='public, max-age=300')
+# GetMap requests are assembled from tiles of this size, up to OWS_MAX_TILES of them
+# (larger requests go to GeoServer uncached) and at most OWS_MAX_ZOOM levels deep.
+OWS_TILE_SIZE = env.int('OWS_TILE_SIZE', default=256)
+OWS_MAX_TILES = env.int('OWS_MAX_TILES', default=64)
+OWS_MAX_ZOOM = env.int('OWS_MAX_ZOOM', default=22)
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  
 STATICFILES_DIRS = [
@@ -170,3 +269,24 @@ CACHES = {
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
+
+# Response cache for the /api/ endpoints, invalidated whenever data is loaded.
+API_CACHE_ALIAS = "default"
+API_CACHE_TIMEOUT = env.int('API_CACHE_TIMEOUT', default=60 * 60 * 24)
+API_CACHE_COMPRESS_LEVEL = env.int('API_CACHE_COMPRESS_LEVEL', default=6)
+API_CACHE_BROTLI_QUALITY = env.int('API_CACHE_BROTLI_QUALITY', default=9)
+API_CACHE_CONTROL = env('API_CACHE_CONTROL', default='no-cache')
+API_CACHE_LOCK_TIMEOUT = env.int('API_CACHE_LOCK_TIMEOUT', default=60)
+API_CACHE_LOCK_POLL = 0.1
+
+# Request and ingestion metrics served in the Prometheus format at /metrics, kept in
+# the default Redis cache and written there by each process every few seconds.
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=10.0)
+# /metrics answers these addresses or networks (as seen in REMOTE_ADDR, so the proxy's
+# address when Django runs behind one) and requests sending "Authorization: Bearer
+# <METRICS_TOKEN>"; everyone else gets a 403.
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+# Add a Server-Timing header (db, serialization, compression, total) to every response.
+METRICS_SERVER_TIMING = env.bool('METRICS_SERVER_TIMING', default=DEBUG)
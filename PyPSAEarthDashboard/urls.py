@@ -26,10 +26,19 @@ from geojson import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
     path('', index, name='index'),
+    path('api/scenarios/', views.scenarios_json, name='scenarios_json'),
     path('api/line-data/', views.line_data_json, name='line_data_json'),
     path('api/optimal-storage-capacity/', views.optimal_storage_capacity_json, name='optimal_storage_capacity_json'),
     path('api/nominal-storage-capacity/', views.nominal_storage_capacity_json, name='nominal_storage_capacity_json'),
     path('api/optimal-generator-capacity/', views.optimal_generator_capacity_json, name='optimal_generator_capacity_json'),
     path('api/nominal-generator-capacity/', views.nominal_generator_capacity_json, name='nominal_generator_capacity_json'),
+    path('api/capacity/summary', views.capacity_summary_json, name='capacity_summary_json'),
+    path('api/clusters/<str:layer>/', views.capacity_clusters_json, name='capacity_clusters_json'),
+    path('api/timeseries/<str:component>/<str:attribute>/<str:name>/', views.timeseries_json, name='timeseries_json'),
+    path('api/line-loading/', views.line_loading_index_json, name='line_loading_index_json'),
+    path('api/line-loading/<int:position>.bin', views.line_loading_frame, name='line_loading_frame'),
+    path('api/tiles/<str:layer>/<int:z>/<int:x>/<int:y>.pbf', views.vector_tile, name='vector_tile'),
+    path('geoserver/<str:workspace>/<str:service>', views.ows_proxy, name='ows_proxy'),
 ]
@@ -4,12 +4,62 @@
 #
 
 from django.contrib import admin
-from .models import Bus, JSONBus
+from .models import Bus, IngestionJob, JSONBus, PyPSANetwork, enqueue_ingestion
+
+
+def latest_job(kind, instance):
+    return IngestionJob.objects.filter(kind=kind, object_id=instance.pk).first()
+
 
 # Register your models here.
-admin.site.register(Bus)
+@admin.register(Bus)
+class BusAdmin(admin.ModelAdmin):
+    list_display = ['name', 'scenario', 'uploaded_time', 'ingestion_status']
+    list_filter = ['scenario']
+
+    @admin.display(description='Ingestion')
+    def ingestion_status(self, obj):
+        job = latest_job('geojson', obj)
+        return job.get_status_display() if job else '-'
 
 @admin.register(JSONBus)
 class JSONBusAdmin(admin.ModelAdmin):
-    list_display = ['name', 'uploaded_time']
+    list_display = ['name', 'scenario', 'uploaded_time', 'ingestion_status']
+    list_filter = ['scenario']
+    search_fields = ['name']
+
+    @admin.display(description='Ingestion')
+    def ingestion_status(self, obj):
+        job = latest_job('json', obj)
+        return job.get_status_display() if job else '-'
+
+@admin.register(PyPSANetwork)
+class PyPSANetworkAdmin(admin.ModelAdmin):
+    list_display = ['name', 'scenario', 'uploaded_time', 'ingestion_status']
+    list_filter = ['scenario']
+    search_fields = ['name']
+    actions = ['import_networks']
+
+    @admin.display(description='Ingestion')
+    def ingestion_status(self, obj):
+        job = latest_job('pypsa', obj)
+        return job.get_status_display() if job else '-'
+
+    @admin.action(description="Import the selected networks again")
+    def import_networks(self, request, queryset):
+        for network in queryset:
+            enqueue_ingestion('pypsa', network)
+        self.message_user(request, f"Queued the import of {len(queryset)} networks.")
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'kind', 'status', 'progress', 'message', 'created_time', 'duration',
+                    'inserted', 'updated', 'deleted']
+    list_filter = ['status', 'kind']
     search_fields = ['name']
+    readonly_fields = ['kind', 'object_id', 'name', 'status', 'progress', 'message',
+                       'created_time', 'started_time', 'finished_time', 'duration',
+                       'inserted', 'updated', 'deleted']
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+from django.conf import settings
+from django.db import connection
+
+from .filters import QueryParameterError
+from .loader import quote
+from .matviews import relation_kind, source_table
+from .models import (
+  NominalGeneratorCapacity,
+  OptimalGeneratorCapacity,
+  NominalStorageCapacity,
+  OptimalStorageCapacity
+)
+from .scenarios import parse_scenario, scenario_table
+
+# Capacity summaries for the dashboard charts, summed in PostgreSQL so the browser
+# gets one row per group instead of every generator and storage unit.
+GROUP_BY_OPTIONS = ('carrier', 'country', 'bus', 'region')
+KINDS = ('nominal', 'optimal')
+COMPONENTS = ('generator', 'storage', 'statistics')
+DEFAULT_COMPONENTS = ('generator', 'storage')
+
+CAPACITY_MODELS = {
+    ('generator', 'nominal'): (NominalGeneratorCapacity, 'p_nom'),
+    ('generator', 'optimal'): (OptimalGeneratorCapacity, 'p_nom_opt'),
+    ('storage', 'nominal'): (NominalStorageCapacity, 'p_nom'),
+    ('storage', 'optimal'): (OptimalStorageCapacity, 'p_nom_opt'),
+}
+STATISTICS_COLUMNS = {
+    'nominal': 'Installed Capacity',
+    'optimal': 'Optimal Capacity',
+}
+
+#########################################################################################
+# Query parameters
+#########################################################################################
+
+def parse_list(request, name, options, default):
+    values = [value.strip() for value in request.GET.get(name, '').split(',') if value.strip()]
+    unknown = [value for value in values if value not in options]
+    if unknown:
+        raise QueryParameterError(f"Unknown {name} '{', '.join(unknown)}', expected {', '.join(options)}.")
+    # Keep the order given by the client but drop repeated values.
+    return list(dict.fromkeys(values)) or list(default)
+
+
+def parse_kind(request):
+    kind = request.GET.get('kind') or 'nominal'
+    if kind not in KINDS:
+        raise QueryParameterError(f"Unknown kind '{kind}', expected {' or '.join(KINDS)}.")
+    return kind
+
+#########################################################################################
+# Aggregation queries
+#########################################################################################
+
+def region_join():
+    # Each point is assigned to the first region polygon containing it, through the
+    # GiST index on the regions table.
+    return f"""
+    LEFT JOIN LATERAL (
+        SELECT r.{quote(settings.API_REGIONS_KEY)}::text AS region
+        FROM public.{quote(settings.API_REGIONS_TABLE)} r
+        WHERE ST_Intersects(r.geom, v.geom)
+        LIMIT 1
+    ) r ON true
+    """
+
+
+def component_sql(component, kind, group_by, scenario):
+    model, capacity = CAPACITY_MODELS[(component, kind)]
+    columns = {
+        'carrier': 'v.carrier',
+        'country': 'v.country',
+        'bus': 'v."Bus"',
+        'region': 'r.region',
+    }
+    joins = ''
+    if component == 'storage' and 'country' in group_by:
+        # Storage units carry no country, it comes from their bus.
+        buses = quote(source_table('buses', scenario))
+        joins += f' LEFT JOIN public.{buses} b ON b."Bus" = v."Bus"'
+        columns['country'] = 'b.country'
+    if 'region' in group_by:
+        joins += region_join()
+
+    select = ', '.join(f'{columns[name]} AS {name}' for name in group_by)
+    group = ', '.join(columns[name] for name in group_by)
+    return f"""
+    SELECT {select}, sum(v.{capacity})::double precision AS capacity, count(*) AS count
+    FROM public.{model._meta.db_table} v {joins}
+    WHERE v.scenario = %s
+    GROUP BY {group}
+    ORDER BY {group}
+    """
+
+
+def statistics_sql(kind, scenario):
+    return f"""
+    SELECT t.name AS carrier, sum(s.{quote(STATISTICS_COLUMNS[kind])})::double precision AS capacity,
+           count(*) AS count
+    FROM public.{quote(scenario_table('statistics_json', scenario))} s
+    JOIN public.generator_types t ON t.id = s."Generator Type"
+    GROUP BY t.name
+    ORDER BY t.name
+    """
+
+
+def required_tables(component, group_by, scenario):
+    # Tables a query reads besides the view tables, which may not have been loaded.
+    tables = []
+    if component == 'statistics':
+        tables += [scenario_table('statistics_json', scenario), 'generator_types']
+    elif component == 'storage' and 'country' in group_by:
+        tables.append(source_table('buses', scenario))
+    if 'region' in group_by:
+        tables.append(settings.API_REGIONS_TABLE)
+    return tables
+
+
+def check_tables(components, group_by, scenario):
+    with connection.cursor() as cursor:
+        for component in components:
+            missing = [table for table in required_tables(component, group_by, scenario)
+                       if relation_kind(cursor, table) is None]
+            if missing:
+                raise QueryParameterError(
+                    f"The {component} summary by {', '.join(group_by)} is not available for scenario "
+                    f"'{scenario}', {', '.join(missing)} {'is' if len(missing) == 1 else 'are'} not loaded."
+                )
+
+
+def fetch_rows(sql, component, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row), component=component) for row in cursor.fetchall()]
+
+
+def capacity_summary(request):
+    group_by = parse_list(request, 'group_by', GROUP_BY_OPTIONS, ('carrier',))
+    kind = parse_kind(request)
+    scenario = parse_scenario(request)
+    components = parse_list(request, 'component', COMPONENTS, DEFAULT_COMPONENTS)
+    if 'statistics' in components and group_by != ['carrier']:
+        raise QueryParameterError("The statistics component can only be grouped by carrier.")
+
+    check_tables(components, group_by, scenario)
+    results = []
+    for component in components:
+        if component == 'statistics':
+            results += fetch_rows(statistics_sql(kind, scenario), component)
+        else:
+            results += fetch_rows(component_sql(component, kind, group_by, scenario), component, [scenario])
+    return {'scenario': scenario, 'kind': kind, 'group_by': group_by, 'results': results}
@@ -0,0 +1,456 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .cache import bump_dataset_version
+from .ingestion import run_job
+from .models import Bus, IngestionJob, JSONBus
+from .scenarios import drop_scenario
+
+logger = logging.getLogger(__name__)
+
+# Synthetic PyPSA networks for `manage.py benchmark`, sized by their number of buses.
+# Lines, generators and storage units scale with the buses like in a PyPSA-Earth model.
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+LINES_PER_BUS = 1.5
+GENERATORS_PER_BUS = 2
+STORAGE_UNITS_PER_BUS = 0.5
+CARRIERS = ('solar', 'onwind', 'offwind-ac', 'ror', 'hydro', 'CCGT', 'OCGT', 'coal', 'oil', 'nuclear')
+STORAGE_CARRIERS = ('battery', 'H2', 'PHS')
+COUNTRIES = ('NG', 'ZA', 'EG', 'KE', 'MA', 'ET', 'GH', 'TZ', 'DZ', 'AO')
+# Buses are scattered over Africa, (minx, miny, maxx, maxy).
+EXTENT = (-18.0, -35.0, 52.0, 37.0)
+
+# Upload names of the synthetic network, their tables become the view sources for
+# the duration of the benchmark. Everything is loaded into its own scenario, so the
+# partitions of the real networks are left untouched.
+BENCHMARK_SCENARIO = 'benchmark'
+UPLOAD_NAMES = {
+    'buses': 'bench_buses',
+    'generators': 'bench_generators',
+    'storage_units': 'bench_storage_units',
+    'lines': 'bench_lines',
+}
+SERIES_NAME = 'lines_t_p0'
+KEY_FIELDS = {'buses': 'Bus', 'generators': 'id', 'storage_units': 'id', 'lines': 'name'}
+
+#########################################################################################
+# Synthetic networks
+#########################################################################################
+
+def generate_network(buses, seed=0):
+    # Returns GeoDataFrame/DataFrames with the columns the view tables read.
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(EXTENT[0], EXTENT[2], buses)
+    y = rng.uniform(EXTENT[1], EXTENT[3], buses)
+    names = np.char.add('B', np.arange(buses).astype(str))
+    bus_df = gpd.GeoDataFrame({
+        'Bus': names,
+        'v_nom': rng.choice([132.0, 220.0, 380.0, 400.0], buses),
+        'country': rng.choice(COUNTRIES, buses),
+        'x': x,
+        'y': y,
+        'control': 'PQ',
+        'generator': '',
+        'type': '',
+        'unit': '',
+        'v_mag_pu_set': 1.0,
+        'v_mag_pu_min': 0.0,
+        'sub_network': rng.integers(0, 10, buses).astype(str),
+    }, geometry=gpd.points_from_xy(x, y), crs='EPSG:4326')
+
+    # Lines join buses that are close in x, so that they are short like real ones.
+    count = int(buses * LINES_PER_BUS)
+    order = np.argsort(x)
+    start = rng.integers(0, buses - 1, count)
+    end = np.minimum(start + rng.integers(1, 10, count), buses - 1)
+    s_nom = rng.uniform(100, 3000, count)
+    lines = pd.DataFrame({
+        'name': np.char.add('L', np.arange(count).astype(str)),
+        'bus0': names[order[start]],
+        'bus1': names[order[end]],
+        'length': rng.uniform(1, 500, count),
+        'num_parallel': rng.integers(1, 4, count).astype(float),
+        'carrier': 'AC',
+        'type': 'Al/St 240/40 4-bundle 380.0',
+        's_max_pu': 0.7,
+        's_nom': s_nom,
+        'capital_cost': rng.uniform(10, 100, count),
+        's_nom_extendable': rng.random(count) < 0.5,
+        's_nom_min': 0.0,
+        'x': rng.uniform(0.01, 10, count),
+        'r': rng.uniform(0.01, 5, count),
+        'b': rng.uniform(0, 0.001, count),
+        'build_year': 2020,
+        'x_pu_eff': rng.uniform(0, 0.01, count),
+        'r_pu_eff': rng.uniform(0, 0.01, count),
+        's_nom_opt': s_nom * rng.uniform(1, 2, count),
+        'v_nom': 380.0,
+        'g': 0.0,
+        's_nom_max': np.nan,
+        'lifetime': np.nan,
+        'terrain_factor': 1.0,
+        'v_ang_min': np.nan,
+        'v_ang_max': np.nan,
+        'sub_network': '0',
+        'x_pu': rng.uniform(0, 0.01, count),
+        'r_pu': rng.uniform(0, 0.01, count),
+        'g_pu': 0.0,
+        'b_pu': rng.uniform(0, 0.01, count),
+    })
+
+    count = int(buses * GENERATORS_PER_BUS)
+    p_nom = rng.exponential(100, count)
+    generators = pd.DataFrame({
+        'id': np.char.add('G', np.arange(count).astype(str)),
+        'bus': names[rng.integers(0, buses, count)],
+        'carrier': rng.choice(CARRIERS, count),
+        'p_nom': p_nom,
+        'p_nom_opt': p_nom * rng.uniform(1, 3, count),
+    })
+
+    count = int(buses * STORAGE_UNITS_PER_BUS)
+    p_nom = rng.exponential(50, count)
+    storage_units = pd.DataFrame({
+        'id': np.char.add('S', np.arange(count).astype(str)),
+        'bus': names[rng.integers(0, buses, count)],
+        'carrier': rng.choice(STORAGE_CARRIERS, count),
+        'p_nom': p_nom,
+        'p_nom_opt': p_nom * rng.uniform(1, 3, count),
+    })
+    return {'buses': bus_df, 'generators': generators, 'storage_units': storage_units, 'lines': lines}
+
+
+def generate_line_p0(lines, snapshots, seed=0):
+    # Hourly p0 of every line, named like the line.
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    capacity = lines['s_nom_opt'].to_numpy(dtype=np.float32)
+    hours = np.arange(snapshots, dtype=np.float32)[:, None]
+    loading = 0.5 + 0.4 * np.sin(hours / 24 * 2 * np.pi + rng.uniform(0, 2 * np.pi, len(lines)))
+    return pd.DataFrame(
+        loading * capacity,
+        index=pd.date_range('2013-01-01', periods=snapshots, freq='h'),
+        columns=lines['name'],
+    )
+
+
+def write_network(network, p0, directory):
+    # Files in the formats the admin uploads take: GeoJSON for the buses, pandas
+    # 'split' JSON for the other components and the time series.
+    os.makedirs(directory, exist_ok=True)
+    paths = {'buses': os.path.join(directory, 'buses.geojson')}
+    network['buses'].to_file(paths['buses'], driver='GeoJSON')
+    for kind in ('generators', 'storage_units', 'lines'):
+        paths[kind] = os.path.join(directory, f'{kind}.json')
+        network[kind].to_json(paths[kind], orient='split', index=False)
+    paths[SERIES_NAME] = os.path.join(directory, f'{SERIES_NAME}.json')
+    p0.to_json(paths[SERIES_NAME], orient='split', date_format='iso')
+    return paths
+
+
+def modify_network(network, fraction, seed=1):
+    # A copy with a fraction of the rows changed, for the incremental ingestion path.
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    changed = {}
+    for kind, df in network.items():
+        df = df.copy()
+        rows = rng.choice(len(df), max(1, int(len(df) * fraction)), replace=False)
+        column = 'v_nom' if kind in ('buses', 'lines') else 'p_nom_opt'
+        df.iloc[rows, df.columns.get_loc(column)] *= 1.1
+        changed[kind] = df
+    return changed
+
+#########################################################################################
+# Measurements
+#########################################################################################
+
+def reset_peak_rss():
+    # Linux resets VmHWM on writing 5 to clear_refs; elsewhere the peak only grows.
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / 1024 / 1024 if platform.system() == 'Darwin' else peak / 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def latency_stats(seconds):
+    total = sum(seconds)
+    return {
+        'requests': len(seconds),
+        'p50_ms': percentile(seconds, 50) * 1000,
+        'p95_ms': percentile(seconds, 95) * 1000,
+        'p99_ms': percentile(seconds, 99) * 1000,
+        'max_ms': max(seconds) * 1000,
+        'throughput_rps': len(seconds) / total if total else None,
+    }
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+#########################################################################################
+# Ingestion paths
+#########################################################################################
+
+def upload(kind, name, path, key_field=''):
+    # Saves the upload like the admin does and runs the job it queues in this process.
+    model, field = (Bus, 'geojson_file') if kind == 'buses' else (JSONBus, 'json_file')
+    with open(path, 'rb') as file:
+        instance = model(name=name, key_field=key_field, scenario=BENCHMARK_SCENARIO)
+        getattr(instance, field).save(os.path.basename(path), File(file), save=False)
+        instance.save()
+    job = IngestionJob.objects.filter(object_id=instance.pk, name=name).first()
+    reset_peak_rss()
+    with CaptureQueriesContext(connection) as queries:
+        run_job(job)
+    if job.status != IngestionJob.DONE:
+        raise RuntimeError(f"Ingestion of '{name}' failed: {job.message}")
+    rows = (job.inserted or 0) + (job.updated or 0) + (job.deleted or 0)
+    return {
+        'seconds': job.duration,
+        'rows': rows,
+        'rows_per_second': rows / job.duration if job.duration else None,
+        'inserted': job.inserted,
+        'updated': job.updated,
+        'deleted': job.deleted,
+        'file_mb': os.path.getsize(path) / 1024 / 1024,
+        'peak_rss_mb': peak_rss_mb(),
+        'queries': len(queries),
+    }
+
+
+def remove_uploads():
+    # Deleting the instances drops their tables through the post_delete signals, and
+    # the partitions built from them are dropped with the scenario.
+    drop_scenario(BENCHMARK_SCENARIO)
+    for instance in [*Bus.objects.filter(name__startswith='bench_'),
+                     *JSONBus.objects.filter(name__startswith='bench_')]:
+        instance.delete()
+    IngestionJob.objects.filter(name__startswith='bench_').delete()
+
+
+def run_ingestion(paths, modified_paths):
+    results = {}
+    # Buses first, the views are refreshed once every source table exists.
+    for kind in ('buses', 'generators', 'storage_units', 'lines'):
+        results[f'{kind}-replace'] = upload(kind, UPLOAD_NAMES[kind], paths[kind])
+    # The same files again through the streaming readers, then the changed rows applied
+    # in place by key. Both read the same way so that the table definitions match.
+    with override_settings(INGESTION_STREAMING_MIN_MB=0):
+        for kind in ('buses', 'lines'):
+            results[f'{kind}-streaming'] = upload(kind, UPLOAD_NAMES[kind], paths[kind])
+        for kind in ('buses', 'lines'):
+            results[f'{kind}-upsert'] = upload(kind, UPLOAD_NAMES[kind], modified_paths[kind],
+                                               key_field=KEY_FIELDS[kind])
+    results['timeseries'] = upload(SERIES_NAME, SERIES_NAME, paths[SERIES_NAME])
+    return results
+
+#########################################################################################
+# API endpoints
+#########################################################################################
+
+def endpoint_requests():
+    # (name, url) of the requests driven for each endpoint, covering the filters and
+    # output formats of the /api/ list endpoints.
+    viewport = 'bbox=2,4,15,14&zoom=6'
+    scenario = f'scenario={BENCHMARK_SCENARIO}'
+    requests = []
+    for endpoint in ('line-data', 'nominal-generator-capacity', 'optimal-generator-capacity',
+                     'nominal-storage-capacity', 'optimal-storage-capacity'):
+        requests += [
+            (f'{endpoint}', f'/api/{endpoint}/?limit=1000'),
+            (f'{endpoint}-viewport', f'/api/{endpoint}/?{viewport}&limit=10000'),
+            (f'{endpoint}-geojson', f'/api/{endpoint}/?format=geojson&limit=1000'),
+        ]
+    requests += [
+        ('line-data-lod', '/api/line-data/?zoom=3&limit=10000'),
+        ('line-data-filtered', '/api/line-data/?carrier=AC&v_nom_min=300&limit=1000'),
+        ('line-data-flatgeobuf', '/api/line-data/?format=flatgeobuf'),
+        ('line-data-geoparquet', '/api/line-data/?format=geoparquet'),
+        ('capacity-summary', '/api/capacity/summary?group_by=carrier,country'),
+        ('clusters', '/api/clusters/nominal-generator-capacity/?zoom=4'),
+        ('clusters-points', '/api/clusters/nominal-generator-capacity/?zoom=12&bbox=2,4,3,5'),
+        ('tiles-lines', '/api/tiles/lines/4/8/7.pbf'),
+        ('tiles-generators', '/api/tiles/nominal-generator-capacity/6/33/31.pbf'),
+        ('timeseries', '/api/timeseries/lines/p0/L0/?points=500'),
+        ('line-loading-index', '/api/line-loading/'),
+        ('line-loading-frame', '/api/line-loading/0.bin'),
+    ]
+    return [(name, f"{url}{'&' if '?' in url else '?'}{scenario}") for name, url in requests]
+
+
+def measure_endpoint(client, url, repeat):
+    # Cold requests start from an invalidated response cache, warm ones are served
+    # from it; the query count and payload are those of a cold request.
+    cold = []
+    for _ in range(repeat):
+        bump_dataset_version(BENCHMARK_SCENARIO)
+        reset_peak_rss()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            size = response_size(response)
+            cold.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}: {response.content[:200]!r}")
+    rss = peak_rss_mb()
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response_size(client.get(url))
+        warm.append(time.perf_counter() - start)
+    return {
+        'cold': latency_stats(cold),
+        'warm': latency_stats(warm),
+        'queries': len(queries),
+        'payload_bytes': size,
+        'peak_rss_mb': rss,
+    }
+
+
+def run_endpoints(repeat):
+    client = Client()
+    return {name: measure_endpoint(client, url, repeat) for name, url in endpoint_requests()}
+
+#########################################################################################
+# Reports
+#########################################################################################
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(scale, directory, repeat=5, snapshots=168, seed=0):
+    buses = SCALES[scale]
+    logger.info(f"Benchmark {scale}: generating {buses} buses")
+    start = time.monotonic()
+    network = generate_network(buses, seed)
+    p0 = generate_line_p0(network['lines'], snapshots, seed)
+    paths = write_network(network, p0, os.path.join(directory, scale))
+    modified_paths = write_network(modify_network(network, 0.01, seed + 1), p0,
+                                   os.path.join(directory, f'{scale}-modified'))
+    generated = time.monotonic() - start
+    counts = {kind: len(df) for kind, df in network.items()}
+    del network, p0
+
+    with override_settings(MATVIEW_SOURCE_UPLOADS=UPLOAD_NAMES, INGESTION_ASYNC=True, GEOSERVER_PUBLISH=False):
+        remove_uploads()
+        ingestion = run_ingestion(paths, modified_paths)
+        endpoints = run_endpoints(repeat)
+    return {
+        'scale': scale,
+        'counts': counts,
+        'snapshots': snapshots,
+        'repeat': repeat,
+        'generate_seconds': generated,
+        'ingestion': ingestion,
+        'endpoints': endpoints,
+    }
+
+
+def build_report(results):
+    return {
+        'created': timezone.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'scales': {result['scale']: result for result in results},
+    }
+
+
+# Metrics compared against a baseline, lower is better for all of them.
+COMPARED_METRICS = {
+    'ingestion': ('seconds', 'peak_rss_mb', 'queries'),
+    'endpoints': ('cold.p50_ms', 'cold.p95_ms', 'warm.p50_ms', 'queries', 'payload_bytes', 'peak_rss_mb'),
+}
+
+
+def metric(values, path):
+    for part in path.split('.'):
+        values = (values or {}).get(part)
+    return values
+
+
+def compare_reports(report, baseline, threshold):
+    # Returns (path, baseline, current, relative change) for every metric that grew
+    # by more than the threshold, e.g. 0.2 for 20%.
+    regressions = []
+    for scale, result in report['scales'].items():
+        base = baseline.get('scales', {}).get(scale)
+        if base is None:
+            continue
+        for section, metrics in COMPARED_METRICS.items():
+            for name, values in result[section].items():
+                for path in metrics:
+                    current, previous = metric(values, path), metric(base[section].get(name), path)
+                    if current is None or not previous:
+                        continue
+                    change = (current - previous) / previous
+                    if change > threshold:
+                        regressions.append((f'{scale}.{section}.{name}.{path}', previous, current, change))
+    return regressions
+
+
+def write_report(report, path):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def read_report(path):
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import gzip
+import hashlib
+import logging
+import re
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+
+from .metrics import phase
+from .responses import parse_format, wants_stream
+from .scenarios import DEFAULT_SCENARIO, parse_scenario
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are then only precompressed as gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DATASET_VERSION_KEY = 'geojson:dataset-version'
+DATASET_MODIFIED_KEY = 'geojson:dataset-modified'
+# Response headers kept with a cache entry, e.g. the pagination cursor.
+CACHED_HEADERS = ('X-Next-After', 'Link', 'X-Snapshot')
+
+def api_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+#########################################################################################
+# Dataset version
+#########################################################################################
+
+# Every cached response is keyed by the current dataset version of its scenario, so
+# bumping the version after an ingestion invalidates all the responses of that
+# scenario at once without a key scan, and leaves the other scenarios cached. The
+# version also drives the ETag and Last-Modified headers of the API responses.
+# Responses that span every scenario (the scenario list) use the ALL_SCENARIOS state,
+# which every bump advances as well.
+ALL_SCENARIOS = '*'
+
+
+def dataset_keys(scenario):
+    return f'{DATASET_VERSION_KEY}:{scenario}', f'{DATASET_MODIFIED_KEY}:{scenario}'
+
+
+def get_dataset_state(scenario=DEFAULT_SCENARIO):
+    # One round trip per request, the counters are only started when missing.
+    cache = api_cache()
+    version_key, modified_key = keys = dataset_keys(scenario)
+    state = cache.get_many(keys)
+    now = int(time.time())
+    if len(state) < len(keys):
+        # add() keeps the value of a worker that started them first.
+        cache.add(version_key, 1, timeout=None)
+        cache.add(modified_key, now, timeout=None)
+        state = cache.get_many(keys)
+    return state.get(version_key, 1), state.get(modified_key, now)
+
+
+def get_dataset_version(scenario=DEFAULT_SCENARIO):
+    return get_dataset_state(scenario)[0]
+
+
+def bump_dataset_version(scenario=DEFAULT_SCENARIO):
+    cache = api_cache()
+    now = int(time.time())
+    try:
+        versions = {}
+        for name in (scenario, ALL_SCENARIOS):
+            version_key, modified_key = dataset_keys(name)
+            try:
+                versions[name] = cache.incr(version_key)
+            except ValueError:
+                # The counter is missing (e.g. Redis was flushed), start a new one.
+                versions[name] = now
+                cache.set(version_key, now, timeout=None)
+            cache.set(modified_key, now, timeout=None)
+        logger.info(f"API dataset version of scenario '{scenario}' bumped to {versions[scenario]}")
+        return versions[scenario]
+    except Exception as e:
+        logger.error(f"Error invalidating the API cache of scenario '{scenario}': {e}")
+
+#########################################################################################
+# Conditional requests
+#########################################################################################
+
+def query_digest(request):
+    # The negotiated format is part of the key, the same URL can be requested with
+    # different Accept headers. The path tells apart the layers of one endpoint.
+    query = sorted(request.GET.lists())
+    return hashlib.sha1(repr((request.path, query, parse_format(request))).encode()).hexdigest()
+
+
+def make_etag(endpoint, version, digest):
+    return f'"{endpoint}-{version}-{digest[:16]}"'
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        # Compressed variants carry a suffix, they all stand for the same data.
+        tags = re.findall(r'"[^"]*"', if_none_match)
+        return if_none_match.strip() == '*' or any(
+            re.sub(r'-(gzip|br)"$', '"', tag) == etag for tag in tags
+        )
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = settings.API_CACHE_CONTROL
+    return response
+
+
+def validated(response, etag, last_modified):
+    if response.status_code in (200, 206):
+        set_validators(response, etag, last_modified)
+    response['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+#########################################################################################
+# Precompressed response cache
+#########################################################################################
+
+def accepted_encodings(request):
+    accept = request.headers.get('Accept-Encoding', '')
+    encodings = set()
+    for part in accept.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+def compress_response(response):
+    # Bodies are compressed once when the entry is built and served as-is afterwards.
+    content = response.content
+    with phase('compression'):
+        entry = {
+            'content_type': response['Content-Type'],
+            'gzip': gzip.compress(content, compresslevel=settings.API_CACHE_COMPRESS_LEVEL),
+            'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+        }
+        if brotli is not None:
+            entry['br'] = brotli.compress(content, quality=settings.API_CACHE_BROTLI_QUALITY)
+    return entry
+
+
+def cached_response(request, entry, etag, last_modified):
+    encodings = accepted_encodings(request)
+    if 'br' in entry and 'br' in encodings:
+        encoding = 'br'
+    elif 'gzip' in encodings:
+        encoding = 'gzip'
+    else:
+        encoding = None
+
+    if encoding:
+        response = HttpResponse(entry[encoding], content_type=entry['content_type'])
+        response['Content-Encoding'] = encoding
+        etag = f'{etag[:-1]}-{encoding}"'
+    else:
+        response = HttpResponse(gzip.decompress(entry['gzip']), content_type=entry['content_type'])
+    for name, value in entry.get('headers', {}).items():
+        response[name] = value
+    response['Vary'] = 'Accept, Accept-Encoding'
+    return set_validators(response, etag, last_modified)
+
+
+def wait_for_entry(cache, key, lock_key):
+    # Another worker is already building this response, poll for its result
+    # rather than sending the same expensive query to PostgreSQL.
+    deadline = time.monotonic() + settings.API_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.API_CACHE_LOCK_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            break
+    return None
+
+
+def cached_api_response(view=None, scoped=True):
+    # Responses of one scenario are validated against its dataset state, those of
+    # views declared with scoped=False against the state of all scenarios.
+    if view is None:
+        return partial(cached_api_response, scoped=scoped)
+    endpoint = view.__name__
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        scenario = parse_scenario(request) if scoped else ALL_SCENARIOS
+        version, last_modified = get_dataset_state(scenario)
+        digest = query_digest(request)
+        etag = make_etag(endpoint, version, digest)
+        # A 304 is only sent for parameters the view has accepted: those it answered
+        # with an entry in the cache, or once it has run. Invalid parameters get
+        # their 400 even when the client's validators match.
+        conditional = not_modified(request, etag, last_modified)
+        unchanged = lambda: set_validators(HttpResponseNotModified(), etag, last_modified)
+
+        def uncached(response):
+            if conditional and response.status_code == 200:
+                response.close()
+                return unchanged()
+            return validated(response, etag, last_modified)
+
+        # Streamed responses are meant for payloads too large to hold in memory.
+        if wants_stream(request):
+            return uncached(view(request, *args, **kwargs))
+
+        cache = api_cache()
+        key = f'geojson:api:{scenario}:{version}:{endpoint}:{digest}'
+        if conditional and cache.has_key(key):
+            return unchanged()
+        entry = None if conditional else cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry, etag, last_modified)
+
+        # Single-flight: only the worker holding the lock queries the database.
+        lock_key = f'{key}:lock'
+        locked = cache.add(lock_key, 1, timeout=settings.API_CACHE_LOCK_TIMEOUT)
+        if not locked:
+            entry = wait_for_entry(cache, key, lock_key)
+            if entry is not None:
+                return unchanged() if conditional else cached_response(request, entry, etag, last_modified)
+
+        try:
+            response = view(request, *args, **kwargs)
+            # Export files are streamed or served by range, they are cached on disk.
+            if response.status_code != 200 or response.streaming:
+                return uncached(response)
+            entry = compress_response(response)
+            cache.set(key, entry, timeout=settings.API_CACHE_TIMEOUT)
+            return unchanged() if conditional else cached_response(request, entry, etag, last_modified)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    return wrapper
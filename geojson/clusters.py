@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse
+
+from .filters import QueryParameterError, parse_bbox, parse_zoom
+from .responses import GEOJSON_CONTENT_TYPE
+from .scenarios import DEFAULT_SCENARIO, ensure_partition, parse_scenario
+from .tiles import TILE_LAYERS
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_TABLE = 'capacity_clusters'
+# Capacity column summed per cluster for each point layer of the tile endpoint.
+CLUSTER_LAYERS = {
+    'nominal-generator-capacity': 'p_nom',
+    'optimal-generator-capacity': 'p_nom_opt',
+    'nominal-storage-capacity': 'p_nom',
+    'optimal-storage-capacity': 'p_nom_opt',
+}
+
+#########################################################################################
+# Zoom bands
+#########################################################################################
+
+# settings.CLUSTER_ZOOM_LEVELS is a list of (max_zoom, grid_size) pairs ordered by
+# zoom, the grid size in degrees. The position of a pair is its band number in the
+# cluster table, zoom levels above the last pair get the individual points.
+def cluster_band_for_zoom(zoom):
+    for band, (max_zoom, grid_size) in enumerate(settings.CLUSTER_ZOOM_LEVELS):
+        if zoom <= max_zoom:
+            return band
+    return None
+
+#########################################################################################
+# Cluster rebuild
+#########################################################################################
+
+def cluster_sql(table, partition, capacity):
+    # Points are binned into grid cells of the band; each cell becomes one cluster at
+    # the centroid of its points, with its total capacity and a per-carrier breakdown.
+    return f"""
+    WITH cells AS (
+        SELECT floor(ST_X(geom) / %(grid)s)::bigint AS cx, floor(ST_Y(geom) / %(grid)s)::bigint AS cy,
+               geom, carrier, {capacity} AS capacity
+        FROM public.{table}
+        WHERE scenario = %(scenario)s AND geom IS NOT NULL
+    ),
+    carriers AS (
+        SELECT cx, cy, jsonb_object_agg(COALESCE(carrier, ''), capacity) AS carriers
+        FROM (
+            SELECT cx, cy, carrier, sum(capacity) AS capacity
+            FROM cells
+            GROUP BY cx, cy, carrier
+        ) per_carrier
+        GROUP BY cx, cy
+    ),
+    totals AS (
+        SELECT cx, cy, ST_Centroid(ST_Collect(geom)) AS geom, sum(capacity) AS capacity, count(*) AS count
+        FROM cells
+        GROUP BY cx, cy
+    )
+    INSERT INTO public.{partition} (scenario, layer, band, cluster, geom, capacity, count, carriers)
+    SELECT %(scenario)s, %(layer)s, %(band)s, row_number() OVER (ORDER BY cx, cy), t.geom, t.capacity, t.count, c.carriers
+    FROM totals t
+    JOIN carriers c USING (cx, cy)
+    """
+
+
+def rebuild_capacity_clusters(scenario=DEFAULT_SCENARIO):
+    # Like the line LODs, all clusters of the scenario are replaced in one transaction
+    # so readers see either the old or the new set.
+    start = time.monotonic()
+    with transaction.atomic(), connection.cursor() as cursor:
+        partition = ensure_partition(cursor, CLUSTER_TABLE, scenario)
+        cursor.execute(f'DELETE FROM public.{partition}')
+        for layer, capacity in CLUSTER_LAYERS.items():
+            table = TILE_LAYERS[layer]['table']
+            cursor.execute("SELECT to_regclass(%s)", [f'public.{table}'])
+            if cursor.fetchone()[0] is None:
+                logger.warning(f"Skipping clusters of '{layer}', {table} does not exist.")
+                continue
+            for band, (max_zoom, grid_size) in enumerate(settings.CLUSTER_ZOOM_LEVELS):
+                cursor.execute(cluster_sql(table, partition, capacity),
+                               {'grid': grid_size, 'layer': layer, 'band': band, 'scenario': scenario})
+        cursor.execute(f'ANALYZE public.{partition}')
+    logger.info(f"Rebuilt capacity clusters of scenario '{scenario}' in {time.monotonic() - start:.2f}s")
+
+#########################################################################################
+# Cluster responses
+#########################################################################################
+
+def bbox_condition(request):
+    bbox = parse_bbox(request)
+    if bbox is None:
+        return '', []
+    return 'AND geom && ST_Transform(ST_GeomFromEWKT(%s), 4326)', [bbox.ewkt]
+
+
+def clusters_sql(layer, band, scenario, condition):
+    if band is not None:
+        return f"""
+        SELECT geom, capacity, count, carriers
+        FROM public.{CLUSTER_TABLE}
+        WHERE scenario = %s AND layer = %s AND band = %s {condition}
+        """, [scenario, layer, band]
+    # Past the last band every point is its own cluster.
+    table = TILE_LAYERS[layer]['table']
+    capacity = CLUSTER_LAYERS[layer]
+    return f"""
+    SELECT geom, {capacity} AS capacity, 1 AS count,
+           jsonb_build_object(COALESCE(carrier, ''), {capacity}) AS carriers
+    FROM public.{table}
+    WHERE scenario = %s AND geom IS NOT NULL {condition}
+    """, [scenario]
+
+
+def clusters_response(request, layer):
+    zoom = parse_zoom(request)
+    if zoom is None:
+        raise QueryParameterError("The zoom parameter is required.")
+    condition, bbox_params = bbox_condition(request)
+    sql, params = clusters_sql(layer, cluster_band_for_zoom(zoom), parse_scenario(request), condition)
+    collection_sql = f"""
+        SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', COALESCE(json_agg(ST_AsGeoJSON(c.*, 'geom')::json), '[]'::json)
+        )::text
+        FROM ({sql}) c
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(collection_sql, [*params, *bbox_params])
+        collection = cursor.fetchone()[0]
+    return HttpResponse(collection, content_type=GEOJSON_CONTENT_TYPE)
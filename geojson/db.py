@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# One engine per process: a forked worker must not share pooled sockets with its parent.
+_engines = {}
+_stats = {}
+_lock = threading.Lock()
+
+#########################################################################################
+# Pool statistics
+#########################################################################################
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.held_seconds = 0.0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def as_dict(self, pool):
+        with self.lock:
+            return {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'max_wait_seconds': round(self.max_wait_seconds, 3),
+                'held_seconds': round(self.held_seconds, 3),
+            }
+
+
+def listen_pool_events(engine, stats):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        with stats.lock:
+            stats.connects += 1
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checkout_time'] = time.monotonic()
+        with stats.lock:
+            stats.checkouts += 1
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        checkout_time = connection_record.info.pop('checkout_time', None)
+        with stats.lock:
+            stats.checkins += 1
+            if checkout_time is not None:
+                stats.held_seconds += time.monotonic() - checkout_time
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with stats.lock:
+            stats.invalidations += 1
+
+#########################################################################################
+# Shared engine
+#########################################################################################
+
+def get_engine():
+    pid = os.getpid()
+    engine = _engines.get(pid)
+    if engine is not None:
+        return engine
+    from sqlalchemy import create_engine
+
+    with _lock:
+        if pid not in _engines:
+            engine = create_engine(
+                settings.SQLALCHEMY_DATABASE_URL,
+                pool_size=settings.DB_POOL_SIZE,
+                max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+                pool_timeout=settings.DB_POOL_TIMEOUT,
+                pool_pre_ping=True,
+            )
+            _stats[pid] = PoolStats()
+            listen_pool_events(engine, _stats[pid])
+            _engines[pid] = engine
+        return _engines[pid]
+
+
+def raw_connection():
+    # Checking out a connection waits when the pool and its overflow are exhausted,
+    # the time spent there is what tells whether DB_POOL_SIZE is too small.
+    engine = get_engine()
+    start = time.monotonic()
+    connection = engine.raw_connection()
+    _stats[os.getpid()].record_wait(time.monotonic() - start)
+    return connection
+
+
+def has_engine():
+    return os.getpid() in _engines
+
+
+def pool_stats():
+    engine = get_engine()
+    return _stats[os.getpid()].as_dict(engine.pool)
+
+
+def log_pool_stats():
+    stats = pool_stats()
+    logger.info("Database pool: " + ", ".join(f"{name}={value}" for name, value in stats.items()))
+    return stats
@@ -0,0 +1,210 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsWKB
+from django.http import FileResponse, HttpResponse
+
+from .metrics import phase
+from .scenarios import parse_scenario
+
+logger = logging.getLogger(__name__)
+
+# Binary export formats, served from files so that clients can memory-map them or
+# read parts of them with HTTP range requests (e.g. a FlatGeobuf viewport query
+# through its packed R-tree).
+EXPORT_FORMATS = {
+    'flatgeobuf': {'content_type': 'application/flatgeobuf', 'extension': 'fgb'},
+    'geoparquet': {'content_type': 'application/vnd.apache.parquet', 'extension': 'parquet'},
+    'arrow': {'content_type': 'application/vnd.apache.arrow.file', 'extension': 'arrow'},
+}
+
+#########################################################################################
+# Export writers
+#########################################################################################
+
+# Arrow types of the model fields, the other fields are exported as strings.
+ARROW_TYPES = {
+    'BooleanField': 'bool_',
+    'SmallIntegerField': 'int64',
+    'IntegerField': 'int64',
+    'BigIntegerField': 'int64',
+    'FloatField': 'float64',
+}
+# GeoParquet metadata of the WKB geometry column, in longitude/latitude (the default
+# OGC:CRS84, the axis order of EPSG:4326 data in PostGIS).
+GEOPARQUET_METADATA = {
+    'version': '1.0.0',
+    'primary_column': 'geometry',
+    'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': []}},
+}
+
+
+def arrow_schema(model, columns):
+    # Taken from the model, so every batch has the same schema whichever nulls it
+    # holds. The geometry is a WKB column tagged as such for GeoArrow readers.
+    import pyarrow as pa
+
+    fields = [
+        pa.field(column, getattr(pa, ARROW_TYPES.get(model._meta.get_field(column).get_internal_type(), 'string'))())
+        for column in columns
+    ]
+    fields.append(pa.field('geometry', pa.binary(), metadata={'ARROW:extension:name': 'geoarrow.wkb'}))
+    return pa.schema(fields)
+
+
+def iter_batches(queryset, columns, geom_field, schema):
+    # Rows come from a server-side cursor and are converted to record batches of
+    # EXPORT_BATCH_ROWS, only one batch is held in memory at a time. Geometries are
+    # fetched as WKB and written as they are.
+    import pyarrow as pa
+
+    rows = queryset.values_list(*columns, AsWKB(geom_field)).iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+    while True:
+        batch = list(itertools.islice(rows, settings.EXPORT_BATCH_ROWS))
+        if not batch:
+            return
+        values = list(zip(*batch))
+        values[-1] = [bytes(wkb) if wkb is not None else None for wkb in values[-1]]
+        arrays = [pa.array(column, type=field.type) for column, field in zip(values, schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_flatgeobuf(schema, batches, path):
+    import pyarrow as pa
+    import pyogrio
+
+    reader = pa.RecordBatchReader.from_batches(schema, batches)
+    if not hasattr(pyogrio.raw, 'write_arrow'):
+        # pyogrio < 0.8 only writes whole data frames.
+        import geopandas as gpd
+
+        df = reader.read_all().to_pandas()
+        gdf = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkb(df.pop('geometry')), crs='EPSG:4326')
+        gdf.to_file(path, driver='FlatGeobuf', SPATIAL_INDEX='YES')
+        return
+    pyogrio.raw.write_arrow(reader, path, driver='FlatGeobuf', geometry_name='geometry', geometry_type='Unknown',
+                            crs='EPSG:4326', layer_options={'SPATIAL_INDEX': 'YES'})
+
+
+def write_geoparquet(schema, batches, path):
+    import pyarrow.parquet as pq
+
+    schema = schema.with_metadata({'geo': json.dumps(GEOPARQUET_METADATA)})
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_arrow(schema, batches, path):
+    import pyarrow as pa
+
+    # Arrow IPC file format with the geometry as a WKB column, random access and
+    # memory-mappable on the client side.
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+WRITERS = {
+    'flatgeobuf': write_flatgeobuf,
+    'geoparquet': write_geoparquet,
+    'arrow': write_arrow,
+}
+
+#########################################################################################
+# Export files
+#########################################################################################
+
+def export_path(request, output_format, scenario, version):
+    # Files are keyed by the scenario and its dataset version, the endpoint and its
+    # query parameters, so repeated and range requests for the same data read the
+    # same file.
+    query = sorted(request.GET.lists())
+    digest = hashlib.sha1(repr((request.path, query, output_format)).encode()).hexdigest()
+    extension = EXPORT_FORMATS[output_format]['extension']
+    return os.path.join(settings.EXPORT_DIR, f'{scenario}-{version}-{digest}.{extension}')
+
+
+def remove_stale_exports(scenario, version):
+    # Exports of older versions of the scenario, those of other scenarios are kept.
+    for name in os.listdir(settings.EXPORT_DIR):
+        if name.startswith(f'{scenario}-') and not name.startswith(f'{scenario}-{version}-'):
+            try:
+                os.remove(os.path.join(settings.EXPORT_DIR, name))
+            except OSError:
+                pass
+
+
+def build_export(request, queryset, fields, geom_field, output_format):
+    from .cache import get_dataset_version
+
+    scenario = parse_scenario(request)
+    version = get_dataset_version(scenario)
+    path = export_path(request, output_format, scenario, version)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+    remove_stale_exports(scenario, version)
+    columns = [field for field in fields if field != geom_field]
+    schema = arrow_schema(queryset.model, columns)
+    # Write to a temporary name first so concurrent requests never serve a partial file;
+    # the name is unique to the request, threads of one worker may build the same export.
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with phase('serialization'):
+            WRITERS[output_format](schema, iter_batches(queryset, columns, geom_field, schema), tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Exported {os.path.getsize(path)} bytes to '{path}'")
+    return path
+
+#########################################################################################
+# Range responses
+#########################################################################################
+
+def range_response(request, path, content_type):
+    size = os.path.getsize(path)
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', request.headers.get('Range', '').strip())
+    if not match or match.groups() == ('', ''):
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    start, end = match.groups()
+    if start == '':
+        # Suffix range: the last N bytes of the file.
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    with open(path, 'rb') as file:
+        file.seek(start)
+        content = file.read(end - start + 1)
+    response = HttpResponse(content, status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def export_response(request, queryset, fields, geom_field, output_format):
+    path = build_export(request, queryset, fields, geom_field, output_format)
+    return range_response(request, path, EXPORT_FORMATS[output_format]['content_type'])
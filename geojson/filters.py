@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+# Size in pixels of the web map tiles requested by OpenLayers.
+TILE_SIZE = 256
+MAX_ZOOM = 24
+WEB_MERCATOR_SRIDS = (3857, 900913)
+WEB_MERCATOR_EXTENT = 2 * math.pi * 6378137
+
+#########################################################################################
+# Query parameter errors
+#########################################################################################
+
+class QueryParameterError(ValueError):
+    pass
+
+#########################################################################################
+# Query parameter parsing
+#########################################################################################
+
+def parse_zoom(request):
+    zoom = request.GET.get('zoom')
+    if zoom in (None, ''):
+        return None
+    try:
+        zoom = int(zoom)
+    except ValueError:
+        raise QueryParameterError(f"Invalid zoom '{zoom}', expected an integer.")
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise QueryParameterError(f"Zoom must be between 0 and {MAX_ZOOM}.")
+    return zoom
+
+
+def parse_srid(request):
+    srid = request.GET.get('srid') or 4326
+    try:
+        return int(srid)
+    except ValueError:
+        raise QueryParameterError(f"Invalid srid '{srid}', expected an EPSG code.")
+
+
+def pixel_size(zoom, srid):
+    # Ground size of one map pixel at the given zoom level, in the units of the srid.
+    # Only the web mercator and geographic grids used by the dashboard are known.
+    if srid in WEB_MERCATOR_SRIDS:
+        return WEB_MERCATOR_EXTENT / (TILE_SIZE * 2 ** zoom)
+    if srid == 4326:
+        return 360.0 / (TILE_SIZE * 2 ** zoom)
+    return None
+
+
+def parse_bbox(request):
+    bbox = request.GET.get('bbox')
+    if not bbox:
+        return None
+
+    parts = bbox.split(',')
+    if len(parts) != 4:
+        raise QueryParameterError("bbox must be 'minx,miny,maxx,maxy'.")
+    try:
+        minx, miny, maxx, maxy = (float(part) for part in parts)
+    except ValueError:
+        raise QueryParameterError(f"Invalid bbox '{bbox}', expected four numbers.")
+    if minx > maxx or miny > maxy:
+        raise QueryParameterError("bbox minimum must not be larger than its maximum.")
+
+    srid = parse_srid(request)
+    zoom = parse_zoom(request)
+
+    # Pad the viewport by a few pixels at the requested zoom so that symbols of
+    # features lying just outside the map edge are not clipped while panning.
+    if zoom is not None:
+        size = pixel_size(zoom, srid)
+        if size:
+            buffer = size * settings.API_BBOX_BUFFER_PIXELS
+            minx, miny, maxx, maxy = minx - buffer, miny - buffer, maxx + buffer, maxy + buffer
+
+    polygon = Polygon.from_bbox((minx, miny, maxx, maxy))
+    polygon.srid = srid
+    return polygon
+
+#########################################################################################
+# Queryset filters
+#########################################################################################
+
+def apply_spatial_filter(request, queryset, geom_field):
+    # Restrict the queryset to the features intersecting the requested viewport.
+    # The lookup compiles to ST_Intersects, which PostGIS answers from the GiST
+    # index on the geometry column; a bbox in another srid is transformed in SQL.
+    bbox = parse_bbox(request)
+    if bbox is None:
+        return queryset
+    return queryset.filter(**{f'{geom_field}__intersects': bbox})
+
+#########################################################################################
+# Attribute filters
+#########################################################################################
+
+# Query parameter -> queryset lookup. A comma separated value of an __in lookup
+# matches any of the listed values.
+ATTRIBUTE_FILTERS = {
+    'carrier': 'carrier__in',
+    'country': 'country__in',
+    'sub_network': 'sub_network__in',
+    'v_nom_min': 'v_nom__gte',
+    'v_nom_max': 'v_nom__lte',
+}
+
+
+def parse_number(name, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise QueryParameterError(f"Invalid {name} '{value}', expected a number.")
+
+
+def apply_attribute_filters(request, queryset):
+    model_fields = {field.name for field in queryset.model._meta.get_fields()}
+    for param, lookup in ATTRIBUTE_FILTERS.items():
+        value = request.GET.get(param)
+        if value in (None, ''):
+            continue
+        field, _, operator = lookup.partition('__')
+        if field not in model_fields:
+            raise QueryParameterError(f"Filter '{param}' is not supported by this endpoint.")
+        if operator == 'in':
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        else:
+            value = parse_number(param, value)
+        queryset = queryset.filter(**{lookup: value})
+    return queryset
+
+#########################################################################################
+# Field projection
+#########################################################################################
+
+def parse_fields(request, queryset, fields, geom_field):
+    # The key column (the first of the fields) and the geometry are always returned,
+    # the other columns only when listed in ?fields=.
+    requested = request.GET.get('fields')
+    if not requested:
+        return fields
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names.difference(fields)
+    if unknown:
+        raise QueryParameterError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+    names.update((fields[0], geom_field))
+    return tuple(field for field in fields if field in names)
+
+#########################################################################################
+# Keyset pagination
+#########################################################################################
+
+def parse_limit(request):
+    limit = request.GET.get('limit')
+    if limit in (None, ''):
+        return settings.API_MAX_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise QueryParameterError(f"Invalid limit '{limit}', expected an integer.")
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise QueryParameterError(f"limit must be between 1 and {settings.API_MAX_PAGE_SIZE}.")
+    return limit
+
+
+def apply_pagination(request, queryset):
+    # Keyset pagination within the requested scenario: ?after=<key of the last row of
+    # the previous page>, the Line of a line, the id of a generator and '<Bus>/<carrier>'
+    # of a storage unit. The primary key is '<scenario>/<key>', so the page is a seek
+    # on the unique (scenario, uid) index instead of an OFFSET scan. Returns the page
+    # and the key to pass as ?after= for the next page, or None on the last page.
+    from .scenarios import parse_scenario
+
+    after = request.GET.get('after')
+    if not after and 'limit' not in request.GET:
+        return queryset, None
+
+    limit = parse_limit(request)
+    prefix = f'{parse_scenario(request)}/'
+    queryset = queryset.order_by('pk')
+    if after:
+        queryset = queryset.filter(pk__gt=prefix + after)
+    last = list(queryset.values_list('pk', flat=True)[limit - 1:limit + 1])
+    next_after = last[0][len(prefix):] if len(last) > 1 else None
+    return queryset[:limit], next_after
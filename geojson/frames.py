@@ -0,0 +1,188 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import io
+import itertools
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .db import raw_connection
+from .scenarios import DEFAULT_SCENARIO, ensure_partition, parse_scenario, partition_name
+from .timeseries import SERIES_TABLE, SNAPSHOTS_TABLE, copy_text
+
+logger = logging.getLogger(__name__)
+
+# Line loading |p0| / s_nom_opt of every line at every snapshot, quantized to one
+# byte per line: 0..254 spans 0..LINE_LOADING_MAX, 255 marks a line without data.
+# A frame is the loading of all lines at one snapshot, in the order of
+# line_loading_lines, so a map can animate 10k lines from ~10 kB per snapshot.
+FRAMES_TABLE = 'line_loading_frames'
+LINES_TABLE = 'line_loading_lines'
+NO_DATA = 255
+LOADING_STEPS = 254
+LINE_COMPONENTS = ('lines', 'line')
+# Lines read from the time series store per batch while building the frames.
+BATCH_LINES = 1000
+# Rows per COPY when storing the frames, a row holds one frame of every line.
+BATCH_ROWS = 500
+
+#########################################################################################
+# Frame computation
+#########################################################################################
+
+def line_loading_source(scenario):
+    # (component, attribute) of the stored p0 series of the lines, if any.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT component, attribute FROM public.{SERIES_TABLE}
+            WHERE scenario = %s AND component IN %s AND attribute IN %s
+            GROUP BY component, attribute
+            ORDER BY array_position(%s, attribute::text)
+            LIMIT 1
+            """,
+            [scenario, LINE_COMPONENTS, tuple(settings.LINE_LOADING_ATTRIBUTES),
+             list(settings.LINE_LOADING_ATTRIBUTES)],
+        )
+        return cursor.fetchone()
+
+
+def quantize(loading):
+    import numpy as np
+
+    frames = np.full(loading.shape, NO_DATA, dtype=np.uint8)
+    finite = np.isfinite(loading)
+    frames[finite] = np.rint(np.clip(loading[finite] / settings.LINE_LOADING_MAX, 0, 1) * LOADING_STEPS)
+    return frames
+
+
+def compute_frames(scenario, component, attribute, lines, capacities, snapshots):
+    # Returns a (snapshots x lines) uint8 matrix, filled batch by batch of lines so
+    # that only one batch of float series is ever held in memory.
+    import numpy as np
+
+    frames = np.full((snapshots, len(lines)), NO_DATA, dtype=np.uint8)
+    positions = {str(line): position for position, line in enumerate(lines)}
+    capacities = np.asarray(capacities, dtype=np.float64)
+
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(
+            f'SELECT name, "values" FROM public.{SERIES_TABLE} '
+            f'WHERE scenario = %s AND component = %s AND attribute = %s',
+            [scenario, component, attribute],
+        )
+        while True:
+            rows = cursor.fetchmany(BATCH_LINES)
+            if not rows:
+                break
+            rows = [(positions[name], values) for name, values in rows
+                    if name in positions and len(values) == snapshots]
+            if not rows:
+                continue
+            columns = np.fromiter((position for position, _ in rows), dtype=np.int64, count=len(rows))
+            p0 = np.array([values for _, values in rows], dtype=np.float64).T
+            with np.errstate(divide='ignore', invalid='ignore'):
+                loading = np.abs(p0) / capacities[columns]
+            loading[:, ~(capacities[columns] > 0)] = np.nan
+            frames[:, columns] = quantize(loading)
+    finally:
+        cursor.close()
+    return frames
+
+
+def rebuild_line_loading_frames(scenario=DEFAULT_SCENARIO):
+    source = line_loading_source(scenario)
+    if source is None:
+        logger.info("Skipping line loading frames, no line p0 time series stored.")
+        return 0
+    component, attribute = source
+
+    start = time.monotonic()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [f"public.{partition_name('network_lines_view', scenario)}"])
+        if cursor.fetchone()[0] is None:
+            logger.warning(f"Skipping line loading frames, scenario '{scenario}' has no lines.")
+            return 0
+        # The frame index order: lines sorted by their id, stable across snapshots.
+        cursor.execute('SELECT "Line", s_nom_opt FROM public.network_lines_view WHERE scenario = %s ORDER BY "Line"',
+                       [scenario])
+        rows = cursor.fetchall()
+        lines = [line for line, _ in rows]
+        capacities = [capacity for _, capacity in rows]
+        cursor.execute(
+            f'SELECT snapshot FROM public.{SNAPSHOTS_TABLE} '
+            f'WHERE scenario = %s AND component = %s AND attribute = %s ORDER BY position',
+            [scenario, component, attribute],
+        )
+        snapshots = [row[0] for row in cursor.fetchall()]
+
+    frames = compute_frames(scenario, component, attribute, lines, capacities, len(snapshots))
+    store_frames(scenario, lines, snapshots, frames)
+    logger.info(f"Built {len(snapshots)} line loading frames of {len(lines)} lines of scenario '{scenario}' "
+                f"in {time.monotonic() - start:.2f}s")
+    return len(snapshots)
+
+
+def copy_rows(cursor, table, columns, rows):
+    # COPY in batches of BATCH_ROWS, only one batch of text is held in memory.
+    for batch in iter(lambda: ''.join(itertools.islice(rows, BATCH_ROWS)), ''):
+        cursor.copy_expert(f'COPY public.{table} ({columns}) FROM STDIN', io.StringIO(batch))
+
+
+def store_frames(scenario, lines, snapshots, frames):
+    index = (f'{scenario}\t{position}\t{copy_text(line)}\n' for position, line in enumerate(lines))
+    data = (
+        f'{scenario}\t{position}\t{snapshot.isoformat()}\t\\\\x{frames[position].tobytes().hex()}\n'
+        for position, snapshot in enumerate(snapshots)
+    )
+    db = raw_connection()
+    try:
+        with db.cursor() as cursor:
+            lines_partition = ensure_partition(cursor, LINES_TABLE, scenario)
+            frames_partition = ensure_partition(cursor, FRAMES_TABLE, scenario)
+            cursor.execute(f'DELETE FROM public.{lines_partition}')
+            cursor.execute(f'DELETE FROM public.{frames_partition}')
+            copy_rows(cursor, lines_partition, 'scenario, position, "Line"', index)
+            copy_rows(cursor, frames_partition, 'scenario, position, snapshot, frame', data)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+#########################################################################################
+# Frame responses
+#########################################################################################
+
+def frame_index(request):
+    scenario = parse_scenario(request)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT "Line" FROM public.{LINES_TABLE} WHERE scenario = %s ORDER BY position', [scenario])
+        lines = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'SELECT snapshot FROM public.{FRAMES_TABLE} WHERE scenario = %s ORDER BY position',
+                       [scenario])
+        snapshots = [row[0].isoformat() for row in cursor.fetchall()]
+    return {
+        'scenario': scenario,
+        'lines': lines,
+        'snapshots': snapshots,
+        'scale': settings.LINE_LOADING_MAX / LOADING_STEPS,
+        'no_data': NO_DATA,
+    }
+
+
+def read_frame(request, position):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT snapshot, frame FROM public.{FRAMES_TABLE} WHERE scenario = %s AND position = %s',
+                       [parse_scenario(request), position])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0], bytes(row[1])
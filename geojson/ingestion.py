@@ -0,0 +1,401 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import os
+import json
+import logging
+import time
+from datetime import timedelta
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from environ import Env
+
+from .cache import bump_dataset_version
+from .clusters import rebuild_capacity_clusters
+from .db import get_engine, log_pool_stats
+from .frames import LINE_COMPONENTS, rebuild_line_loading_frames
+from .loader import NoRowsError, copy_chunks, upsert_chunks
+from .lod import rebuild_line_lods
+from .matviews import VIEW_TABLES, refresh_views, source_kind, views_for
+from .metrics import record_ingestion
+from .networks import import_network
+from .models import Bus, IngestionJob, JSONBus, PyPSANetwork
+from .ows import purge_layers
+from .readers import iter_geojson_chunks, iter_json_chunks, use_streaming
+from .scenarios import DEFAULT_SCENARIO, scenario_table
+from .timeseries import read_timeseries, store_timeseries, timeseries_key
+
+# geopandas, pandas, sqlalchemy and the GeoServer client are imported where they are
+# used, so that web workers and management commands that never ingest an upload do
+# not pay for loading them (see `manage.py startup_benchmark`).
+
+logger = logging.getLogger(__name__)
+
+#########################################################################################
+# GeoServer
+#########################################################################################
+
+@lru_cache(maxsize=None)
+def get_catalog():
+    # Built on first use rather than at import, the GeoServer settings are only
+    # required by processes that actually publish layers.
+    from geoserver.catalog import Catalog
+
+    env = Env()
+    env.read_env()
+    return Catalog(env("GEOSERVER_URL"), username=env("GEOSERVER_USER"), password=env("GEOSERVER_PASS"))
+
+
+def database_params():
+    db_url = urlparse(settings.SQLALCHEMY_DATABASE_URL)
+    return {
+        'db': db_url.path[1:],
+        'host': f'{db_url.hostname}:{db_url.port or 5432}',
+        'pg_user': db_url.username,
+        'pg_password': db_url.password,
+    }
+
+#########################################################################################
+# Table loading
+#########################################################################################
+
+def load_chunks(job, instance, chunks, table_name, unit='rows', **options):
+    # Uploads with a key field are applied to the existing table as inserts, updates
+    # and deletes; the others replace the table. The change counts go to the job.
+    # Integer columns are always stored as double precision: a file read in chunks may
+    # hold fractions or nulls in a later chunk, and a file read at once must give the
+    # same table definition, or the next upload replaces the table instead of
+    # applying the changes.
+    progress = lambda rows: job.set_progress(30, f"Wrote {rows} {unit}")
+    if instance.key_field:
+        changes = upsert_chunks(chunks, table_name, instance.key_field, widen_integers=True,
+                                progress=progress, **options)
+    else:
+        rows = copy_chunks(chunks, table_name, widen_integers=True, progress=progress, **options)
+        changes = {'inserted': rows, 'updated': 0, 'deleted': 0, 'created': True}
+    job.record_changes(changes['inserted'], changes['updated'], changes['deleted'])
+    return changes
+
+
+def changed(changes):
+    return changes['created'] or changes['inserted'] or changes['updated'] or changes['deleted']
+
+
+def changes_message(changes, unit, table_name, skipped=()):
+    if changes['created']:
+        message = f"Loaded {changes['inserted']} {unit} into '{table_name}'"
+    else:
+        message = (f"Applied {changes['inserted']} inserted, {changes['updated']} updated and "
+                   f"{changes['deleted']} deleted {unit} to '{table_name}'")
+    if skipped:
+        message += f"; not rebuilt, other uploads are missing: {', '.join(skipped)}"
+    return message
+
+
+def refresh_sources(job, table_name, scenario):
+    # Rebuilds, for the scenario, the view tables built from the upload table and
+    # what is derived from them. Returns the view tables that could not be built
+    # because another of their uploads is missing.
+    kind = source_kind(table_name, scenario)
+    if kind is None:
+        return []  # Not an upload the views are built from.
+    job.set_progress(60, "Refreshing views")
+    timings = refresh_views(views_for(kind), scenario=scenario)
+    if timings.get('network_lines_view') is not None:
+        job.set_progress(70, "Rebuilding line levels of detail")
+        rebuild_line_lods(scenario) # Refresh the simplified line geometries.
+    if any(elapsed is not None for name, elapsed in timings.items() if name != 'network_lines_view'):
+        rebuild_capacity_clusters(scenario)
+    if kind == 'lines':
+        rebuild_line_loading_frames(scenario) # s_nom_opt or the set of lines may have changed.
+    return [name for name, elapsed in timings.items() if elapsed is None]
+
+
+#########################################################################################
+# GeoJSON ingestion
+#########################################################################################
+
+def ingest_geojson(job):
+    instance = Bus.objects.get(pk=job.object_id)
+    if not instance.geojson_file:
+        job.set_progress(100, "No GeoJSON file to load.")
+        return
+
+    path = instance.geojson_file.path
+    # Each scenario has its own upload tables, the default one keeps the plain names.
+    table_name = scenario_table("geojson_" + instance.name, instance.scenario)
+    if use_streaming(path):
+        ingest_geojson_chunks(job, instance, path, table_name)
+        return
+
+    import geopandas as gpd
+
+    # Load GeoJSON from the file into a GeoDataFrame for spatial operations.
+    job.set_progress(5, f"Reading '{instance.geojson_file.name}'")
+    gdf = gpd.read_file(path)
+    if gdf.empty or 'geometry' not in gdf or gdf['geometry'].is_empty.all():
+        job.set_progress(100, "The file has no geometries.")
+        return
+
+    job.set_progress(30, f"Writing {len(gdf)} features")
+
+    # Bulk load into PostGIS, using 'geom' as the geometry column name.
+    # Creates a table name with the prefix 'geojson'.
+    changes = load_chunks(job, instance, [gdf.rename_geometry('geom')], table_name, unit='features',
+                          geometry_column='geom', srid=4326)
+    skipped = publish_geojson(job, instance, table_name, changes)
+    job.set_progress(100, changes_message(changes, 'features', table_name, skipped))
+
+
+def ingest_geojson_chunks(job, instance, path, table_name):
+    # Large files never sit in memory as a whole, each chunk of features goes
+    # straight into the table before the next one is read.
+    job.set_progress(5, f"Streaming '{instance.geojson_file.name}'")
+    chunks = (gdf.rename_geometry('geom') for gdf in iter_geojson_chunks(path))
+    try:
+        changes = load_chunks(job, instance, chunks, table_name, unit='features',
+                              geometry_column='geom', srid=4326)
+    except NoRowsError:
+        job.set_progress(100, "The file has no geometries.")
+        return
+    skipped = publish_geojson(job, instance, table_name, changes)
+    job.set_progress(100, changes_message(changes, 'features', table_name, skipped))
+
+
+def publish_geojson(job, instance, table_name, changes):
+    if not changed(changes):
+        return []  # Nothing to refresh, the table is as it was.
+    # Only the partitions of the upload's scenario are rebuilt.
+    skipped = refresh_sources(job, table_name, instance.scenario)
+    bump_dataset_version(instance.scenario) # Invalidate cached API responses.
+    # The uploaded layer and the views built on it render differently now.
+    purge_layers([instance.name, table_name, *VIEW_TABLES])
+    if not changes['created'] or not settings.GEOSERVER_PUBLISH:
+        return skipped  # Updated in place, the published layer already points at the table.
+
+    # Publish the GeoJSON data to GeoServer using the GeoServer REST client.
+    job.set_progress(85, "Publishing to GeoServer")
+    geo = get_catalog()
+    geo.create_featurestore(
+        name='PyPSAEarthDashboard',
+        workspace='PyPSAEarthDashboard',
+        schema='public',
+        **database_params()
+    )
+    # The layer is the table the features were written to, scenario suffix included.
+    geo.publish_featurestore(workspace='PyPSAEarthDashboard', store_name='PyPSAEarthDashboard',
+                             pg_table=table_name)
+    return skipped
+
+#########################################################################################
+# JSON ingestion
+#########################################################################################
+
+def ingest_json(job):
+    instance = JSONBus.objects.get(pk=job.object_id)
+    logger.info(f"Processing JSON file for instance '{instance.name}'")
+    # Check if the file is accessible
+    if not instance.json_file or not os.path.isfile(instance.json_file.path):
+        raise FileNotFoundError(f"File not found for '{instance.name}'")
+
+    if timeseries_key(instance.name):
+        ingest_timeseries(job, instance)
+        return
+
+    json_table_name = scenario_table("json_" + instance.name, instance.scenario)
+    if use_streaming(instance.json_file.path):
+        # Parse the 'data' array incrementally and write it chunk by chunk.
+        job.set_progress(5, f"Streaming '{instance.json_file.name}'")
+        try:
+            changes = load_chunks(job, instance, iter_json_chunks(instance.json_file.path), json_table_name)
+        except NoRowsError:
+            logger.warning(f"No data to write for '{instance.name}'")
+            job.set_progress(100, "No data to write.")
+            return
+        skipped = refresh_json(job, instance, json_table_name, changes)
+        job.set_progress(100, changes_message(changes, 'rows', json_table_name, skipped))
+        return
+
+    import pandas as pd
+
+    # Load JSON file into a Python dictionary
+    job.set_progress(5, f"Reading '{instance.json_file.name}'")
+    with open(instance.json_file.path, 'r') as file:
+        json_data = json.load(file)
+
+    # Check if 'data' key exists and it's not empty
+    if 'data' not in json_data or not json_data['data']:
+        logger.warning(f"No data to write for '{instance.name}'")
+        job.set_progress(100, "No data to write.")
+        return
+
+    # Process JSON data based on its structure
+    if 'columns' in json_data:
+        # Use 'columns' key for DataFrame columns if it exists
+        json_df = pd.DataFrame(json_data['data'], columns=json_data['columns'])
+    else:
+        # If no 'columns' key, assume data is a list of dictionaries
+        json_df = pd.DataFrame(json_data['data'])
+    logger.info(f"DataFrame created for '{instance.name}'")
+
+    # Write the DataFrame to SQL
+    job.set_progress(30, f"Writing {len(json_df)} rows")
+    changes = load_chunks(job, instance, [json_df], json_table_name)
+    logger.info(f"Data written to SQL table '{json_table_name}'")
+
+    skipped = refresh_json(job, instance, json_table_name, changes)
+    job.set_progress(100, changes_message(changes, 'rows', json_table_name, skipped))
+
+
+def ingest_timeseries(job, instance):
+    # Dynamic data (lines_t, generators_t_p, ...) goes to the time series store, one
+    # array per component, instead of a wide table with a column per component.
+    component, attribute = timeseries_key(instance.name)
+    job.set_progress(5, f"Reading time series '{instance.json_file.name}'")
+    snapshots, names, batches = read_timeseries(instance.json_file.path)
+    if not names:
+        job.set_progress(100, "No data to write.")
+        return
+    job.set_progress(40, f"Writing {len(names)} series of {len(snapshots)} snapshots")
+    store_timeseries(component, attribute, snapshots, batches, scenario=instance.scenario)
+    if component in LINE_COMPONENTS:
+        job.set_progress(70, "Building line loading frames")
+        rebuild_line_loading_frames(instance.scenario)
+    bump_dataset_version(instance.scenario)
+    job.set_progress(100, f"Loaded {len(names)} series into {component}.{attribute}")
+
+
+def refresh_json(job, instance, table_name, changes):
+    if not changed(changes):
+        return []  # Nothing to refresh, the table is as it was.
+    skipped = refresh_sources(job, table_name, instance.scenario)
+    bump_dataset_version(instance.scenario)
+    purge_layers([table_name, *VIEW_TABLES])
+    return skipped
+
+#########################################################################################
+# PyPSA network import
+#########################################################################################
+
+def ingest_network(job):
+    instance = PyPSANetwork.objects.get(pk=job.object_id)
+    if not instance.network_file or not os.path.isfile(instance.network_file.path):
+        raise FileNotFoundError(f"File not found for '{instance.name}'")
+
+    job.set_progress(5, f"Reading '{instance.network_file.name}'")
+    progress = lambda done, total, result: job.set_progress(
+        5 + 60 * done / total, f"Loaded {result['rows']} {result['component']} and {result['series']} series"
+    )
+    results = import_network(instance.network_file.path, instance.scenario, progress=progress)
+    job.record_changes(sum(result['rows'] for result in results.values()), 0, 0)
+    job.set_progress(70, "Refreshing views")
+    refresh_network(instance.scenario, results)
+    job.set_progress(100, f"Imported {', '.join(results)} into scenario '{instance.scenario}'")
+
+
+def refresh_network(scenario, results):
+    # Every table of the scenario was replaced, so everything derived from them is
+    # rebuilt, for that scenario only.
+    refresh_views(scenario=scenario)
+    rebuild_line_lods(scenario)
+    rebuild_capacity_clusters(scenario)
+    rebuild_line_loading_frames(scenario)
+    bump_dataset_version(scenario)
+    purge_layers([result['table'] for result in results.values()] + list(VIEW_TABLES))
+
+#########################################################################################
+# Table removal
+#########################################################################################
+
+def drop_table(table_name, scenario=DEFAULT_SCENARIO):
+    from sqlalchemy import text
+
+    try:
+        sql = text(f"DROP TABLE IF EXISTS public.\"{table_name}\"")
+        with get_engine().begin() as connection:
+            connection.execute(sql)
+            logger.info(f"Table '{table_name}' deleted from the database.")
+        bump_dataset_version(scenario)
+        purge_layers([table_name])
+    except Exception as e:
+        logger.error(f"Error deleting table for {table_name}: {e}")
+
+#########################################################################################
+# Job queue
+#########################################################################################
+
+TASKS = {
+    'geojson': ingest_geojson,
+    'json': ingest_json,
+    'pypsa': ingest_network,
+}
+
+
+def claim_job():
+    # SKIP LOCKED lets several workers poll the same table without handing out a
+    # job twice or waiting on each other's row locks.
+    with transaction.atomic():
+        job = (IngestionJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(status=IngestionJob.QUEUED)
+               .order_by('created_time')
+               .first())
+        if job is None:
+            return None
+        job.status = IngestionJob.RUNNING
+        job.started_time = timezone.now()
+        job.save(update_fields=['status', 'started_time'])
+    return job
+
+
+def run_job(job):
+    start = time.monotonic()
+    job.status = IngestionJob.RUNNING
+    job.started_time = job.started_time or timezone.now()
+    job.save(update_fields=['status', 'started_time'])
+    try:
+        TASKS[job.kind](job)
+        job.status = IngestionJob.DONE
+        job.progress = 100
+    except Exception as e:
+        logger.error(f"Error processing ingestion job {job.pk} ({job.name}): {e}", exc_info=True)
+        job.status = IngestionJob.FAILED
+        job.message = str(e)
+    job.finished_time = timezone.now()
+    job.duration = time.monotonic() - start
+    job.save(update_fields=['status', 'progress', 'message', 'finished_time', 'duration'])
+    logger.info(f"Ingestion job {job.pk} {job.status} in {job.duration:.1f}s")
+    record_ingestion(job)
+    log_pool_stats()
+    return job
+
+
+def requeue_stale_jobs():
+    # Jobs left running by a worker that died are handed out again.
+    cutoff = timezone.now() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT)
+    count = (IngestionJob.objects
+             .filter(status=IngestionJob.RUNNING, started_time__lt=cutoff)
+             .update(status=IngestionJob.QUEUED, started_time=None, progress=0))
+    if count:
+        logger.warning(f"Requeued {count} stale ingestion jobs")
+    return count
+
+
+def work(once=False, poll_interval=None):
+    poll_interval = poll_interval or settings.INGESTION_POLL_INTERVAL
+    requeue_stale_jobs()
+    while True:
+        close_old_connections()
+        job = claim_job()
+        if job is not None:
+            run_job(job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
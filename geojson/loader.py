@@ -0,0 +1,306 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import io
+import itertools
+import json
+import logging
+import time
+
+from .db import raw_connection
+
+logger = logging.getLogger(__name__)
+
+# Rows written per COPY chunk, bounds the size of the in-memory CSV buffer.
+COPY_CHUNK_ROWS = 50000
+NULL_MARKER = '\\N'
+
+
+class NoRowsError(ValueError):
+    pass
+
+
+class DependentObjectsError(ValueError):
+    pass
+
+#########################################################################################
+# Table definition
+#########################################################################################
+
+def quote(identifier):
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def column_type(series, widen_integers=False):
+    import pandas as pd
+
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series):
+        # A later chunk of the same column may hold fractions or nulls.
+        return 'double precision' if widen_integers else 'bigint'
+    if pd.api.types.is_float_dtype(series):
+        return 'double precision'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'timestamp without time zone'
+    return 'text'
+
+
+def table_columns(df, geometry_column, srid, widen_integers=False):
+    # Types are spelled the way format_type() reports them, so the definition can be
+    # compared with the one of an existing table.
+    columns = [
+        (str(name), column_type(df[name], widen_integers))
+        for name in df.columns if name != geometry_column
+    ]
+    if geometry_column:
+        columns.append((geometry_column, f'geometry(Geometry,{srid})'))
+    return columns
+
+
+def create_table_sql(table_name, columns):
+    definition = ', '.join(f'{quote(name)} {type_}' for name, type_ in columns)
+    return f'CREATE TABLE public.{quote(table_name)} ({definition})'
+
+
+def existing_columns(cursor, table_name):
+    cursor.execute(
+        """
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """,
+        [f'public.{quote(table_name)}'],
+    )
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def dependent_objects(cursor, table_name):
+    # Views and materialized views reading from the table.
+    cursor.execute(
+        """
+        SELECT DISTINCT v.relname FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        WHERE d.refobjid = to_regclass(%s) AND v.oid <> d.refobjid
+        """,
+        [f'public.{quote(table_name)}'],
+    )
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def prepare_table(cursor, table_name, columns, geometry_column):
+    # The view tables are built from the uploaded tables. A table with the same
+    # definition is emptied in place so that objects depending on it survive a new
+    # upload, only a changed definition drops it, and never the views reading it.
+    if existing_columns(cursor, table_name) == columns:
+        if geometry_column:
+            cursor.execute(f'DROP INDEX IF EXISTS public.{quote(f"idx_{table_name}_{geometry_column}")}')
+        cursor.execute(f'TRUNCATE public.{quote(table_name)}')
+        return
+    dependents = dependent_objects(cursor, table_name)
+    if dependents:
+        raise DependentObjectsError(
+            f"The columns of '{table_name}' changed and {', '.join(dependents)} depend on it, "
+            f"drop or redefine them before uploading it again."
+        )
+    cursor.execute(f'DROP TABLE IF EXISTS public.{quote(table_name)}')
+    cursor.execute(create_table_sql(table_name, columns))
+
+#########################################################################################
+# Row encoding
+#########################################################################################
+
+def to_json_text(value):
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def prepare_frame(df, geometry_column, srid):
+    # Geometries are encoded as hex EWKB in one vectorized call, PostGIS parses
+    # that text directly on COPY input without any WKT round trip.
+    import numpy as np
+    import pandas as pd
+    import shapely
+
+    df = pd.DataFrame(df).copy()
+    for name in df.columns:
+        if name != geometry_column and df[name].dtype == object:
+            df[name] = df[name].map(to_json_text)
+    if geometry_column:
+        geometries = shapely.set_srid(np.asarray(df[geometry_column].values, dtype=object), srid)
+        df[geometry_column] = shapely.to_wkb(geometries, hex=True, include_srid=True)
+    return df
+
+
+def copy_chunk(cursor, df, table):
+    # table is the qualified, quoted name of the target table. Missing values are
+    # written as \N, CSV COPY would otherwise read empty strings as NULL too.
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+    buffer.seek(0)
+    columns = ', '.join(quote(name) for name in df.columns)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')", buffer)
+
+
+def copy_frames(cursor, df, table, geometry_column, srid):
+    for offset in range(0, len(df), COPY_CHUNK_ROWS):
+        chunk = df.iloc[offset:offset + COPY_CHUNK_ROWS]
+        copy_chunk(cursor, prepare_frame(chunk, geometry_column, srid), table)
+
+#########################################################################################
+# Bulk loader
+#########################################################################################
+
+def copy_chunks(chunks, table_name, geometry_column=None, srid=4326,
+                widen_integers=False, progress=None):
+    # Replace the rows of table_name with those of an iterable of DataFrames, streamed
+    # through COPY ... FROM STDIN. The table is defined by the first chunk and every
+    # later chunk is appended, so only one chunk is held in memory at a time. The whole
+    # replacement is one transaction, and the GiST index is only built once all rows
+    # are in, which is much cheaper than maintaining it row by row.
+    start = time.monotonic()
+    rows = 0
+    created = False
+    connection = raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for df in chunks:
+                if not created:
+                    columns = table_columns(df, geometry_column, srid, widen_integers)
+                    prepare_table(cursor, table_name, columns, geometry_column)
+                    created = True
+                copy_frames(cursor, df, f'public.{quote(table_name)}', geometry_column, srid)
+                rows += len(df)
+                if progress:
+                    progress(rows)
+            if not created:
+                raise NoRowsError(f"No rows to write into '{table_name}'")
+            if geometry_column:
+                cursor.execute(
+                    f'CREATE INDEX {quote(f"idx_{table_name}_{geometry_column}")} '
+                    f'ON public.{quote(table_name)} USING gist ({quote(geometry_column)})'
+                )
+            cursor.execute(f'ANALYZE public.{quote(table_name)}')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    logger.info(f"Copied {rows} rows into '{table_name}' in {time.monotonic() - start:.2f}s")
+    return rows
+
+
+def copy_dataframe(df, table_name, geometry_column=None, srid=4326):
+    return copy_chunks([df], table_name, geometry_column, srid)
+
+
+#########################################################################################
+# Incremental loader
+#########################################################################################
+
+STAGING_TABLE = 'upsert_staging'
+
+
+def upsert_sql(table_name, key, columns):
+    # DELETE, UPDATE and INSERT statements applying the staged rows to table_name,
+    # matched on the key column. Unchanged rows are not rewritten.
+    table = f'public.{quote(table_name)}'
+    staging = f'pg_temp.{STAGING_TABLE}'
+    key = quote(key)
+    names = [quote(name) for name, _ in columns]
+    values = [name for name in names if name != key]
+    statements = {
+        'deleted': f'DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.{key} = t.{key})',
+        'updated': None,
+        'inserted': (
+            f'INSERT INTO {table} ({", ".join(names)}) SELECT {", ".join(names)} FROM {staging} s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key})'
+        ),
+    }
+    if values:
+        statements['updated'] = (
+            f'UPDATE {table} t SET {", ".join(f"{name} = s.{name}" for name in values)} '
+            f'FROM {staging} s WHERE t.{key} = s.{key} AND '
+            f'ROW({", ".join(f"t.{name}" for name in values)}) IS DISTINCT FROM '
+            f'ROW({", ".join(f"s.{name}" for name in values)})'
+        )
+    return statements
+
+
+def stage_rows(cursor, chunks, table_name, key, geometry_column, srid, progress):
+    # COPY the incoming rows into a temporary table shaped like table_name.
+    cursor.execute(f'CREATE TEMP TABLE {STAGING_TABLE} (LIKE public.{quote(table_name)}) ON COMMIT DROP')
+    rows = 0
+    for df in chunks:
+        copy_frames(cursor, df, f'pg_temp.{STAGING_TABLE}', geometry_column, srid)
+        rows += len(df)
+        if progress:
+            progress(rows)
+    cursor.execute(f'CREATE INDEX ON pg_temp.{STAGING_TABLE} ({quote(key)})')
+    cursor.execute(f'ANALYZE pg_temp.{STAGING_TABLE}')
+    cursor.execute(
+        f'SELECT {quote(key)} FROM pg_temp.{STAGING_TABLE} '
+        f'GROUP BY {quote(key)} HAVING count(*) > 1 LIMIT 5'
+    )
+    duplicates = [row[0] for row in cursor.fetchall()]
+    if duplicates:
+        raise ValueError(f"Key column '{key}' is not unique in the upload, e.g. {duplicates}")
+    return rows
+
+
+def upsert_chunks(chunks, table_name, key, geometry_column=None, srid=4326,
+                  widen_integers=False, progress=None):
+    # Apply the rows of an iterable of DataFrames to an existing table_name as
+    # inserts, updates and deletes matched on the key column, in one transaction.
+    # Indexes, dependent views and published layers of the table are left in place.
+    # Without a table of the same definition to diff against, the rows are loaded
+    # with copy_chunks. Returns the change counts and whether the table was created.
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise NoRowsError(f"No rows to write into '{table_name}'")
+    columns = table_columns(first, geometry_column, srid, widen_integers)
+    if key not in [name for name, _ in columns]:
+        raise ValueError(f"Key column '{key}' is not in the upload of '{table_name}'")
+
+    start = time.monotonic()
+    changes = {'created': False}
+    connection = raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            replace = existing_columns(cursor, table_name) != columns
+            if not replace:
+                rows = stage_rows(cursor, itertools.chain([first], chunks), table_name, key,
+                                  geometry_column, srid, progress)
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote(f"idx_{table_name}_{key.lower()}")} '
+                    f'ON public.{quote(table_name)} ({quote(key)})'
+                )
+                for change, sql in upsert_sql(table_name, key, columns).items():
+                    if sql is None:
+                        changes[change] = 0
+                        continue
+                    cursor.execute(sql)
+                    changes[change] = cursor.rowcount
+                if changes['inserted'] or changes['updated'] or changes['deleted']:
+                    cursor.execute(f'ANALYZE public.{quote(table_name)}')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    if replace:
+        rows = copy_chunks(itertools.chain([first], chunks), table_name, geometry_column, srid,
+                           widen_integers, progress)
+        return {'inserted': rows, 'updated': 0, 'deleted': 0, 'created': True}
+    logger.info(
+        f"Upserted {rows} rows into '{table_name}' in {time.monotonic() - start:.2f}s: "
+        f"{changes['inserted']} inserted, {changes['updated']} updated, {changes['deleted']} deleted"
+    )
+    return changes
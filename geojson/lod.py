@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .scenarios import DEFAULT_SCENARIO, ensure_partition, partition_name
+
+logger = logging.getLogger(__name__)
+
+LINE_LOD_TABLE = 'network_lines_lod'
+
+#########################################################################################
+# Level of detail selection
+#########################################################################################
+
+# settings.LINE_LOD_LEVELS is a list of (max_zoom, tolerance) pairs ordered by zoom.
+# The position of a pair in the list is its lod number in the LOD table, zoom levels
+# above the last pair are served at full resolution.
+def line_lod_for_zoom(zoom):
+    if zoom is None:
+        return None
+    for lod, (max_zoom, tolerance) in enumerate(settings.LINE_LOD_LEVELS):
+        if zoom <= max_zoom:
+            return lod
+    return None
+
+
+def line_lod_geometry(lod, scenario=DEFAULT_SCENARIO):
+    # Simplified geometry of the current network_lines_view row, falling back to the
+    # full resolution geometry for lines that have no LOD yet.
+    simplified = RawSQL(
+        f'SELECT l.line_geom FROM public.{LINE_LOD_TABLE} l '
+        f'WHERE l.scenario = %s AND l.lod = %s AND l."Line" = "network_lines_view"."Line"',
+        (scenario, lod),
+        output_field=GeometryField(srid=4326),
+    )
+    return Coalesce(simplified, 'line_geom', output_field=GeometryField(srid=4326))
+
+#########################################################################################
+# LOD rebuild
+#########################################################################################
+
+def rebuild_line_lods(scenario=DEFAULT_SCENARIO):
+    # Recompute every LOD of the scenario from network_lines_view with
+    # ST_SimplifyPreserveTopology. The rows of its partition are replaced in one
+    # transaction, so readers keep seeing the previous LODs until the new ones are
+    # committed, and the other scenarios are not touched.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [f"public.{partition_name('network_lines_view', scenario)}"])
+        if cursor.fetchone()[0] is None:
+            logger.warning(f"Skipping line LOD rebuild, scenario '{scenario}' has no lines.")
+            return
+
+    start = time.monotonic()
+    with transaction.atomic(), connection.cursor() as cursor:
+        partition = ensure_partition(cursor, LINE_LOD_TABLE, scenario)
+        cursor.execute(f'DELETE FROM public.{partition}')
+        for lod, (max_zoom, tolerance) in enumerate(settings.LINE_LOD_LEVELS):
+            cursor.execute(
+                f'''
+                INSERT INTO public.{partition} (scenario, lod, "Line", line_geom)
+                SELECT scenario, %s, "Line", ST_SimplifyPreserveTopology(line_geom, %s)
+                FROM public.network_lines_view
+                WHERE scenario = %s AND line_geom IS NOT NULL
+                ''',
+                [lod, tolerance, scenario],
+            )
+            # Each LOD gets its own partial GiST index, so a query for one zoom band
+            # only walks the index of that band. Declared on the parent, it is
+            # created on the partitions of every scenario.
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS idx_{LINE_LOD_TABLE}_{lod}_geom '
+                f'ON public.{LINE_LOD_TABLE} USING gist (line_geom) WHERE lod = {lod}'
+            )
+        cursor.execute(f'ANALYZE public.{partition}')
+    logger.info(f"Rebuilt {len(settings.LINE_LOD_LEVELS)} line LODs of scenario '{scenario}' "
+                f"in {time.monotonic() - start:.2f}s")
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geojson.benchmark import (
+    SCALES,
+    build_report,
+    compare_reports,
+    read_report,
+    run_benchmark,
+    write_report
+)
+
+
+class Command(BaseCommand):
+    help = ("Load synthetic PyPSA networks into the database, drive the ingestion paths and "
+            "API endpoints, and write a JSON report, optionally compared against a baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', nargs='+', default=['1k'],
+                            help=f"Network sizes in buses: {', '.join(SCALES)}.")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Requests per endpoint, cold and warm each.")
+        parser.add_argument('--snapshots', type=int, default=168,
+                            help="Snapshots of the synthetic line p0 time series.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmark.json',
+                            help="Path of the JSON report.")
+        parser.add_argument('--baseline',
+                            help="Report to compare against; regressions make the command fail.")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative growth of a metric counted as a regression.")
+        parser.add_argument('--workdir',
+                            help="Directory for the generated files, a temporary one by default.")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Do not ask for confirmation.")
+
+    def handle(self, *args, **options):
+        unknown = [scale for scale in options['scale'] if scale not in SCALES]
+        if unknown:
+            raise CommandError(f"Unknown scales: {', '.join(unknown)}. Choose from {', '.join(SCALES)}.")
+        baseline = read_report(options['baseline']) if options['baseline'] else None
+
+        if options['interactive']:
+            answer = input("The benchmark loads a synthetic network into the 'benchmark' scenario and "
+                           "invalidates the API cache. Only run it against a disposable database.\n"
+                           "Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError("Benchmark cancelled.")
+
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = options['workdir'] or tmp
+            for scale in options['scale']:
+                self.stdout.write(f"Running the {scale} benchmark...")
+                result = run_benchmark(scale, os.path.join(directory, 'benchmark'), repeat=max(options['repeat'], 1),
+                                       snapshots=options['snapshots'], seed=options['seed'])
+                results.append(result)
+                self.write_summary(result)
+
+        report = build_report(results)
+        write_report(report, options['output'])
+        self.stdout.write(f"Report written to {options['output']}")
+
+        if baseline is None:
+            return
+        regressions = compare_reports(report, baseline, options['threshold'])
+        for path, previous, current, change in regressions:
+            self.stderr.write(f"{path}: {previous:.1f} -> {current:.1f} (+{change:.0%})")
+        if regressions:
+            raise CommandError(f"{len(regressions)} metrics regressed by more than {options['threshold']:.0%}.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def write_summary(self, result):
+        for name, values in result['ingestion'].items():
+            self.stdout.write(f"  ingest {name}: {values['seconds']:.2f}s, {values['rows']} rows, "
+                              f"peak {values['peak_rss_mb']:.0f} MB")
+        for name, values in result['endpoints'].items():
+            self.stdout.write(f"  {name}: cold p50 {values['cold']['p50_ms']:.1f} ms, "
+                              f"warm p50 {values['warm']['p50_ms']:.1f} ms, {values['queries']} queries, "
+                              f"{values['payload_bytes']} bytes")
@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import os
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geojson.ingestion import refresh_network
+from geojson.networks import import_network, network_format
+from geojson.scenarios import DEFAULT_SCENARIO, SCENARIO_PATTERN
+
+
+class Command(BaseCommand):
+    help = "Import a solved PyPSA network (.nc or .h5) into the tables behind the API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Network file written by pypsa.Network.export_to_netcdf or export_to_hdf5.")
+        parser.add_argument('--scenario', default=DEFAULT_SCENARIO,
+                            help="Scenario the network is loaded into.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes loading components, settings.PYPSA_IMPORT_WORKERS by default.")
+
+    def handle(self, *args, **options):
+        path, scenario = options['path'], options['scenario']
+        if not os.path.isfile(path):
+            raise CommandError(f"File not found: {path}")
+        if not re.match(SCENARIO_PATTERN, scenario):
+            raise CommandError(f"Invalid scenario '{scenario}'.")
+        try:
+            network_format(path)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        results = import_network(path, scenario, workers=options['workers'])
+        for component, result in results.items():
+            self.stdout.write(f"{component}: {result['rows']} rows, {result['series']} series "
+                              f"into '{result['table']}' in {result['seconds']:.2f}s")
+        self.stdout.write("Refreshing views...")
+        refresh_network(scenario, results)
+        self.stdout.write(self.style.SUCCESS(f"Network imported into scenario '{scenario}'."))
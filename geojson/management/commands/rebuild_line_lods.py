@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+from django.core.management.base import BaseCommand
+
+from geojson.cache import bump_dataset_version
+from geojson.lod import rebuild_line_lods
+from geojson.scenarios import DEFAULT_SCENARIO
+
+
+class Command(BaseCommand):
+    help = "Rebuild the simplified per-zoom geometries of network_lines_view."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', default=DEFAULT_SCENARIO,
+                            help="Scenario whose LODs are rebuilt.")
+
+    def handle(self, *args, **options):
+        rebuild_line_lods(options['scenario'])
+        bump_dataset_version(options['scenario'])
+        self.stdout.write(self.style.SUCCESS("Line LODs rebuilt."))
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geojson.cache import bump_dataset_version
+from geojson.clusters import rebuild_capacity_clusters
+from geojson.frames import rebuild_line_loading_frames
+from geojson.lod import rebuild_line_lods
+from geojson.matviews import VIEW_TABLES, refresh_view
+from geojson.ows import purge_layers
+from geojson.scenarios import DEFAULT_SCENARIO, SCENARIO_PATTERN
+
+
+class Command(BaseCommand):
+    help = "Rebuild the tables behind the API endpoints for one scenario and report timings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*',
+                            help="Views to refresh, all of them by default.")
+        parser.add_argument('--scenario', default=DEFAULT_SCENARIO,
+                            help="Scenario whose partitions are rebuilt.")
+        parser.add_argument('--create', action='store_true',
+                            help="Drop and recreate the partitions of the scenario instead of refreshing them.")
+
+    def handle(self, *args, **options):
+        names = options['views'] or list(VIEW_TABLES)
+        unknown = [name for name in names if name not in VIEW_TABLES]
+        if unknown:
+            raise CommandError(f"Unknown views: {', '.join(unknown)}. "
+                               f"Choose from {', '.join(VIEW_TABLES)}.")
+        scenario = options['scenario']
+        if not re.match(SCENARIO_PATTERN, scenario):
+            raise CommandError(f"Invalid scenario '{scenario}'.")
+        failed = []
+        for name in names:
+            try:
+                elapsed = refresh_view(name, scenario=scenario, create=options['create'])
+            except Exception as e:
+                failed.append(name)
+                self.stderr.write(f"{name}: {e}")
+                continue
+            self.stdout.write(f"{name}: {elapsed:.2f}s")
+
+        if 'network_lines_view' in names:
+            rebuild_line_lods(scenario)
+            rebuild_line_loading_frames(scenario)  # Keyed by "Line", like the LODs.
+        rebuild_capacity_clusters(scenario)
+        bump_dataset_version(scenario)
+        purge_layers(names)
+        if failed:
+            raise CommandError(f"Failed to refresh: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f"Views of scenario '{scenario}' refreshed."))
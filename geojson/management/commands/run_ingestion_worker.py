@@ -0,0 +1,21 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+from django.core.management.base import BaseCommand
+
+from geojson.ingestion import work
+
+
+class Command(BaseCommand):
+    help = "Process queued ingestion jobs. Several workers can run side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit when the queue is empty instead of polling for new jobs.")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds between polls of an empty queue.")
+
+    def handle(self, *args, **options):
+        work(once=options['once'], poll_interval=options['poll_interval'])
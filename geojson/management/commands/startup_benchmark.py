@@ -0,0 +1,65 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Libraries only the ingestion worker needs, a web worker must boot without them.
+HEAVY_MODULES = (
+    'geopandas', 'pandas', 'numpy', 'shapely', 'sqlalchemy', 'geoalchemy2',
+    'geoserver', 'geo', 'pyogrio', 'fiona', 'ijson', 'pyarrow',
+)
+
+# Run in a fresh interpreter for every sample: boot Django and import everything a
+# request to the read-only API touches, then report the time and what got loaded.
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+import geojson.views, geojson.responses, geojson.cache, geojson.tiles, geojson.export
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in sys.argv[1:] if name in sys.modules)
+print(json.dumps({'seconds': elapsed, 'heavy': heavy}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure process startup on the API path and check that no ingestion library is imported."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Number of fresh interpreters to start.")
+
+    def probe(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, *HEAVY_MODULES],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup probe failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        samples = [self.probe() for _ in range(max(options['repeat'], 1))]
+        seconds = [sample['seconds'] for sample in samples]
+        self.stdout.write(
+            f"API startup over {len(seconds)} runs: min {min(seconds):.3f}s, "
+            f"median {statistics.median(seconds):.3f}s, max {max(seconds):.3f}s"
+        )
+        heavy = sorted({name for sample in samples for name in sample['heavy']})
+        if heavy:
+            raise CommandError(f"Ingestion libraries imported on the API path: {', '.join(heavy)}")
+        self.stdout.write(self.style.SUCCESS("No ingestion libraries imported on the API path."))
@@ -0,0 +1,380 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .loader import STAGING_TABLE, dependent_objects, quote, upsert_sql
+from .models import (
+  JSONBus,
+  Lines,
+  NominalGeneratorCapacity,
+  OptimalGeneratorCapacity,
+  NominalStorageCapacity,
+  OptimalStorageCapacity
+)
+from .scenarios import DEFAULT_SCENARIO, ensure_partition, partition_name, scenario_table
+
+logger = logging.getLogger(__name__)
+
+#########################################################################################
+# View definitions
+#########################################################################################
+
+# The API models read from these relations. They are tables partitioned by scenario
+# (materialized views cannot be partitioned), and each partition holds the result of
+# the view query over the uploaded component tables of its scenario (the uploads named
+# in settings.MATVIEW_SOURCE_UPLOADS), so that the bus joins are computed once per
+# ingestion instead of on every request.
+
+# Buses are uploaded as GeoJSON, the other components as JSON.
+SOURCE_PREFIXES = {'buses': 'geojson_'}
+
+
+def source_table(kind, scenario=DEFAULT_SCENARIO):
+    # Named the way ingestion names the table of an upload.
+    prefix = SOURCE_PREFIXES.get(kind, 'json_')
+    return scenario_table(f'{prefix}{settings.MATVIEW_SOURCE_UPLOADS[kind]}', scenario)
+
+
+def source(kind, scenario=DEFAULT_SCENARIO):
+    return '"' + source_table(kind, scenario).replace('"', '""') + '"'
+
+
+def source_kind(table_name, scenario=DEFAULT_SCENARIO):
+    # The component an upload table is the source of, or None.
+    for kind in settings.MATVIEW_SOURCE_UPLOADS:
+        if source_table(kind, scenario) == table_name:
+            return kind
+    return None
+
+
+# Columns a generator can be keyed by when its upload declares no key field: the
+# name PyPSA gives every generator, as exported by the dashboard or by the network
+# import.
+GENERATOR_KEYS = ('Generator', 'name')
+
+
+def upload_key_field(kind, scenario):
+    # The key field declared by the latest upload of the source, or ''.
+    upload = (JSONBus.objects
+              .filter(name=settings.MATVIEW_SOURCE_UPLOADS[kind], scenario=scenario)
+              .exclude(key_field='')
+              .order_by('-uploaded_time')
+              .first())
+    return upload.key_field if upload else ''
+
+
+def generators_key(cursor, scenario):
+    # id must stay the same when the generators are uploaded again, like "Line". Without
+    # a name column generators are keyed by bus and carrier like in PyPSA, which is only
+    # unique when no bus has two generators of one carrier: numbering them by their
+    # order in the table would renumber them whenever an upsert moves rows.
+    table = f"public.{source('generators', scenario)}"
+    columns = relation_columns(cursor, table)
+    key_field = upload_key_field('generators', scenario)
+    candidates = (key_field, *GENERATOR_KEYS) if key_field else GENERATOR_KEYS
+    key = next((column for column in candidates if column in columns), None)
+    if key is not None:
+        return key
+    cursor.execute(f'SELECT bus, carrier FROM {table} GROUP BY bus, carrier HAVING count(*) > 1 LIMIT 5')
+    duplicates = [f'{carrier} at {bus}' for bus, carrier in cursor.fetchall()]
+    if duplicates:
+        raise ValueError(f"The generators of scenario '{scenario}' have several generators of one carrier "
+                         f"at a bus ({', '.join(duplicates)}) and none of the key columns "
+                         f"{', '.join(candidates)} to tell them apart")
+    return None
+
+
+def generator_query(capacity, scenario):
+    with connection.cursor() as cursor:
+        key = generators_key(cursor, scenario)
+    generator_id = f'g.{quote(key)}::text' if key else "g.bus || ' ' || g.carrier"
+    return f"""
+    SELECT
+        {generator_id} AS id,
+        b."Bus", b.v_nom, b.country, b.x, b.y, b.control, b.generator, b.type, b.unit,
+        b.v_mag_pu_set, b.v_mag_pu_min, b.sub_network, b.geom,
+        g.carrier, g.{capacity}
+    FROM public.{source('generators', scenario)} g
+    JOIN public.{source('buses', scenario)} b ON b."Bus" = g.bus
+    """
+
+
+def storage_query(capacity, scenario):
+    return f"""
+    SELECT s."Bus", b.geom, s.carrier, s.{capacity}
+    FROM (
+        SELECT bus AS "Bus", carrier, sum({capacity}) AS {capacity}
+        FROM public.{source('storage_units', scenario)}
+        GROUP BY bus, carrier
+    ) s
+    JOIN public.{source('buses', scenario)} b ON b."Bus" = s."Bus"
+    """
+
+
+# Columns a line can be keyed by when its upload declares no key field: the "Line"
+# of the dashboard's own exports, then the name PyPSA gives every line.
+LINE_KEYS = ('Line', 'name')
+
+
+def lines_key(cursor, scenario):
+    # "Line" must stay the same when the lines are uploaded again, the time series,
+    # the line loading frames and the pagination cursors refer to lines by it.
+    columns = relation_columns(cursor, f"public.{source('lines', scenario)}")
+    key_field = upload_key_field('lines', scenario)
+    candidates = (key_field, *LINE_KEYS) if key_field else LINE_KEYS
+    key = next((column for column in candidates if column in columns), None)
+    if key is None:
+        raise ValueError(f"The lines of scenario '{scenario}' have none of the key columns "
+                         f"{', '.join(candidates)}")
+    return key, columns
+
+
+def lines_query(scenario):
+    with connection.cursor() as cursor:
+        key, columns = lines_key(cursor, scenario)
+    others = ''.join(f'l.{quote(column)}, ' for column in sorted(columns) if column != 'Line')
+    return f"""
+    SELECT l.{quote(key)}::text AS "Line", {others}
+           ST_MakeLine(b0.geom, b1.geom)::geometry(LineString, 4326) AS line_geom
+    FROM public.{source('lines', scenario)} l
+    LEFT JOIN public.{source('buses', scenario)} b0 ON b0."Bus" = l.bus0
+    LEFT JOIN public.{source('buses', scenario)} b1 ON b1."Bus" = l.bus1
+    """
+
+
+# The columns of each table are those of its API model, plus the scenario. The key
+# columns identify a row within its scenario; prefixed with the scenario they make
+# up uid, the primary key of the model, unique across scenarios.
+VIEW_TABLES = {
+    'network_lines_view': {
+        'query': lines_query,
+        'model': Lines,
+        'sources': ('lines', 'buses'),
+        'key': ('Line',),
+        'geometry': 'line_geom',
+        'indexes': ('carrier', 'v_nom', 'sub_network'),
+    },
+    'view_nominal_generator_capacity_with_geom': {
+        'query': lambda scenario: generator_query('p_nom', scenario),
+        'model': NominalGeneratorCapacity,
+        'sources': ('generators', 'buses'),
+        'key': ('id',),
+        'geometry': 'geom',
+        'indexes': ('carrier', 'country', 'v_nom', 'sub_network'),
+    },
+    'view_optimal_generator_capacity_with_geom': {
+        'query': lambda scenario: generator_query('p_nom_opt', scenario),
+        'model': OptimalGeneratorCapacity,
+        'sources': ('generators', 'buses'),
+        'key': ('id',),
+        'geometry': 'geom',
+        'indexes': ('carrier', 'country', 'v_nom', 'sub_network'),
+    },
+    'view_nominal_storage_unit_capacity_with_geom': {
+        'query': lambda scenario: storage_query('p_nom', scenario),
+        'model': NominalStorageCapacity,
+        'sources': ('storage_units', 'buses'),
+        'key': ('Bus', 'carrier'),
+        'geometry': 'geom',
+        'indexes': ('carrier',),
+    },
+    'view_optimal_storage_unit_capacity_with_geom': {
+        'query': lambda scenario: storage_query('p_nom_opt', scenario),
+        'model': OptimalStorageCapacity,
+        'sources': ('storage_units', 'buses'),
+        'key': ('Bus', 'carrier'),
+        'geometry': 'geom',
+        'indexes': ('carrier',),
+    },
+}
+
+#########################################################################################
+# Create and refresh
+#########################################################################################
+
+def views_for(kind):
+    return [name for name, config in VIEW_TABLES.items() if kind in config['sources']]
+
+
+def relation_kind(cursor, name):
+    cursor.execute(
+        """
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = %s
+        """,
+        [name],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class MissingSourcesError(ValueError):
+    pass
+
+
+def missing_sources(cursor, name, scenario):
+    missing = []
+    for kind in VIEW_TABLES[name]['sources']:
+        cursor.execute("SELECT to_regclass(%s)", [f'public.{source(kind, scenario)}'])
+        if cursor.fetchone()[0] is None:
+            missing.append(source_table(kind, scenario))
+    return missing
+
+
+def table_columns(name):
+    # (column, type) pairs of the model fields, the scenario is not a model column.
+    model = VIEW_TABLES[name]['model']
+    return [(field.column, field.db_type(connection)) for field in model._meta.concrete_fields
+            if field.column != 'scenario']
+
+
+def select_columns(name, available, scenario):
+    # Columns missing from the relation read from are left NULL, the others are cast
+    # to the type of the table.
+    key = ', '.join(f'q."{column}"::text' for column in VIEW_TABLES[name]['key'])
+    values = {'uid': f"concat_ws('/', '{scenario}'::text, {key})::varchar(255)"}
+    return ', '.join(
+        values.get(column) or (f'q."{column}"::{db_type}' if column in available else f'NULL::{db_type}')
+        for column, db_type in table_columns(name)
+    )
+
+
+def relation_columns(cursor, relation):
+    cursor.execute(f'SELECT * FROM {relation} q LIMIT 0')
+    return {column[0] for column in cursor.description}
+
+
+def rename_relation(cursor, name, kind):
+    # Moves a relation of an earlier version out of the way, its indexes included
+    # since index names are schema-wide.
+    old = f'{name}_old'
+    relation = 'MATERIALIZED VIEW' if kind == 'm' else 'TABLE'
+    cursor.execute(f'ALTER {relation} public.{name} RENAME TO {old}')
+    cursor.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = to_regclass(%s)",
+                   [f'public.{old}'])
+    for (index,) in cursor.fetchall():
+        cursor.execute(f'ALTER INDEX {index} RENAME TO "{index.strip(chr(34))[:59]}_old"')
+    return old
+
+
+def create_table(cursor, name):
+    # Replaces the materialized view, plain table or view of the same name that
+    # earlier versions created. The rows of a materialized view or table move to the
+    # partition of the default scenario, and the relation is then dropped unless
+    # other views still read from it. Indexes declared on the parent are created on
+    # every partition, now and when a scenario is added.
+    config = VIEW_TABLES[name]
+    kind = relation_kind(cursor, name)
+    old = None
+    if kind in ('m', 'r'):
+        old = rename_relation(cursor, name, kind)
+    elif kind == 'v':
+        cursor.execute(f'DROP VIEW public.{name}')
+
+    columns = ', '.join(f'"{column}" {db_type}' for column, db_type in table_columns(name))
+    cursor.execute(
+        f'CREATE TABLE public.{name} (scenario varchar(40) NOT NULL, {columns}) PARTITION BY LIST (scenario)'
+    )
+    if old:
+        partition = ensure_partition(cursor, name, DEFAULT_SCENARIO)
+        names = ', '.join(f'"{column}"' for column, _ in table_columns(name))
+        values = select_columns(name, relation_columns(cursor, f'public.{old}'), DEFAULT_SCENARIO)
+        cursor.execute(f'INSERT INTO public.{partition} (scenario, {names}) SELECT %s, {values} FROM public.{old} q',
+                       [DEFAULT_SCENARIO])
+        logger.info(f"Moved {cursor.rowcount} rows of '{name}' to its partition '{partition}'")
+        dependents = dependent_objects(cursor, old)
+        if dependents:
+            logger.warning(f"Kept '{old}', {', '.join(dependents)} still read from it.")
+        else:
+            cursor.execute(f'DROP {"MATERIALIZED VIEW" if kind == "m" else "TABLE"} public.{old}')
+
+    cursor.execute(f'CREATE UNIQUE INDEX uniq_{name} ON public.{name} (scenario, uid)')
+    cursor.execute(
+        f'CREATE INDEX idx_{name}_{config["geometry"]} ON public.{name} USING gist ({config["geometry"]})'
+    )
+    for column in config['indexes']:
+        cursor.execute(f'CREATE INDEX idx_{name}_{column.lower()} ON public.{name} USING btree ("{column}")')
+
+
+def ensure_tables():
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in VIEW_TABLES:
+            if relation_kind(cursor, name) != 'p':
+                create_table(cursor, name)
+
+
+def fill_partition(cursor, name, scenario):
+    # Applied the way REFRESH MATERIALIZED VIEW CONCURRENTLY does: the view query fills
+    # a temporary table, which is diffed against the partition on uid, and only the
+    # rows that changed are deleted, updated or inserted. No lock is taken beyond the
+    # rows written, so readers of the scenario keep reading the previous rows until
+    # commit instead of waiting for the refresh. Returns the change counts.
+    query = VIEW_TABLES[name]['query'](scenario)
+    columns = [('scenario', None), *table_columns(name)]
+    names = ', '.join(f'"{column}"' for column, _ in columns)
+    values = select_columns(name, relation_columns(cursor, f'({query})'), scenario)
+    partition = partition_name(name, scenario)
+    cursor.execute(f'CREATE TEMP TABLE {STAGING_TABLE} (LIKE public.{partition}) ON COMMIT DROP')
+    cursor.execute(f'INSERT INTO pg_temp.{STAGING_TABLE} ({names}) SELECT %s, {values} FROM ({query}) q',
+                   [scenario])
+    cursor.execute(f'CREATE UNIQUE INDEX ON pg_temp.{STAGING_TABLE} (uid)')
+    cursor.execute(f'ANALYZE pg_temp.{STAGING_TABLE}')
+    changes = {}
+    for change, sql in upsert_sql(partition, 'uid', columns).items():
+        cursor.execute(sql)
+        changes[change] = cursor.rowcount
+    cursor.execute(f'DROP TABLE pg_temp.{STAGING_TABLE}')
+    if any(changes.values()):
+        cursor.execute(f'ANALYZE public.{partition}')
+    return changes
+
+
+def refresh_view(name, scenario=DEFAULT_SCENARIO, create=False):
+    # Returns the seconds spent. Refuses to run when uploads the table is built from
+    # are missing, rather than empty the partition. Only the partition of the scenario
+    # is rewritten, in one transaction, and the other scenarios are not touched at all.
+    start = time.monotonic()
+    with transaction.atomic(), connection.cursor() as cursor:
+        missing = missing_sources(cursor, name, scenario)
+        if missing:
+            raise MissingSourcesError(
+                f"Cannot build '{name}' of scenario '{scenario}', missing source tables: {', '.join(missing)}"
+            )
+        if relation_kind(cursor, name) != 'p':
+            create_table(cursor, name)
+            action = 'Created'
+        elif create:
+            cursor.execute(f'DROP TABLE IF EXISTS public.{partition_name(name, scenario)}')
+            action = 'Created'
+        else:
+            action = 'Refreshed'
+        partition = ensure_partition(cursor, name, scenario)
+        changes = fill_partition(cursor, name, scenario)
+    # VACUUM cannot run in a transaction; it reclaims the rows replaced by the refresh
+    # and sets the visibility map, which index-only scans of the partition rely on.
+    if any(changes.values()) and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute(f'VACUUM public.{partition}')
+    elapsed = time.monotonic() - start
+    logger.info(f"{action} '{name}' of scenario '{scenario}' in {elapsed:.2f}s: {changes['inserted']} inserted, "
+                f"{changes['updated']} updated and {changes['deleted']} deleted rows")
+    return elapsed
+
+
+def refresh_views(names=None, scenario=DEFAULT_SCENARIO, create=False):
+    timings = {}
+    for name in names or VIEW_TABLES:
+        try:
+            timings[name] = refresh_view(name, scenario=scenario, create=create)
+        except MissingSourcesError as e:
+            logger.warning(str(e))
+            timings[name] = None
+    return timings
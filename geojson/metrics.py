@@ -0,0 +1,279 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import hmac
+import ipaddress
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse
+
+logger = logging.getLogger(__name__)
+
+# Request and ingestion metrics in the Prometheus text format. Every process (web
+# workers, the ingestion worker) aggregates its observations in memory and adds them
+# to one Redis hash every METRICS_FLUSH_INTERVAL seconds, so /metrics reports the
+# totals of all processes whichever worker serves it.
+METRICS_KEY = 'geojson:metrics'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+INGESTION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RATE_BUCKETS = (100, 1e3, 1e4, 5e4, 1e5, 5e5, 1e6)
+
+HISTOGRAMS = {
+    'dashboard_request_duration_seconds': ("Time spent handling a request.", SECONDS_BUCKETS),
+    'dashboard_request_db_seconds': ("Time spent in SQL queries per request.", SECONDS_BUCKETS),
+    'dashboard_request_queries': ("SQL queries per request.", QUERY_BUCKETS),
+    'dashboard_request_serialization_seconds': ("Time spent serializing the response body.", SECONDS_BUCKETS),
+    'dashboard_response_bytes': ("Size of the response body.", BYTES_BUCKETS),
+    'dashboard_ingestion_duration_seconds': ("Duration of ingestion jobs.", INGESTION_BUCKETS),
+    'dashboard_ingestion_rows_per_second': ("Rows written per second by ingestion jobs.", RATE_BUCKETS),
+}
+COUNTERS = {
+    'dashboard_ingestion_rows_total': "Rows inserted, updated or deleted by ingestion jobs.",
+}
+
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+_local = threading.local()
+
+#########################################################################################
+# Registry
+#########################################################################################
+
+def label_string(labels):
+    return ','.join(
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('|', '/') + '"'
+        for name, value in sorted(labels.items())
+    )
+
+
+def observe(name, value, **labels):
+    # Buckets are stored cumulatively, like they are exposed.
+    labels = label_string(labels)
+    with _pending_lock:
+        for bound in HISTOGRAMS[name][1]:
+            if value <= bound:
+                key = f'{name}|{labels}|{bound:g}'
+                _pending[key] = _pending.get(key, 0) + 1
+        for suffix, amount in (('+Inf', 1), ('sum', value), ('count', 1)):
+            key = f'{name}|{labels}|{suffix}'
+            _pending[key] = _pending.get(key, 0) + amount
+
+
+def increment(name, amount=1, **labels):
+    key = f'{name}|{label_string(labels)}|'
+    with _pending_lock:
+        _pending[key] = _pending.get(key, 0) + amount
+
+
+def flush(force=False):
+    if not force and time.monotonic() - _last_flush[0] < settings.METRICS_FLUSH_INTERVAL:
+        return
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.monotonic()
+    if not pending:
+        return
+    try:
+        from django_redis import get_redis_connection
+
+        pipeline = get_redis_connection(settings.API_CACHE_ALIAS).pipeline(transaction=False)
+        for key, amount in pending.items():
+            pipeline.hincrbyfloat(METRICS_KEY, key, amount)
+        pipeline.execute()
+    except Exception as e:
+        # Keep the observations for the next flush rather than losing them.
+        logger.warning(f"Could not flush metrics: {e}")
+        with _pending_lock:
+            for key, amount in pending.items():
+                _pending[key] = _pending.get(key, 0) + amount
+
+
+def read_metrics():
+    from django_redis import get_redis_connection
+
+    flush(force=True)
+    values = get_redis_connection(settings.API_CACHE_ALIAS).hgetall(METRICS_KEY)
+    return {key.decode(): float(value) for key, value in values.items()}
+
+#########################################################################################
+# Exposition
+#########################################################################################
+
+def format_value(value):
+    return f'{value:.0f}' if value == int(value) else repr(value)
+
+
+def sample(name, labels, value, extra=''):
+    labels = ','.join(part for part in (labels, extra) if part)
+    return f'{name}{{{labels}}} {format_value(value)}' if labels else f'{name} {format_value(value)}'
+
+
+def render_metrics(gauges=()):
+    # gauges: (name, help, [(labels dict, value)]) computed at scrape time.
+    series = {}
+    for key, value in read_metrics().items():
+        name, labels, suffix = key.split('|', 2)
+        series.setdefault(name, {}).setdefault(labels, {})[suffix] = value
+
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for labels, values in sorted(series.get(name, {}).items()):
+            for bound in buckets:
+                lines.append(sample(f'{name}_bucket', labels, values.get(f'{bound:g}', 0), f'le="{bound:g}"'))
+            lines.append(sample(f'{name}_bucket', labels, values.get('+Inf', 0), 'le="+Inf"'))
+            lines.append(sample(f'{name}_sum', labels, values.get('sum', 0)))
+            lines.append(sample(f'{name}_count', labels, values.get('count', 0)))
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for labels, values in sorted(series.get(name, {}).items()):
+            lines.append(sample(name, labels, values.get('', 0)))
+    for name, help_text, samples in gauges:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for labels, value in samples:
+            lines.append(sample(name, label_string(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    # Scrapes come from METRICS_ALLOWED_IPS (addresses or networks, compared with
+    # REMOTE_ADDR) or carry METRICS_TOKEN as a bearer token.
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+#########################################################################################
+# Request timing
+#########################################################################################
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.phases = {'db': 0.0, 'serialization': 0.0, 'compression': 0.0}
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.phases['db'] += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        entries = [f'db;dur={self.phases["db"] * 1000:.1f};desc="{self.queries} queries"']
+        entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.phases.items()
+                    if name != 'db' and seconds]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def phase(name):
+    # Adds the time spent in the block to a phase of the current request, if any.
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[name] += time.perf_counter() - start
+
+
+def record_request(stats, endpoint, method, status, size):
+    labels = {'endpoint': endpoint}
+    observe('dashboard_request_duration_seconds', time.perf_counter() - stats.start,
+            method=method, status=status, **labels)
+    observe('dashboard_request_db_seconds', stats.phases['db'], **labels)
+    observe('dashboard_request_queries', stats.queries, **labels)
+    observe('dashboard_request_serialization_seconds', stats.phases['serialization'], **labels)
+    observe('dashboard_response_bytes', size, **labels)
+    flush()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.func.__name__
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED or request.path == '/metrics':
+            return self.get_response(request)
+        stats = RequestStats()
+        _local.stats = stats
+        try:
+            with connection.execute_wrapper(stats.record_query):
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+
+        endpoint = endpoint_name(request)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = stats.server_timing(time.perf_counter() - stats.start)
+        if isinstance(response, FileResponse):
+            # Left unwrapped so the server can send the file with wsgi.file_wrapper.
+            size = int(response.get('Content-Length') or 0)
+            record_request(stats, endpoint, request.method, response.status_code, size)
+        elif response.streaming:
+            # The body (and the queries of a server-side cursor) run while it is sent.
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, stats, endpoint, request.method, response.status_code
+            )
+        else:
+            record_request(stats, endpoint, request.method, response.status_code, len(response.content))
+        return response
+
+    def measure_stream(self, content, stats, endpoint, method, status):
+        size = 0
+        _local.stats = stats
+        try:
+            with connection.execute_wrapper(stats.record_query):
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            _local.stats = None
+            record_request(stats, endpoint, method, status, size)
+
+#########################################################################################
+# Ingestion
+#########################################################################################
+
+def record_ingestion(job):
+    labels = {'kind': job.kind}
+    observe('dashboard_ingestion_duration_seconds', job.duration, status=job.status, **labels)
+    rows = 0
+    for change in ('inserted', 'updated', 'deleted'):
+        count = getattr(job, change) or 0
+        rows += count
+        if count:
+            increment('dashboard_ingestion_rows_total', count, change=change, **labels)
+    if rows and job.duration:
+        observe('dashboard_ingestion_rows_per_second', rows / job.duration, **labels)
+    flush(force=True)
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# The API models are unmanaged, so the GiST indexes declared with db_index=True on
+# their geometry columns are never created by Django. Create them here for the
+# tables that already exist, which lets the bbox filter use an index scan.
+SPATIAL_INDEXES = [
+    ('network_lines_view', 'line_geom'),
+    ('view_nominal_generator_capacity_with_geom', 'geom'),
+    ('view_optimal_generator_capacity_with_geom', 'geom'),
+    ('view_nominal_storage_unit_capacity_with_geom', 'geom'),
+    ('view_optimal_storage_unit_capacity_with_geom', 'geom'),
+]
+
+
+def create_index_sql(table, column):
+    return f"""
+    DO $$
+    BEGIN
+        IF to_regclass('public.{table}') IS NOT NULL THEN
+            CREATE INDEX IF NOT EXISTS idx_{table}_{column}
+                ON public.{table} USING gist ({column});
+            ANALYZE public.{table};
+        END IF;
+    END $$;
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0006_alter_bus_geometry'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=create_index_sql(table, column),
+            reverse_sql=f"DROP INDEX IF EXISTS public.idx_{table}_{column};",
+        )
+        for table, column in SPATIAL_INDEXES
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0007_spatial_indexes'),
+    ]
+
+    # Simplified line geometries per zoom band, filled by geojson.lod.rebuild_line_lods
+    # (run `manage.py rebuild_line_lods` once after migrating an existing database).
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE IF NOT EXISTS public.network_lines_lod (
+                lod smallint NOT NULL,
+                "Line" integer NOT NULL,
+                line_geom public.geometry(Geometry, 4326),
+                PRIMARY KEY (lod, "Line")
+            );
+            """,
+            reverse_sql="DROP TABLE IF EXISTS public.network_lines_lod;",
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Btree indexes backing the attribute filters and the keyset pagination of the API
+# endpoints. The tables are not managed by Django, so indexes are only created on
+# the tables and columns that exist.
+ATTRIBUTE_INDEXES = {
+    'network_lines_view': ['Line', 'carrier', 'v_nom', 'sub_network'],
+    'view_nominal_generator_capacity_with_geom': ['id', 'carrier', 'country', 'v_nom', 'sub_network'],
+    'view_optimal_generator_capacity_with_geom': ['id', 'carrier', 'country', 'v_nom', 'sub_network'],
+    'view_nominal_storage_unit_capacity_with_geom': ['Bus', 'carrier'],
+    'view_optimal_storage_unit_capacity_with_geom': ['Bus', 'carrier'],
+}
+
+
+def index_name(table, column):
+    return f'idx_{table}_{column.lower()}'
+
+
+def create_index_sql(table, column):
+    return f"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = '{table}' AND column_name = '{column}'
+        ) THEN
+            CREATE INDEX IF NOT EXISTS {index_name(table, column)}
+                ON public.{table} USING btree ("{column}");
+        END IF;
+    END $$;
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0008_network_lines_lod'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=create_index_sql(table, column),
+            reverse_sql=f"DROP INDEX IF EXISTS public.{index_name(table, column)};",
+        )
+        for table, columns in ATTRIBUTE_INDEXES.items()
+        for column in columns
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0009_attribute_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('progress', models.FloatField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('created_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_time', models.DateTimeField(blank=True, null=True)),
+                ('finished_time', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_time'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# GiST index on the region polygons, used by the point-in-polygon join of the
+# region breakdown in /api/capacity/summary.
+REGION_TABLES = [
+    ('gadm_shapes', 'geom'),
+    ('country_shapes', 'geom'),
+]
+
+
+def create_index_sql(table, column):
+    return f"""
+    DO $$
+    BEGIN
+        IF to_regclass('public.{table}') IS NOT NULL THEN
+            CREATE INDEX IF NOT EXISTS idx_{table}_{column}
+                ON public.{table} USING gist ({column});
+            ANALYZE public.{table};
+        END IF;
+    END $$;
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0010_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=create_index_sql(table, column),
+            reverse_sql=f"DROP INDEX IF EXISTS public.idx_{table}_{column};",
+        )
+        for table, column in REGION_TABLES
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0011_region_indexes'),
+    ]
+
+    # Generator and storage capacity clusters per zoom band, filled by
+    # geojson.clusters.rebuild_capacity_clusters after every ingestion.
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE IF NOT EXISTS public.capacity_clusters (
+                layer varchar(64) NOT NULL,
+                band smallint NOT NULL,
+                cluster integer NOT NULL,
+                geom public.geometry(Point, 4326) NOT NULL,
+                capacity double precision,
+                count integer NOT NULL,
+                carriers jsonb NOT NULL,
+                PRIMARY KEY (layer, band, cluster)
+            );
+            CREATE INDEX IF NOT EXISTS idx_capacity_clusters_geom
+                ON public.capacity_clusters USING gist (geom);
+            """,
+            reverse_sql="DROP TABLE IF EXISTS public.capacity_clusters;",
+        ),
+    ]
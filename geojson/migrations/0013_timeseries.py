@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0012_capacity_clusters'),
+    ]
+
+    # Time series of the *_t JSON uploads, filled by geojson.timeseries.store_timeseries:
+    # one real[] per component name and attribute, and the snapshot axis they share.
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE IF NOT EXISTS public.timeseries_snapshots (
+                component varchar(64) NOT NULL,
+                attribute varchar(64) NOT NULL,
+                position integer NOT NULL,
+                snapshot timestamp NOT NULL,
+                PRIMARY KEY (component, attribute, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_timeseries_snapshots_snapshot
+                ON public.timeseries_snapshots (component, attribute, snapshot);
+            CREATE TABLE IF NOT EXISTS public.timeseries (
+                component varchar(64) NOT NULL,
+                attribute varchar(64) NOT NULL,
+                name varchar(255) NOT NULL,
+                "values" real[] NOT NULL,
+                PRIMARY KEY (component, attribute, name)
+            );
+            """,
+            reverse_sql="""
+            DROP TABLE IF EXISTS public.timeseries;
+            DROP TABLE IF EXISTS public.timeseries_snapshots;
+            """,
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0013_timeseries'),
+    ]
+
+    # Quantized line loading per snapshot, filled by
+    # geojson.frames.rebuild_line_loading_frames, and the line order of the frames.
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE IF NOT EXISTS public.line_loading_lines (
+                position integer PRIMARY KEY,
+                "Line" integer NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS public.line_loading_frames (
+                position integer PRIMARY KEY,
+                snapshot timestamp NOT NULL,
+                frame bytea NOT NULL
+            );
+            """,
+            reverse_sql="""
+            DROP TABLE IF EXISTS public.line_loading_frames;
+            DROP TABLE IF EXISTS public.line_loading_lines;
+            """,
+        ),
+    ]
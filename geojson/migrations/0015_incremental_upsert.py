@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0014_line_loading_frames'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='key_field',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='jsonbus',
+            name='key_field',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='inserted',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='updated',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='deleted',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
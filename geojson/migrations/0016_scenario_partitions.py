@@ -0,0 +1,261 @@
+import django.core.validators
+from django.db import migrations, models
+
+# The tables derived from the uploads are partitioned by LIST on the scenario, one
+# partition per network run. Existing rows move to the partition of the default
+# scenario: each table is renamed, recreated as a partitioned table and copied over.
+PARTITIONED_TABLES = {
+    'network_lines_lod': {
+        'prefix': 'lines_lod',
+        'columns': """
+            lod smallint NOT NULL,
+            "Line" integer NOT NULL,
+            line_geom public.geometry(Geometry, 4326)
+        """,
+        'names': 'lod, "Line", line_geom',
+        'primary_key': 'lod, "Line"',
+        'indexes': [],
+    },
+    'capacity_clusters': {
+        'prefix': 'capacity_clusters',
+        'columns': """
+            layer varchar(64) NOT NULL,
+            band smallint NOT NULL,
+            cluster integer NOT NULL,
+            geom public.geometry(Point, 4326) NOT NULL,
+            capacity double precision,
+            count integer NOT NULL,
+            carriers jsonb NOT NULL
+        """,
+        'names': 'layer, band, cluster, geom, capacity, count, carriers',
+        'primary_key': 'layer, band, cluster',
+        'indexes': ['CREATE INDEX idx_capacity_clusters_geom ON public.capacity_clusters USING gist (geom)'],
+    },
+    'timeseries_snapshots': {
+        'prefix': 'timeseries_snapshots',
+        'columns': """
+            component varchar(64) NOT NULL,
+            attribute varchar(64) NOT NULL,
+            position integer NOT NULL,
+            snapshot timestamp NOT NULL
+        """,
+        'names': 'component, attribute, position, snapshot',
+        'primary_key': 'component, attribute, position',
+        'indexes': ['CREATE INDEX idx_timeseries_snapshots_snapshot '
+                    'ON public.timeseries_snapshots (component, attribute, snapshot)'],
+    },
+    'timeseries': {
+        'prefix': 'timeseries',
+        'columns': """
+            component varchar(64) NOT NULL,
+            attribute varchar(64) NOT NULL,
+            name varchar(255) NOT NULL,
+            "values" real[] NOT NULL
+        """,
+        'names': 'component, attribute, name, "values"',
+        'primary_key': 'component, attribute, name',
+        'indexes': [],
+    },
+    'line_loading_lines': {
+        'prefix': 'line_loading_lines',
+        'columns': """
+            position integer NOT NULL,
+            "Line" integer NOT NULL
+        """,
+        'names': 'position, "Line"',
+        'primary_key': 'position',
+        'indexes': [],
+    },
+    'line_loading_frames': {
+        'prefix': 'line_loading_frames',
+        'columns': """
+            position integer NOT NULL,
+            snapshot timestamp NOT NULL,
+            frame bytea NOT NULL
+        """,
+        'names': 'position, snapshot, frame',
+        'primary_key': 'position',
+        'indexes': [],
+    },
+}
+
+
+def partition_sql(table, config):
+    # Index names are schema-wide: the primary key of the old table is renamed, and
+    # the other indexes are created once the old table is gone.
+    return f"""
+    ALTER TABLE public.{table} RENAME TO {table}_old;
+    ALTER INDEX public.{table}_pkey RENAME TO {table}_old_pkey;
+    CREATE TABLE public.{table} (
+        scenario varchar(40) NOT NULL,
+        {config['columns']},
+        PRIMARY KEY (scenario, {config['primary_key']})
+    ) PARTITION BY LIST (scenario);
+    CREATE TABLE public.{config['prefix']}__default PARTITION OF public.{table} FOR VALUES IN ('default');
+    INSERT INTO public.{table} (scenario, {config['names']})
+        SELECT 'default', {config['names']} FROM public.{table}_old;
+    DROP TABLE public.{table}_old;
+    """ + ''.join(f'{index};\n' for index in config['indexes'])
+
+
+def reverse_partition_sql(table, config):
+    return f"""
+    ALTER TABLE public.{table} RENAME TO {table}_old;
+    ALTER INDEX public.{table}_pkey RENAME TO {table}_old_pkey;
+    CREATE TABLE public.{table} AS
+        SELECT {config['names']} FROM public.{table}_old WHERE scenario = 'default';
+    DROP TABLE public.{table}_old;
+    ALTER TABLE public.{table} ADD PRIMARY KEY ({config['primary_key']});
+    """ + ''.join(f'{index};\n' for index in config['indexes'])
+
+
+# The five API relations, as the models declared them when this migration was
+# written. They are frozen here, later changes go through later migrations.
+GENERATOR_COLUMNS = [
+    ('id', 'varchar(255)'), ('Bus', 'varchar(255)'), ('v_nom', 'double precision'),
+    ('country', 'varchar(255)'), ('x', 'double precision'), ('y', 'double precision'),
+    ('control', 'varchar(255)'), ('generator', 'varchar(255)'), ('type', 'varchar(255)'),
+    ('unit', 'varchar(255)'), ('v_mag_pu_set', 'double precision'), ('v_mag_pu_min', 'double precision'),
+    ('sub_network', 'varchar(255)'), ('geom', 'geometry(GEOMETRY,4326)'), ('carrier', 'varchar(255)'),
+]
+STORAGE_COLUMNS = [('Bus', 'varchar(255)'), ('geom', 'geometry(GEOMETRY,4326)'), ('carrier', 'varchar(255)')]
+VIEW_TABLES = {
+    'network_lines_view': {
+        'prefix': 'lines_view',
+        'columns': [
+            ('Line', 'integer'), ('bus0', 'varchar(255)'), ('bus1', 'varchar(255)'),
+            ('length', 'double precision'), ('num_parallel', 'double precision'), ('carrier', 'varchar(255)'),
+            ('type', 'varchar(255)'), ('s_max_pu', 'double precision'), ('s_nom', 'double precision'),
+            ('capital_cost', 'double precision'), ('s_nom_extendable', 'boolean'),
+            ('s_nom_min', 'double precision'), ('x', 'double precision'), ('r', 'double precision'),
+            ('b', 'double precision'), ('build_year', 'integer'), ('x_pu_eff', 'double precision'),
+            ('r_pu_eff', 'double precision'), ('s_nom_opt', 'double precision'), ('v_nom', 'double precision'),
+            ('g', 'double precision'), ('s_nom_max', 'double precision'), ('lifetime', 'double precision'),
+            ('terrain_factor', 'double precision'), ('v_ang_min', 'double precision'),
+            ('v_ang_max', 'double precision'), ('sub_network', 'varchar(255)'), ('x_pu', 'double precision'),
+            ('r_pu', 'double precision'), ('g_pu', 'double precision'), ('b_pu', 'double precision'),
+            ('line_geom', 'geometry(GEOMETRY,4326)'),
+        ],
+        'unique': ('Line',),
+        'geometry': 'line_geom',
+        'indexes': ('carrier', 'v_nom', 'sub_network'),
+    },
+    'view_nominal_generator_capacity_with_geom': {
+        'prefix': 'generators_nominal',
+        'columns': GENERATOR_COLUMNS + [('p_nom', 'double precision')],
+        'unique': ('id',),
+        'geometry': 'geom',
+        'indexes': ('carrier', 'country', 'v_nom', 'sub_network'),
+    },
+    'view_optimal_generator_capacity_with_geom': {
+        'prefix': 'generators_optimal',
+        'columns': GENERATOR_COLUMNS + [('p_nom_opt', 'double precision')],
+        'unique': ('id',),
+        'geometry': 'geom',
+        'indexes': ('carrier', 'country', 'v_nom', 'sub_network'),
+    },
+    'view_nominal_storage_unit_capacity_with_geom': {
+        'prefix': 'storage_nominal',
+        'columns': STORAGE_COLUMNS + [('p_nom', 'double precision')],
+        'unique': ('Bus', 'carrier'),
+        'geometry': 'geom',
+        'indexes': ('carrier',),
+    },
+    'view_optimal_storage_unit_capacity_with_geom': {
+        'prefix': 'storage_optimal',
+        'columns': STORAGE_COLUMNS + [('p_nom_opt', 'double precision')],
+        'unique': ('Bus', 'carrier'),
+        'geometry': 'geom',
+        'indexes': ('carrier',),
+    },
+}
+
+
+def create_view_table(cursor, table, config):
+    # Replaces the materialized view, table or view of earlier versions. The rows of a
+    # materialized view or table move to the default partition, the columns it lacks
+    # are left NULL; it is kept when other views still read from it.
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [f'public.{table}'])
+    row = cursor.fetchone()
+    kind = row[0] if row else None
+    if kind == 'p':
+        return
+    old = None
+    if kind in ('m', 'r'):
+        old = f'{table}_old'
+        relation = 'MATERIALIZED VIEW' if kind == 'm' else 'TABLE'
+        cursor.execute(f'ALTER {relation} public.{table} RENAME TO {old}')
+        cursor.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = to_regclass(%s)",
+                       [f'public.{old}'])
+        for (index,) in cursor.fetchall():
+            cursor.execute(f'ALTER INDEX {index} RENAME TO "{index.strip(chr(34))[:59]}_old"')
+    elif kind == 'v':
+        cursor.execute(f'DROP VIEW public.{table}')
+
+    columns = config['columns']
+    definitions = ', '.join(f'"{column}" {db_type}' for column, db_type in columns)
+    cursor.execute(
+        f'CREATE TABLE public.{table} (scenario varchar(40) NOT NULL, {definitions}) PARTITION BY LIST (scenario)'
+    )
+    if old:
+        partition = f"{config['prefix']}__default"
+        cursor.execute(f"CREATE TABLE public.{partition} PARTITION OF public.{table} FOR VALUES IN ('default')")
+        cursor.execute(f'SELECT * FROM public.{old} q LIMIT 0')
+        available = {column[0] for column in cursor.description}
+        names = ', '.join(f'"{column}"' for column, _ in columns)
+        values = ', '.join(
+            f'q."{column}"::{db_type}' if column in available else f'NULL::{db_type}'
+            for column, db_type in columns
+        )
+        cursor.execute(f"INSERT INTO public.{partition} (scenario, {names}) "
+                       f"SELECT 'default', {values} FROM public.{old} q")
+        cursor.execute(
+            "SELECT DISTINCT r.ev_class::regclass::text FROM pg_depend d "
+            "JOIN pg_rewrite r ON r.oid = d.objid "
+            "WHERE d.refobjid = to_regclass(%s) AND r.ev_class <> d.refobjid",
+            [f'public.{old}'],
+        )
+        if not cursor.fetchall():
+            cursor.execute(f'DROP {"MATERIALIZED VIEW" if kind == "m" else "TABLE"} public.{old}')
+
+    unique = ', '.join(f'"{column}"' for column in config['unique'])
+    cursor.execute(f'CREATE UNIQUE INDEX uniq_{table} ON public.{table} (scenario, {unique})')
+    cursor.execute(
+        f'CREATE INDEX idx_{table}_{config["geometry"]} ON public.{table} USING gist ({config["geometry"]})'
+    )
+    for column in config['indexes']:
+        cursor.execute(f'CREATE INDEX idx_{table}_{column.lower()} ON public.{table} USING btree ("{column}")')
+
+
+def create_view_tables(apps, schema_editor):
+    # The five API relations become partitioned tables as well, their rows moved to
+    # the default scenario. They are rebuilt from the uploads by the next refresh
+    # (manage.py refresh_views), not here.
+    with schema_editor.connection.cursor() as cursor:
+        for table, config in VIEW_TABLES.items():
+            create_view_table(cursor, table, config)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0015_incremental_upsert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='scenario',
+            field=models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}$', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')]),
+        ),
+        migrations.AddField(
+            model_name='jsonbus',
+            name='scenario',
+            field=models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}$', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')]),
+        ),
+        *[
+            migrations.RunSQL(sql=partition_sql(table, config), reverse_sql=reverse_partition_sql(table, config))
+            for table, config in PARTITIONED_TABLES.items()
+        ],
+        migrations.RunPython(create_view_tables, migrations.RunPython.noop),
+    ]
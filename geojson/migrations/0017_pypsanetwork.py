@@ -0,0 +1,23 @@
+import datetime
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0016_scenario_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PyPSANetwork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('network_file', models.FileField(upload_to='pypsa_networks/', validators=[django.core.validators.FileExtensionValidator(['nc', 'h5', 'hdf5'])])),
+                ('uploaded_time', models.DateTimeField(default=datetime.datetime.now)),
+                ('scenario', models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}$', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')])),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+# "Line" is the key of a line in its upload (the declared key field, "Line" or the
+# PyPSA name) instead of a number following the physical order of the rows, which
+# an upsert changes. The tables referring to lines store it as text; the lines
+# are rebuilt with the new keys by the next refresh (see 0019_view_uids).
+LINE_TABLES = ('network_lines_view', 'network_lines_lod', 'line_loading_lines')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0017_pypsanetwork'),
+    ]
+
+    operations = [
+        *[
+            migrations.RunSQL(
+                sql=f'ALTER TABLE public.{table} ALTER COLUMN "Line" TYPE varchar(255) USING "Line"::text;',
+                reverse_sql=migrations.RunSQL.noop,
+            )
+            for table in LINE_TABLES
+        ],
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# Line, id and Bus only identify a row within its scenario (storage units within
+# their bus and carrier), so none of them can be the primary key of the API models.
+# Each table gets uid, '<scenario>/<key>', unique across scenarios, which the
+# models declare as their primary key and the keyset pagination seeks on.
+# The lines keep the keys they had until they are rebuilt with the keys of 0018
+# (run `manage.py refresh_views network_lines_view --scenario <name>` once per
+# scenario after migrating an existing database).
+VIEW_KEYS = {
+    'network_lines_view': '"Line"',
+    'view_nominal_generator_capacity_with_geom': 'id',
+    'view_optimal_generator_capacity_with_geom': 'id',
+    'view_nominal_storage_unit_capacity_with_geom': '"Bus", carrier',
+    'view_optimal_storage_unit_capacity_with_geom': '"Bus", carrier',
+}
+
+
+def uid_sql(table, key):
+    return f"""
+    ALTER TABLE public.{table} ADD COLUMN IF NOT EXISTS uid varchar(255);
+    UPDATE public.{table} SET uid = concat_ws('/', scenario, {key});
+    ALTER TABLE public.{table} ALTER COLUMN uid SET NOT NULL;
+    DROP INDEX IF EXISTS public.uniq_{table};
+    CREATE UNIQUE INDEX uniq_{table} ON public.{table} (scenario, uid);
+    """
+
+
+def reverse_uid_sql(table, key):
+    return f"""
+    DROP INDEX IF EXISTS public.uniq_{table};
+    ALTER TABLE public.{table} DROP COLUMN uid;
+    CREATE UNIQUE INDEX uniq_{table} ON public.{table} (scenario, {key});
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0018_line_keys'),
+    ]
+
+    operations = [
+        *[
+            migrations.RunSQL(sql=uid_sql(table, key), reverse_sql=reverse_uid_sql(table, key))
+            for table, key in VIEW_KEYS.items()
+        ],
+    ]
@@ -0,0 +1,27 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geojson', '0019_view_uids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bus',
+            name='scenario',
+            field=models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}\\Z', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')]),
+        ),
+        migrations.AlterField(
+            model_name='jsonbus',
+            name='scenario',
+            field=models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}\\Z', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')]),
+        ),
+        migrations.AlterField(
+            model_name='pypsanetwork',
+            name='scenario',
+            field=models.CharField(default='default', max_length=40, validators=[django.core.validators.RegexValidator('^[a-z0-9][a-z0-9_]{0,39}\\Z', 'Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.')]),
+        ),
+    ]
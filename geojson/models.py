@@ -3,52 +3,79 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 #
 
-import os
-import glob
-import zipfile
-from sqlalchemy import *
-from geo.Geoserver import Geoserver
-from django.contrib.gis.db import models as gis_models
-from django.contrib.gis.geos import GEOSGeometry
-from django.db.models import JSONField 
 import datetime
-import json
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-import geopandas as gpd
-import pandas as pd
-from sqlalchemy import create_engine
-from geoserver.catalog import Catalog
-from geoalchemy2 import Geometry, WKTElement
-from sqlalchemy import text
-from sqlalchemy import MetaData
-from django.db import models
-
 import logging
 
-from environ import Env
-from urllib.parse import urlparse
+from django.conf import settings
+from django.contrib.gis.db import models as gis_models
+from django.core.validators import FileExtensionValidator
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
+from .scenarios import DEFAULT_SCENARIO, scenario_table, validate_scenario
 
-env = Env()
-env.read_env() 
+logger = logging.getLogger(__name__)
 
-GEOSERVER_URL = env("GEOSERVER_URL")
-GEOSERVER_USER = env("GEOSERVER_USER")
-GEOSERVER_PASS = env("GEOSERVER_PASS")
-DATABASE_URL = env("DATABASE_URL")
+#########################################################################################
+# Django model for ingestion jobs
+#########################################################################################
 
-db_url = urlparse(DATABASE_URL)
-db_name = db_url.path[1:]  
-db_host = db_url.hostname
-db_port = db_url.port or 5432 
-db_user = db_url.username
-db_password = db_url.password
+class IngestionJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20)  # Ingestion task, see geojson.ingestion.TASKS
+    object_id = models.PositiveBigIntegerField()  # Uploaded Bus / JSONBus instance
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    progress = models.FloatField(default=0)  # Percent
+    message = models.TextField(blank=True)
+    created_time = models.DateTimeField(default=timezone.now)
+    started_time = models.DateTimeField(null=True, blank=True)
+    finished_time = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # Seconds
+    # Rows changed in the target table, see geojson.loader.upsert_chunks.
+    inserted = models.PositiveBigIntegerField(null=True, blank=True)
+    updated = models.PositiveBigIntegerField(null=True, blank=True)
+    deleted = models.PositiveBigIntegerField(null=True, blank=True)
 
-logger = logging.getLogger(__name__)
+    class Meta:
+        ordering = ['-created_time']
 
-geo = Catalog(GEOSERVER_URL, username=GEOSERVER_USER, password=GEOSERVER_PASS)
-conn_str = DATABASE_URL
+    def __str__(self):
+        return f"{self.kind} {self.name} ({self.status})"
+
+    def set_progress(self, progress, message=''):
+        # Update only the progress columns, the row is polled by the admin meanwhile.
+        self.progress = progress
+        self.message = message
+        IngestionJob.objects.filter(pk=self.pk).update(progress=progress, message=message)
+        logger.info(f"Ingestion job {self.pk}: {progress:.0f}% {message}")
+
+    def record_changes(self, inserted, updated, deleted):
+        self.inserted, self.updated, self.deleted = inserted, updated, deleted
+        IngestionJob.objects.filter(pk=self.pk).update(inserted=inserted, updated=updated, deleted=deleted)
+        logger.info(f"Ingestion job {self.pk}: {inserted} inserted, {updated} updated, {deleted} deleted")
+
+
+def enqueue_ingestion(kind, instance):
+    # The job row is written in the same transaction as the upload, a worker picks it
+    # up once committed. With INGESTION_ASYNC disabled the job runs in the request.
+    job = IngestionJob.objects.create(kind=kind, object_id=instance.pk, name=instance.name)
+    if not settings.INGESTION_ASYNC:
+        from .ingestion import run_job
+        transaction.on_commit(lambda: run_job(job))
+    return job
 
 #########################################################################################
 # Django model for geojson files
@@ -60,58 +87,27 @@ class Bus(models.Model):
                                   null=True, blank=True)  # Field to load GeoJSON files
   uploaded_time = models.DateTimeField(default=datetime.datetime.now)  # load date 
   geometry = gis_models.GeometryField(srid=4326, db_index=True, null=True, blank=True)
+  # Column identifying a feature (e.g. Bus, Line). When set, a new upload under the same
+  # name updates the table in place; when blank the table is replaced.
+  key_field = models.CharField(max_length=100, blank=True)
+  # Network run the upload belongs to, see geojson.scenarios.
+  scenario = models.CharField(max_length=40, default=DEFAULT_SCENARIO, validators=[validate_scenario])
 
   def __str__(self):
     return self.name
 
 # Signal handlers
 #########################################################################################
-# Django post delete signal
+# Django post save signal
 #########################################################################################
 # This signal function is triggered after a Bus instance is saved.
 @receiver(post_save, sender=Bus)
 def publish_data(sender, instance, created, **kwargs):
-  if not created:
+  if not created or not instance.geojson_file:
     return  # Skip processing if the instance is not newly created.
-  
-  try:
-    # Process GeoJSON file if available for the new Bus instance.
-    if instance.geojson_file:
-      gdf = gpd.read_file(instance.geojson_file.path) # Load GeoJSON from the file into a GeoDataFrame for spatial operations.
-    
-      if not gdf.empty and 'geometry' in gdf and not gdf['geometry'].is_empty.all():
-        engine = create_engine(conn_str, echo=True) # Establish Database connection
-              
-        # Convert geometries to WKT format and load them into PostGIS, using 'geom' as the geometry column name.
-        gdf['geom'] = gdf['geometry'].apply(lambda x: x.wkt)
-        gdf.drop('geometry', axis=1, inplace=True)
-              
-        # Creates a table name with the prefix 'geojson'.
-        table_name = "geojson_" + instance.name 
-        gdf.to_sql(name=table_name, con=engine, if_exists='replace', index=False,
-                   dtype={'geom': Geometry('GEOMETRY', srid=4326)})
-
-        
-        # Publish the GeoJSON data to GeoServer using the GeoServer REST client.
-        GEOSERVER_URL = env("GEOSERVER_URL")
-        GEOSERVER_USER = env("GEOSERVER_USER")
-        GEOSERVER_PASS = env("GEOSERVER_PASS")
-        geo = Catalog(GEOSERVER_URL, username=GEOSERVER_USER, password=GEOSERVER_PASS)
-        geo.create_featurestore(
-            name='PyPSAEarthDashboard', 
-            workspace='PyPSAEarthDashboard', 
-            db=db_name, 
-            host=f'{db_host}:{db_port}', 
-            pg_user=db_user, 
-            pg_password=db_password, 
-            schema='public'
-        )
-        geo.publish_featurestore(workspace='PyPSAEarthDashboard', store_name='PyPSAEarthDashboard',
-                                         pg_table=instance.name)
-
-            
-  except Exception as e:
-    logger.error(f"Error processing file: {e}", exc_info=True)
+
+  # Loading and publishing the file runs in an ingestion worker, the admin returns immediately.
+  enqueue_ingestion('geojson', instance)
 
 
 #########################################################################################
@@ -120,16 +116,8 @@ def publish_data(sender, instance, created, **kwargs):
 
 @receiver(post_delete, sender=Bus)
 def delete_data(sender, instance, **kwargs):
-    DATABASE_URL = env("DATABASE_URL") ##
-    engine = create_engine(conn_str)
-    try:
-        geojson_table_name = f"geojson_{instance.name}"
-        sql = text(f"DROP TABLE IF EXISTS public.\"{geojson_table_name}\"")
-        with engine.begin() as connection:
-            connection.execute(sql)
-            logger.info(f"Table '{geojson_table_name}' deleted from the database.")
-    except Exception as e:
-        logger.error(f"Error deleting table for {geojson_table_name}: {e}")
+    from .ingestion import drop_table
+    drop_table(scenario_table(f"geojson_{instance.name}", instance.scenario), instance.scenario)
 
 
 #########################################################################################
@@ -140,6 +128,11 @@ class JSONBus(models.Model):
     name = models.CharField(max_length=100)
     json_file = models.FileField(upload_to='json_files/', null=True, blank=True)
     uploaded_time = models.DateTimeField(default=datetime.datetime.now)
+    # Column identifying a row (e.g. Bus, Line, Generator). When set, a new upload under
+    # the same name updates the table in place; when blank the table is replaced.
+    key_field = models.CharField(max_length=100, blank=True)
+    # Network run the upload belongs to, see geojson.scenarios.
+    scenario = models.CharField(max_length=40, default=DEFAULT_SCENARIO, validators=[validate_scenario])
 
     def __str__(self):
         return self.name
@@ -154,63 +147,58 @@ def publish_json_data(sender, instance, created, **kwargs):
         logger.info("Signal triggered, but no new file was created.")
         return
 
-    try:
-        logger.info(f"Processing JSON file for instance '{instance.name}'")
-        # Check if the file is accessible
-        if not os.path.isfile(instance.json_file.path):
-            logger.error(f"File not found at '{instance.json_file.path}'")
-            return
-
-        # Load JSON file into a Python dictionary
-        with open(instance.json_file.path, 'r') as file:
-            json_data = json.load(file)
-
-        # Check if 'data' key exists and it's not empty
-        if 'data' in json_data and json_data['data']:
-            # Process JSON data based on its structure
-            if 'columns' in json_data:
-                # Use 'columns' key for DataFrame columns if it exists
-                json_df = pd.DataFrame(json_data['data'], columns=json_data['columns'])
-            else:
-                # If no 'columns' key, assume data is a list of dictionaries
-                json_df = pd.DataFrame(json_data['data'])
-
-            logger.info(f"DataFrame created for '{instance.name}'")
-
-            # Write the DataFrame to SQL
-            engine = create_engine(conn_str, echo=True)
-            json_table_name = "json_" + instance.name
-            json_df.to_sql(name=json_table_name, con=engine, if_exists='replace', index=False)
-            logger.info(f"Data written to SQL table '{json_table_name}'")
-        else:
-            logger.warning(f"No data to write for '{instance.name}'")
-
-    except Exception as e:
-        logger.error(f"Error processing JSON file: {e}", exc_info=True)
+    enqueue_ingestion('json', instance)
 
 
 # Signal handlers  
 @receiver(post_delete, sender=JSONBus)
 def delete_json_data(sender, instance, **kwargs):
-    engine = create_engine(conn_str)
-    try:
-        json_table_name = f"json_{instance.name}"
-        sql = text(f"DROP TABLE IF EXISTS public.\"{json_table_name}\"")
-        with engine.begin() as connection:
-            connection.execute(sql)
-            logger.info(f"Table '{json_table_name}' deleted from the database.")
-    except Exception as e:
-        logger.error(f"Error deleting table for {json_table_name}: {e}")
+    from .ingestion import drop_table
+    drop_table(scenario_table(f"json_{instance.name}", instance.scenario), instance.scenario)
+
 
+#########################################################################################
+# Django model for PyPSA network files
+#########################################################################################
+
+class PyPSANetwork(models.Model):
+    name = models.CharField(max_length=100)
+    # A solved network as written by pypsa.Network.export_to_netcdf / export_to_hdf5.
+    network_file = models.FileField(upload_to='pypsa_networks/',
+                                    validators=[FileExtensionValidator(['nc', 'h5', 'hdf5'])])
+    uploaded_time = models.DateTimeField(default=datetime.datetime.now)
+    # Network run the components are loaded into, see geojson.scenarios.
+    scenario = models.CharField(max_length=40, default=DEFAULT_SCENARIO, validators=[validate_scenario])
+
+    def __str__(self):
+        return self.name
+
+# Signal handlers
+#########################################################################################
+# Django post save signal
+#########################################################################################
+@receiver(post_save, sender=PyPSANetwork)
+def import_network_data(sender, instance, created, **kwargs):
+    if not created or not instance.network_file:
+        return
+
+    # Every component of the network is loaded by the ingestion worker.
+    enqueue_ingestion('pypsa', instance)
 
 
 #########################################################################################
 # Django model for statistics files
 #########################################################################################
 
+# The tables below are partitioned by scenario, every query filters on it so that
+# PostgreSQL only reads the partition of that scenario (see geojson.matviews). Line,
+# id and Bus repeat across scenarios, the primary key uid is '<scenario>/<key>'.
+
 # Clase Lines
 class Lines(models.Model):
-    Line = models.CharField(max_length=255, primary_key=True)
+    scenario = models.CharField(max_length=40)
+    uid = models.CharField(max_length=255, primary_key=True)
+    Line = models.CharField(max_length=255)
     bus0 = models.CharField(max_length=255)
     bus1 = models.CharField(max_length=255)
     length = models.FloatField()
@@ -249,7 +237,9 @@ class Lines(models.Model):
 
 # Clase generators p_nom 
 class NominalGeneratorCapacity(models.Model):
-    id = models.CharField(max_length=255, primary_key=True)
+    scenario = models.CharField(max_length=40)
+    uid = models.CharField(max_length=255, primary_key=True)
+    id = models.CharField(max_length=255)
     Bus = models.CharField(max_length=255)
     v_nom = models.FloatField()
     country = models.CharField(max_length=255)
@@ -271,7 +261,9 @@ class NominalGeneratorCapacity(models.Model):
         db_table = 'view_nominal_generator_capacity_with_geom'
 
 class OptimalGeneratorCapacity(models.Model):
-    id = models.CharField(max_length=255, primary_key=True)
+    scenario = models.CharField(max_length=40)
+    uid = models.CharField(max_length=255, primary_key=True)
+    id = models.CharField(max_length=255)
     Bus = models.CharField(max_length=255)
     v_nom = models.FloatField()
     country = models.CharField(max_length=255)
@@ -293,7 +285,9 @@ class OptimalGeneratorCapacity(models.Model):
         db_table = 'view_optimal_generator_capacity_with_geom'
 
 class NominalStorageCapacity(models.Model):
-    Bus = models.CharField(max_length=255, primary_key=True)
+    scenario = models.CharField(max_length=40)
+    uid = models.CharField(max_length=255, primary_key=True)
+    Bus = models.CharField(max_length=255)
     geom = gis_models.GeometryField(db_index=True)
     carrier = models.CharField(max_length=255)
     p_nom = models.FloatField()
@@ -303,7 +297,9 @@ class NominalStorageCapacity(models.Model):
         db_table = 'view_nominal_storage_unit_capacity_with_geom'
 
 class OptimalStorageCapacity(models.Model):
-    Bus = models.CharField(max_length=255, primary_key=True)
+    scenario = models.CharField(max_length=40)
+    uid = models.CharField(max_length=255, primary_key=True)
+    Bus = models.CharField(max_length=255)
     geom = gis_models.GeometryField(db_index=True)
     carrier = models.CharField(max_length=255)
     p_nom_opt = models.FloatField()
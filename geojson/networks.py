@@ -0,0 +1,284 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .matviews import source_table
+from .scenarios import ensure_partition, scenario_table
+from .timeseries import BATCH_SERIES, SERIES_TABLE, SNAPSHOTS_TABLE, store_timeseries
+
+logger = logging.getLogger(__name__)
+
+# Solved PyPSA networks read straight from the netCDF (.nc) or HDF5 (.h5) files that
+# pypsa.Network.export_to_* writes, without going through JSON exports. Each component
+# is read, written with COPY into the upload table the views are built from and its
+# time series stored, by its own worker process; the files are read with xarray and
+# pandas so that a worker only loads the variables of its component.
+COMPONENTS = ('buses', 'lines', 'links', 'generators', 'storage_units', 'stores')
+NETCDF_EXTENSIONS = ('.nc',)
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+
+# Columns the view queries read, added with these values when the network lacks them
+# (a plain PyPSA network has no country, an unsolved one no p_nom_opt, and columns
+# left at their PyPSA default, such as p_nom or carrier, are not exported at all).
+REQUIRED_COLUMNS = {
+    'buses': {
+        'v_nom': float('nan'), 'country': '', 'x': float('nan'), 'y': float('nan'), 'control': 'PQ',
+        'generator': '', 'type': '', 'unit': '', 'v_mag_pu_set': 1.0, 'v_mag_pu_min': 0.0,
+        'sub_network': '',
+    },
+    'lines': {'s_nom_opt': float('nan')},
+    'generators': {'p_nom': 0.0, 'p_nom_opt': float('nan'), 'carrier': ''},
+    'storage_units': {'p_nom': 0.0, 'p_nom_opt': float('nan'), 'carrier': ''},
+}
+
+
+class MultiPeriodError(ValueError):
+    # The time series store keeps one time axis per series, the snapshots of a
+    # multi-period network are (investment period, timestep) pairs whose timesteps
+    # repeat from one period to the next.
+    def __init__(self, path):
+        super().__init__(f"'{os.path.basename(path)}' is a multi-period network, its snapshots are indexed "
+                         f"by (period, timestep). Export one network per investment period instead.")
+
+#########################################################################################
+# Network files
+#########################################################################################
+
+def network_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in NETCDF_EXTENSIONS:
+        return 'netcdf'
+    if extension in HDF5_EXTENSIONS:
+        return 'hdf5'
+    raise ValueError(f"Unsupported network file '{os.path.basename(path)}', expected .nc or .h5.")
+
+
+def network_components(path):
+    # Components with at least one element in the file, in COMPONENTS order.
+    if network_format(path) == 'netcdf':
+        import xarray as xr
+
+        with xr.open_dataset(path) as ds:
+            return [component for component in COMPONENTS
+                    if f'{component}_i' in ds.coords and ds.sizes[f'{component}_i']]
+
+    import pandas as pd
+
+    with pd.HDFStore(path, mode='r') as store:
+        keys = set(store.keys())
+        return [component for component in COMPONENTS
+                if f'/{component}' in keys and store.get_storer(f'/{component}').nrows != 0]
+
+
+def is_multi_period(path):
+    # PyPSA writes the two levels of multi-period snapshots as separate variables
+    # (netCDF) or columns of the snapshots table (HDF5).
+    if network_format(path) == 'netcdf':
+        import xarray as xr
+
+        with xr.open_dataset(path) as ds:
+            return 'snapshots_period' in ds.variables
+
+    import pandas as pd
+
+    with pd.HDFStore(path, mode='r') as store:
+        return '/snapshots' in store.keys() and 'period' in store.get('/snapshots').columns
+
+
+def read_static_netcdf(path, component):
+    import pandas as pd
+    import xarray as xr
+
+    index = f'{component}_i'
+    prefix = f'{component}_'
+    with xr.open_dataset(path) as ds:
+        columns = {
+            name[len(prefix):]: variable.values
+            for name, variable in ds.data_vars.items()
+            if name.startswith(prefix) and variable.dims == (index,)
+        }
+        return pd.DataFrame(columns, index=pd.Index(ds[index].values.astype(str)))
+
+
+def iter_series_netcdf(path, component, names):
+    # Yields (attribute, snapshots x components DataFrame), one attribute at a time.
+    import xarray as xr
+
+    prefix = f'{component}_t_'
+    with xr.open_dataset(path) as ds:
+        for name in ds.data_vars:
+            if name.startswith(prefix) and ds[name].ndim == 2:
+                frame = ds[name].to_pandas()
+                frame.columns = frame.columns.astype(str)
+                yield name[len(prefix):], frame
+
+
+def read_static_hdf5(path, component):
+    import pandas as pd
+
+    with pd.HDFStore(path, mode='r') as store:
+        df = store.get(f'/{component}')
+    if 'name' in df.columns:
+        df = df.set_index('name')
+    df.index = df.index.astype(str)
+    return df
+
+
+def iter_series_hdf5(path, component, names):
+    # Recent PyPSA versions number the series columns by the position of the
+    # component in its static table, older ones use the names.
+    import pandas as pd
+
+    prefix = f'/{component}_t/'
+    with pd.HDFStore(path, mode='r') as store:
+        snapshots = store.get('/snapshots') if '/snapshots' in store.keys() else None
+        for key in store.keys():
+            if not key.startswith(prefix):
+                continue
+            frame = store.get(key)
+            if pd.api.types.is_integer_dtype(frame.columns):
+                frame.columns = names[frame.columns]
+            if not isinstance(frame.index, pd.DatetimeIndex) and snapshots is not None:
+                column = next((name for name in ('snapshot', 'name') if name in snapshots.columns), None)
+                if column and len(snapshots) == len(frame):
+                    frame.index = snapshots[column].values
+            frame.columns = frame.columns.astype(str)
+            yield key[len(prefix):], frame
+
+
+READERS = {
+    'netcdf': (read_static_netcdf, iter_series_netcdf),
+    'hdf5': (read_static_hdf5, iter_series_hdf5),
+}
+
+#########################################################################################
+# Component loading
+#########################################################################################
+
+def component_table(component, scenario):
+    # The four components behind the views go to the tables of their uploads, links
+    # and stores next to them.
+    if component in settings.MATVIEW_SOURCE_UPLOADS:
+        return source_table(component, scenario)
+    return scenario_table(f'json_{component}', scenario)
+
+
+def component_frame(component, df):
+    # The table layout of the JSON and GeoJSON exports: buses keyed by "Bus" with a
+    # point geometry, the other components by name.
+    import shapely
+
+    for column, default in REQUIRED_COLUMNS.get(component, {}).items():
+        if column not in df.columns:
+            df[column] = default
+    if component == 'buses':
+        df = df.rename_axis('Bus').reset_index()
+        df['geom'] = shapely.points(df['x'].to_numpy(dtype=float), df['y'].to_numpy(dtype=float))
+    else:
+        df = df.rename_axis('name').reset_index()
+    return df
+
+
+def snapshot_times(path, component, attribute, index):
+    import pandas as pd
+
+    if isinstance(index, pd.MultiIndex):
+        raise MultiPeriodError(path)
+    if pd.api.types.is_integer_dtype(index):
+        # Positions, left when the file has no snapshot names to read them from.
+        raise ValueError(f"The snapshots of {component}.{attribute} in '{os.path.basename(path)}' are not timestamps.")
+    try:
+        times = pd.DatetimeIndex(pd.to_datetime(index)).tz_localize(None)
+    except (TypeError, ValueError):
+        raise ValueError(f"The snapshots of {component}.{attribute} in '{os.path.basename(path)}' are not timestamps.")
+    return list(times.to_pydatetime())
+
+
+def load_component(path, component, scenario):
+    # Runs in a worker process. The time series are stored under the names of the
+    # components, which is what "Line" holds for the lines in network_lines_view.
+    import numpy as np
+    import pandas as pd
+
+    from .loader import copy_chunks
+
+    start = time.monotonic()
+    read_static, iter_series = READERS[network_format(path)]
+    static = read_static(path, component)
+    names = static.index
+    table = component_table(component, scenario)
+    geometry_column = 'geom' if component == 'buses' else None
+    rows = copy_chunks([component_frame(component, static)], table, geometry_column=geometry_column, srid=4326,
+                       widen_integers=True)
+    del static
+
+    series = 0
+    for attribute, frame in iter_series(path, component, names):
+        if frame.empty:
+            continue
+        snapshots = snapshot_times(path, component, attribute, frame.index)
+        batches = (
+            (list(frame.columns[start:start + BATCH_SERIES]),
+             frame.iloc[:, start:start + BATCH_SERIES].to_numpy(dtype=np.float32))
+            for start in range(0, frame.shape[1], BATCH_SERIES)
+        )
+        series += store_timeseries(component, attribute, snapshots, batches, scenario=scenario)
+    return {
+        'component': component,
+        'table': table,
+        'rows': rows,
+        'series': series,
+        'seconds': time.monotonic() - start,
+    }
+
+
+def init_worker():
+    # Workers are spawned, not forked, so they hold no database connection of the
+    # parent; they set Django up again from DJANGO_SETTINGS_MODULE.
+    import django
+
+    django.setup()
+
+
+def import_network(path, scenario, workers=None, progress=None):
+    # Loads every component of the network into the tables of the scenario, one worker
+    # process per component, and returns the result of each component.
+    # progress(done, total, result) is called as components complete.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.monotonic()
+    components = network_components(path)
+    if not components:
+        raise ValueError(f"No components in '{os.path.basename(path)}'.")
+    if is_multi_period(path):
+        raise MultiPeriodError(path)
+
+    # The workers write time series concurrently, the partitions must exist first.
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in (SERIES_TABLE, SNAPSHOTS_TABLE):
+            ensure_partition(cursor, table, scenario)
+
+    workers = min(workers or settings.PYPSA_IMPORT_WORKERS, len(components))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker) as pool:
+        futures = [pool.submit(load_component, path, component, scenario) for component in components]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['component']] = result
+            logger.info(f"Loaded {result['rows']} {result['component']} and {result['series']} series "
+                        f"into '{result['table']}' in {result['seconds']:.2f}s")
+            if progress:
+                progress(len(results), len(futures), result)
+    logger.info(f"Imported {len(results)} components of '{os.path.basename(path)}' into scenario "
+                f"'{scenario}' with {workers} workers in {time.monotonic() - start:.2f}s")
+    return results
@@ -0,0 +1,395 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import hashlib
+import io
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+from urllib.error import HTTPError
+from urllib.parse import quote, unquote, urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Caching proxy in front of GeoServer's WMS and WFS. GetMap requests are cut into
+# tiles of a fixed grid, so that panning the map asks GeoServer only for the tiles it
+# has not rendered yet; WFS and capabilities documents are cached per normalized query.
+# Entries live on disk under OWS_CACHE_DIR, one directory per layer so that a
+# republished layer can be purged, and the least recently used are evicted once the
+# cache outgrows OWS_CACHE_MAX_MB.
+
+# Tile grids as (min x, max y, tile span at zoom 0) in the units of the CRS, tiles are
+# numbered from the top left corner like WMTS. EPSG:4326 has two tiles at zoom 0.
+TILE_GRIDS = {
+    'EPSG:4326': (-180.0, 90.0, 180.0),
+    'EPSG:3857': (-20037508.342789244, 20037508.342789244, 40075016.68557849),
+    'EPSG:900913': (-20037508.342789244, 20037508.342789244, 40075016.68557849),
+}
+TILE_FORMATS = {'image/png': 'PNG', 'image/jpeg': 'JPEG'}
+# GetMap parameters that place the image, replaced by those of each tile.
+PLACEMENT_PARAMS = ('SERVICE', 'REQUEST', 'VERSION', 'BBOX', 'WIDTH', 'HEIGHT', 'SRS', 'CRS')
+# Requests served from the cache, with the parameters naming their layers.
+CACHED_REQUESTS = {
+    ('WMS', 'GETCAPABILITIES'): (),
+    ('WMS', 'GETLEGENDGRAPHIC'): ('LAYER',),
+    ('WFS', 'GETCAPABILITIES'): (),
+    ('WFS', 'DESCRIBEFEATURETYPE'): ('TYPENAME', 'TYPENAMES'),
+    ('WFS', 'GETFEATURE'): ('TYPENAME', 'TYPENAMES'),
+}
+CAPABILITIES_BUCKET = '_capabilities'
+EXCEPTION_MARKERS = (b'ServiceException', b'ExceptionReport')
+
+# Size of the disk cache as seen by this process, rescanned periodically since other
+# workers write to the same directory.
+_cache_state = {'size': None, 'scanned': 0.0}
+
+#########################################################################################
+# Upstream
+#########################################################################################
+
+def upstream_url(workspace, service):
+    return f"{settings.OWS_UPSTREAM_URL.rstrip('/')}/{workspace}/{service}"
+
+
+def fetch(url, params):
+    # Returns (status, content type, body); error responses of GeoServer are passed
+    # on to the client, connection errors raise OSError and truncated or malformed
+    # responses http.client.HTTPException.
+    try:
+        with urlopen(f'{url}?{urlencode(params)}', timeout=settings.OWS_TIMEOUT) as response:
+            return response.status, response.headers.get('Content-Type', ''), response.read()
+    except HTTPError as e:
+        return e.code, e.headers.get('Content-Type', ''), e.read()
+
+
+def cacheable(status, content_type, body, expected_type=None):
+    # GeoServer reports OGC exceptions with a 200 status, they must not be cached.
+    if status != 200 or 'se_xml' in content_type:
+        return False
+    if expected_type and not content_type.startswith(expected_type):
+        return False
+    return not any(marker in body[:1024] for marker in EXCEPTION_MARKERS)
+
+#########################################################################################
+# Request normalization
+#########################################################################################
+
+def normalize_params(query):
+    # OGC parameter names are case-insensitive; the first value of each wins.
+    params = {}
+    for name, values in query.lists():
+        params.setdefault(name.upper(), values[0])
+    return params
+
+
+def layer_names(value):
+    # 'workspace:layer' and 'layer' name the same layer of our workspace.
+    return sorted({name.split(':', 1)[-1] for name in value.split(',') if name})
+
+
+def layer_bucket(names):
+    return ','.join(quote(name, safe='') for name in names) or CAPABILITIES_BUCKET
+
+
+def parse_numbers(value, count):
+    try:
+        numbers = [float(number) for number in value.split(',')[:count]]
+    except (AttributeError, ValueError):
+        return None
+    if len(numbers) != count or not all(math.isfinite(number) for number in numbers):
+        return None
+    return numbers
+
+
+def parse_version(value):
+    # '1.3.0' -> (1, 3, 0); missing or malformed versions are taken as 1.1.1, the
+    # version of the WMS requests the dashboard sends.
+    try:
+        return tuple(int(part) for part in value.split('.'))
+    except (AttributeError, ValueError):
+        return (1, 1, 1)
+
+
+def map_bbox(params):
+    # (crs, [minx, miny, maxx, maxy]) of a GetMap request in x/y order. WMS 1.3.0
+    # uses the latitude/longitude axis order for EPSG:4326.
+    crs = (params.get('CRS') or params.get('SRS') or '').upper()
+    bbox = parse_numbers(params.get('BBOX'), 4)
+    if bbox is None:
+        return crs, None
+    if crs == 'EPSG:4326' and parse_version(params.get('VERSION')) >= (1, 3):
+        bbox = [bbox[1], bbox[0], bbox[3], bbox[2]]
+    return crs, bbox
+
+
+def snap_bbox(value, crs):
+    # Grows a WFS bbox outward to the tile grid of the zoom level where it spans at
+    # most two tiles, so that nearby viewports share a cache entry. The axis order
+    # does not matter, both axes are snapped with the same step.
+    grid = TILE_GRIDS.get(crs.upper())
+    numbers = parse_numbers(value, 4)
+    if grid is None or numbers is None:
+        return value
+    extent = max(numbers[2] - numbers[0], numbers[3] - numbers[1])
+    if extent <= 0:
+        return value
+    zoom = max(0, min(settings.OWS_MAX_ZOOM, math.floor(math.log2(grid[2] / extent))))
+    step = grid[2] / 2 ** zoom
+    snapped = [math.floor(numbers[0] / step) * step, math.floor(numbers[1] / step) * step,
+               math.ceil(numbers[2] / step) * step, math.ceil(numbers[3] / step) * step]
+    rest = value.split(',')[4:]
+    return ','.join([repr(number) for number in snapped] + rest)
+
+
+def wfs_params(params):
+    params = dict(params)
+    if 'BBOX' in params:
+        bbox = params['BBOX'].split(',')
+        crs = bbox[4] if len(bbox) > 4 else params.get('SRSNAME', 'EPSG:4326')
+        params['BBOX'] = snap_bbox(params['BBOX'], crs.replace('urn:ogc:def:crs:', '').replace('::', ':'))
+    return params
+
+
+def request_digest(params):
+    return hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+
+#########################################################################################
+# Disk cache
+#########################################################################################
+
+def entry_path(bucket, digest):
+    return os.path.join(settings.OWS_CACHE_DIR, bucket, digest[:2], digest)
+
+
+def read_entry(path):
+    # An entry is its content type on the first line followed by the body.
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    content_type, _, body = data.partition(b'\n')
+    try:
+        os.utime(path)  # Marks the entry as recently used for the eviction.
+    except OSError:
+        pass
+    return content_type.decode(), body
+
+
+def write_entry(path, content_type, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary name first so concurrent requests never read a partial entry;
+    # the name is unique to the request, threads of one worker may fetch the same tile.
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(content_type.encode() + b'\n' + body)
+    os.replace(tmp_path, path)
+    account(len(body) + len(content_type) + 1)
+
+
+def cache_entries():
+    for root, dirs, files in os.walk(settings.OWS_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def account(size):
+    now = time.monotonic()
+    if _cache_state['size'] is None or now - _cache_state['scanned'] > settings.OWS_CACHE_SCAN_INTERVAL:
+        _cache_state['size'] = sum(entry[1] for entry in cache_entries())
+        _cache_state['scanned'] = now
+    else:
+        _cache_state['size'] += size
+    if _cache_state['size'] > settings.OWS_CACHE_MAX_MB * 1024 * 1024:
+        evict()
+
+
+def evict():
+    # Least recently used entries go first, down to 90% of the limit so that the
+    # next few writes do not trigger another scan.
+    entries = sorted(cache_entries())
+    size = sum(entry[1] for entry in entries)
+    target = settings.OWS_CACHE_MAX_MB * 1024 * 1024 * 0.9
+    removed = 0
+    for _, entry_size, path in entries:
+        if size <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        size -= entry_size
+        removed += 1
+    _cache_state['size'] = size
+    _cache_state['scanned'] = time.monotonic()
+    logger.info(f"Evicted {removed} OWS cache entries, {size / 1024 / 1024:.0f} MB left")
+
+
+def cached_fetch(bucket, url, params, expected_type=None):
+    # Returns (status, content type, body, hit).
+    path = entry_path(bucket, request_digest(params))
+    entry = read_entry(path)
+    if entry is not None:
+        return 200, *entry, True
+    status, content_type, body = fetch(url, params)
+    if cacheable(status, content_type, body, expected_type):
+        write_entry(path, content_type, body)
+    return status, content_type, body, False
+
+
+def purge_layers(names):
+    # Drops the cached tiles and features of the given layers, and the capabilities
+    # documents that describe them. Called when ingestion changes or republishes them.
+    if not os.path.isdir(settings.OWS_CACHE_DIR):
+        return
+    names = set(names)
+    for bucket in os.listdir(settings.OWS_CACHE_DIR):
+        layers = {unquote(layer) for layer in bucket.split(',')}
+        if bucket == CAPABILITIES_BUCKET or layers & names:
+            shutil.rmtree(os.path.join(settings.OWS_CACHE_DIR, bucket), ignore_errors=True)
+    _cache_state['size'] = None
+    logger.info(f"Purged OWS cache of {', '.join(sorted(names))}")
+
+#########################################################################################
+# Tiled GetMap
+#########################################################################################
+
+def tile_zoom(grid, resolution):
+    # The coarsest zoom level whose tiles are at least as detailed as the request.
+    zoom = math.ceil(math.log2(grid[2] / (settings.OWS_TILE_SIZE * resolution)) - 1e-9)
+    return max(0, min(settings.OWS_MAX_ZOOM, zoom))
+
+
+def tile_range(grid, zoom, bbox):
+    span = grid[2] / 2 ** zoom
+    x0 = math.floor((bbox[0] - grid[0]) / span + 1e-9)
+    x1 = math.ceil((bbox[2] - grid[0]) / span - 1e-9) - 1
+    y0 = math.floor((grid[1] - bbox[3]) / span + 1e-9)
+    y1 = math.ceil((grid[1] - bbox[1]) / span - 1e-9) - 1
+    return x0, max(x0, x1), y0, max(y0, y1)
+
+
+def tile_params(params, crs, grid, zoom, x, y):
+    span = grid[2] / 2 ** zoom
+    minx, maxy = grid[0] + x * span, grid[1] - y * span
+    tile = {name: value for name, value in params.items() if name not in PLACEMENT_PARAMS}
+    tile.update({
+        'SERVICE': 'WMS',
+        'REQUEST': 'GetMap',
+        'VERSION': '1.1.1',
+        'SRS': crs,
+        'BBOX': ','.join(repr(value) for value in (minx, maxy - span, minx + span, maxy)),
+        'WIDTH': str(settings.OWS_TILE_SIZE),
+        'HEIGHT': str(settings.OWS_TILE_SIZE),
+    })
+    return tile
+
+
+def tiled_getmap(url, params):
+    # Returns (content type, body, hit) for a GetMap request rendered from cached grid
+    # tiles, or None when it cannot be tiled (unknown CRS or format, too many tiles).
+    crs, bbox = map_bbox(params)
+    grid = TILE_GRIDS.get(crs)
+    image_format = params.get('FORMAT', '').lower()
+    try:
+        width, height = int(params.get('WIDTH', 0)), int(params.get('HEIGHT', 0))
+    except ValueError:
+        return None
+    if grid is None or bbox is None or image_format not in TILE_FORMATS or width <= 0 or height <= 0:
+        return None
+    if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+        return None
+
+    resolution = min((bbox[2] - bbox[0]) / width, (bbox[3] - bbox[1]) / height)
+    zoom = tile_zoom(grid, resolution)
+    x0, x1, y0, y1 = tile_range(grid, zoom, bbox)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > settings.OWS_MAX_TILES:
+        return None
+
+    bucket = layer_bucket(layer_names(params.get('LAYERS', '')))
+    tiles = {}
+    hits = True
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            status, content_type, body, hit = cached_fetch(
+                bucket, url, tile_params(params, crs, grid, zoom, x, y), expected_type='image/'
+            )
+            if status != 200 or not content_type.startswith('image/'):
+                return None
+            tiles[(x, y)] = body
+            hits = hits and hit
+
+    # A request for exactly one grid tile is answered with the tile as rendered.
+    span = grid[2] / 2 ** zoom
+    tile_size = settings.OWS_TILE_SIZE
+    if len(tiles) == 1 and (width, height) == (tile_size, tile_size):
+        corners = (grid[0] + x0 * span, grid[1] - (y0 + 1) * span, grid[0] + (x0 + 1) * span, grid[1] - y0 * span)
+        if all(math.isclose(a, b, abs_tol=span * 1e-6) for a, b in zip(bbox, corners)):
+            return image_format, tiles[(x0, y0)], hits
+    return image_format, mosaic(tiles, (x0, y0), grid, zoom, bbox, (width, height), image_format), hits
+
+
+def mosaic(tiles, origin, grid, zoom, bbox, size, image_format):
+    from PIL import Image
+
+    tile_size = settings.OWS_TILE_SIZE
+    x0, y0 = origin
+    columns = max(x for x, _ in tiles) - x0 + 1
+    rows = max(y for _, y in tiles) - y0 + 1
+    canvas = Image.new('RGBA', (columns * tile_size, rows * tile_size), (0, 0, 0, 0))
+    for (x, y), body in tiles.items():
+        with Image.open(io.BytesIO(body)) as tile:
+            canvas.paste(tile.convert('RGBA'), ((x - x0) * tile_size, (y - y0) * tile_size))
+
+    # Pixel box of the requested bbox on the canvas, then resampled to the requested size.
+    resolution = grid[2] / 2 ** zoom / tile_size
+    left, top = grid[0] + x0 * grid[2] / 2 ** zoom, grid[1] - y0 * grid[2] / 2 ** zoom
+    box = ((bbox[0] - left) / resolution, (top - bbox[3]) / resolution,
+           (bbox[2] - left) / resolution, (top - bbox[1]) / resolution)
+    image = canvas.resize(size, Image.BILINEAR, box=box)
+    if TILE_FORMATS[image_format] == 'JPEG':
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, TILE_FORMATS[image_format])
+    return output.getvalue()
+
+#########################################################################################
+# Proxy
+#########################################################################################
+
+def proxy_request(workspace, service, query):
+    # Returns (status, content type, body, cache state) for a GET request to the OWS
+    # endpoint of the workspace; the cache state is 'HIT', 'MISS' or 'BYPASS'.
+    url = upstream_url(workspace, service)
+    params = normalize_params(query)
+    ows_service = (params.get('SERVICE') or service).upper()
+    request = params.get('REQUEST', '').upper()
+
+    if (ows_service, request) == ('WMS', 'GETMAP'):
+        tiled = tiled_getmap(url, params)
+        if tiled is not None:
+            content_type, body, hit = tiled
+            return 200, content_type, body, 'HIT' if hit else 'MISS'
+    elif (ows_service, request) in CACHED_REQUESTS:
+        if ows_service == 'WFS':
+            params = wfs_params(params)
+        layers = next((params[name] for name in CACHED_REQUESTS[(ows_service, request)] if name in params), '')
+        bucket = layer_bucket(layer_names(layers))
+        status, content_type, body, hit = cached_fetch(bucket, url, params)
+        return status, content_type, body, 'HIT' if hit else 'MISS'
+
+    status, content_type, body = fetch(url, params)
+    return status, content_type, body, 'BYPASS'
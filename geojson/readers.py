@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import logging
+import os
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# A parsed row takes several times its size on disk once it is a DataFrame row,
+# a CSV line for COPY and a copy in the loader; chunk sizes account for that.
+MEMORY_OVERHEAD = 4
+MIN_CHUNK_ROWS = 100
+
+#########################################################################################
+# Chunk sizing
+#########################################################################################
+
+def memory_budget():
+    return settings.INGESTION_MEMORY_BUDGET_MB * 1024 * 1024
+
+
+def rows_per_chunk(bytes_per_row):
+    rows = memory_budget() // max(int(bytes_per_row * MEMORY_OVERHEAD), 1)
+    return max(int(rows), MIN_CHUNK_ROWS)
+
+
+def use_streaming(path):
+    # Small files are read in one go, large ones chunk by chunk within the budget.
+    return os.path.getsize(path) > settings.INGESTION_STREAMING_MIN_MB * 1024 * 1024
+
+#########################################################################################
+# GeoJSON chunks
+#########################################################################################
+
+def iter_geojson_chunks(path):
+    # Yields GeoDataFrames of at most a budget's worth of features, read with pyogrio
+    # in a single pass over the file through an Arrow stream when available.
+    import geopandas as gpd
+    import pyogrio
+    import shapely
+
+    if not hasattr(pyogrio.raw, 'open_arrow'):
+        yield from iter_geojson_features(path)
+        return
+
+    info = pyogrio.read_info(path)
+    features = max(info.get('features') or 0, 1)
+    chunk_rows = rows_per_chunk(os.path.getsize(path) / features)
+    logger.info(f"Reading '{path}' in chunks of {chunk_rows} features")
+
+    with pyogrio.raw.open_arrow(path, batch_size=chunk_rows) as (meta, reader):
+        geometry_name = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            df = batch.to_pandas()
+            geometry = shapely.from_wkb(df.pop(geometry_name).values)
+            yield gpd.GeoDataFrame(df, geometry=geometry, crs=meta['crs'])
+
+
+def iter_geojson_features(path):
+    # Without open_arrow (pyogrio < 0.7) the features are parsed with ijson, also in
+    # a single pass: paging with read_dataframe(skip_features=...) would read the
+    # file again from its start for every chunk.
+    import geopandas as gpd
+    import ijson
+
+    logger.info(f"Reading '{path}' feature by feature")
+    chunk_rows = MIN_CHUNK_ROWS
+    features = []
+    with open(path, 'rb') as file:
+        for feature in ijson.items(file, 'features.item', use_float=True):
+            features.append(feature)
+            if len(features) < chunk_rows:
+                continue
+            gdf = gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+            # Resize the following chunks from the measured size of this one.
+            chunk_rows = rows_per_chunk(gdf.memory_usage(deep=True).sum() / len(gdf))
+            features = []
+            yield gdf
+    if features:
+        yield gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+
+#########################################################################################
+# JSON chunks
+#########################################################################################
+
+def iter_json_chunks(path):
+    # Incrementally parses {"columns": [...], "data": [...]} or {"data": [{...}, ...]}
+    # exports with ijson, without ever holding the whole document in memory.
+    import ijson
+    import pandas as pd
+
+    with open(path, 'rb') as file:
+        columns = next(ijson.items(file, 'columns'), None)
+
+    chunk_rows = MIN_CHUNK_ROWS
+    rows = []
+    with open(path, 'rb') as file:
+        for row in ijson.items(file, 'data.item', use_float=True):
+            rows.append(row)
+            if len(rows) < chunk_rows:
+                continue
+            df = pd.DataFrame(rows, columns=columns)
+            # Resize the following chunks from the measured size of this one.
+            chunk_rows = rows_per_chunk(df.memory_usage(deep=True).sum() / len(df))
+            rows = []
+            yield df
+    if rows:
+        yield pd.DataFrame(rows, columns=columns)
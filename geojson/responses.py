@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+from .export import EXPORT_FORMATS, export_response
+from .filters import QueryParameterError
+from .metrics import phase
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+GEOJSON_CONTENT_TYPE = 'application/geo+json'
+# Output formats and the media types they are negotiated from.
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'geojson': GEOJSON_CONTENT_TYPE,
+    **{name: config['content_type'] for name, config in EXPORT_FORMATS.items()},
+}
+FORMATS = tuple(CONTENT_TYPES)
+
+#########################################################################################
+# Response mode
+#########################################################################################
+
+def wants_stream(request):
+    stream = request.GET.get('stream')
+    if stream in (None, ''):
+        return settings.API_STREAMING
+    stream = stream.lower()
+    if stream in TRUE_VALUES:
+        return True
+    if stream in FALSE_VALUES:
+        return False
+    raise QueryParameterError(f"Invalid stream '{stream}', expected true or false.")
+
+
+def negotiate_format(request):
+    # Without ?format=, the first media type of the Accept header that matches an
+    # output format is used; browsers sending */* get the JSON list.
+    formats = {content_type: name for name, content_type in CONTENT_TYPES.items()}
+    for media_range in request.headers.get('Accept', '').split(','):
+        content_type = media_range.split(';')[0].strip().lower()
+        if content_type in formats:
+            return formats[content_type]
+    return 'json'
+
+
+def parse_format(request):
+    output_format = (request.GET.get('format') or negotiate_format(request)).lower()
+    if output_format not in FORMATS:
+        raise QueryParameterError(
+            f"Invalid format '{output_format}', expected one of {', '.join(FORMATS)}."
+        )
+    return output_format
+
+#########################################################################################
+# JSON list responses
+#########################################################################################
+
+def geometry_to_text(row, geom_field, geom_source):
+    # Convert geometric value to string if necessary
+    if geom_source != geom_field:
+        row[geom_field] = row.pop(geom_source)
+    row[geom_field] = str(row[geom_field])
+    return row
+
+
+def json_response(queryset, fields, geom_field, geom_source):
+    # Convert the QuerySet to a list of dictionaries
+    rows = list(queryset.values(*fields))
+    with phase('serialization'):
+        for row in rows:
+            geometry_to_text(row, geom_field, geom_source)
+        return JsonResponse(rows, safe=False)
+
+
+def iter_json_array(queryset, fields, geom_field, geom_source, chunk_size):
+    # Rows are read through a server-side cursor and written out one chunk at a
+    # time, so memory stays flat however large the underlying table grows.
+    encoder = DjangoJSONEncoder()
+    separator = '['
+    rows = []
+
+    def encode(rows, separator):
+        with phase('serialization'):
+            chunk = []
+            for row in rows:
+                geometry_to_text(row, geom_field, geom_source)
+                chunk.append(separator + encoder.encode(row))
+                separator = ','
+            return ''.join(chunk)
+
+    for row in queryset.values(*fields).iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            yield encode(rows, separator)
+            separator = ','
+            rows = []
+    if rows:
+        yield encode(rows, separator) + ']'
+    else:
+        yield '[]' if separator == '[' else ']'
+
+
+def streaming_json_response(queryset, fields, geom_field, geom_source):
+    chunk_size = settings.API_STREAM_CHUNK_SIZE
+    return StreamingHttpResponse(
+        iter_json_array(queryset, fields, geom_field, geom_source, chunk_size),
+        content_type='application/json',
+    )
+
+#########################################################################################
+# GeoJSON responses
+#########################################################################################
+
+def geojson_sql(queryset, fields):
+    # ST_AsGeoJSON(record, geom_column) turns every non-geometry column of the row
+    # into a feature property, so the filtered queryset is used as a subquery.
+    sql, params = queryset.values(*fields).query.sql_with_params()
+    return f"SELECT ST_AsGeoJSON(t.*, %s) FROM ({sql}) t", params
+
+
+def geojson_response(queryset, fields, geom_field):
+    # PostGIS assembles the whole FeatureCollection and Django only passes the
+    # resulting text through, no geometry is parsed or serialized in Python.
+    features_sql, params = geojson_sql(queryset, fields)
+    sql = f"""
+        SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', COALESCE(json_agg(features.feature::json), '[]'::json)
+        )::text
+        FROM ({features_sql}) AS features(feature)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [geom_field, *params])
+        collection = cursor.fetchone()[0]
+    return HttpResponse(collection, content_type=GEOJSON_CONTENT_TYPE)
+
+
+def iter_geojson_features(queryset, fields, geom_field, chunk_size):
+    sql, params = geojson_sql(queryset, fields)
+    separator = '{"type": "FeatureCollection", "features": ['
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(sql, [geom_field, *params])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = []
+            for (feature,) in rows:
+                chunk.append(separator + feature)
+                separator = ','
+            yield ''.join(chunk)
+    finally:
+        cursor.close()
+    if separator == ',':
+        yield ']}'
+    else:
+        yield separator + ']}'
+
+
+def streaming_geojson_response(queryset, fields, geom_field):
+    chunk_size = settings.API_STREAM_CHUNK_SIZE
+    return StreamingHttpResponse(
+        iter_geojson_features(queryset, fields, geom_field, chunk_size),
+        content_type=GEOJSON_CONTENT_TYPE,
+    )
+
+
+def api_response(request, queryset, fields, geom_field, geom_source=None):
+    # geom_source names an annotation that replaces the geometry column in the
+    # output, e.g. a simplified geometry; it is still returned as geom_field.
+    output_format = parse_format(request)
+    stream = wants_stream(request)
+    geom_source = geom_source or geom_field
+    fields = tuple(geom_source if field == geom_field else field for field in fields)
+    if output_format in EXPORT_FORMATS:
+        return export_response(request, queryset, fields, geom_source, output_format)
+    if output_format == 'geojson':
+        if stream:
+            return streaming_geojson_response(queryset, fields, geom_source)
+        return geojson_response(queryset, fields, geom_source)
+    if stream:
+        return streaming_json_response(queryset, fields, geom_field, geom_source)
+    return json_response(queryset, fields, geom_field, geom_source)
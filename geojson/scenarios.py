@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import re
+
+from django.core.validators import RegexValidator
+from django.db import connection
+
+from .filters import QueryParameterError
+
+# Every network run (a scenario, a country model, ...) is stored under its own key.
+# The tables read by the API are partitioned by LIST on that key, one partition per
+# run, so a query for one run only ever touches that run's partition and its indexes,
+# and loading a run rewrites only its own partitions.
+DEFAULT_SCENARIO = 'default'
+# \Z rather than $, which also matches before a trailing newline; the key ends up in
+# table names.
+SCENARIO_PATTERN = r'^[a-z0-9][a-z0-9_]{0,39}\Z'
+validate_scenario = RegexValidator(
+    SCENARIO_PATTERN,
+    "Use up to 40 lowercase letters, digits and underscores, starting with a letter or digit.",
+)
+
+# Partitioned tables and the prefix of their partitions, short enough that the
+# partition names stay within PostgreSQL's 63 character identifiers.
+PARTITIONED_TABLES = {
+    'network_lines_view': 'lines_view',
+    'view_nominal_generator_capacity_with_geom': 'generators_nominal',
+    'view_optimal_generator_capacity_with_geom': 'generators_optimal',
+    'view_nominal_storage_unit_capacity_with_geom': 'storage_nominal',
+    'view_optimal_storage_unit_capacity_with_geom': 'storage_optimal',
+    'network_lines_lod': 'lines_lod',
+    'capacity_clusters': 'capacity_clusters',
+    'timeseries': 'timeseries',
+    'timeseries_snapshots': 'timeseries_snapshots',
+    'line_loading_frames': 'line_loading_frames',
+    'line_loading_lines': 'line_loading_lines',
+}
+
+#########################################################################################
+# Scenario keys
+#########################################################################################
+
+def parse_scenario(request):
+    scenario = request.GET.get('scenario') or DEFAULT_SCENARIO
+    if not re.match(SCENARIO_PATTERN, scenario):
+        raise QueryParameterError(f"Invalid scenario '{scenario}'.")
+    return scenario
+
+
+def scenario_table(table_name, scenario):
+    # Upload tables of the default scenario keep their historical names.
+    if scenario == DEFAULT_SCENARIO:
+        return table_name
+    return f'{table_name}__{scenario}'
+
+#########################################################################################
+# Partitions
+#########################################################################################
+
+def partition_name(table, scenario):
+    return f'{PARTITIONED_TABLES[table]}__{scenario}'
+
+
+def ensure_partition(cursor, table, scenario):
+    # Creating the partition of a new scenario only takes a brief lock on the parent,
+    # the partitions of the other scenarios are not touched.
+    partition = partition_name(table, scenario)
+    cursor.execute("SELECT to_regclass(%s)", [f'public.{partition}'])
+    if cursor.fetchone()[0] is None:
+        cursor.execute(
+            f'CREATE TABLE public.{partition} PARTITION OF public.{table} FOR VALUES IN (%s)',
+            [scenario],
+        )
+    return partition
+
+
+def drop_scenario(scenario):
+    # Dropping the partitions of a scenario leaves the other scenarios as they are.
+    with connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            cursor.execute(f'DROP TABLE IF EXISTS public.{partition_name(table, scenario)}')
+
+
+def list_scenarios():
+    # Scenarios with a lines or capacity partition, read from the catalog.
+    parents = [table for table in PARTITIONED_TABLES if table.startswith(('network_lines_view', 'view_'))]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT DISTINCT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = 'public' AND p.relname = ANY(%s)
+            """,
+            [parents],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted({name.split('__', 1)[1] for name in names if '__' in name})
@@ -3,6 +3,706 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 #
 
-from django.test import TestCase
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
 
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 
+from . import db, ows, timeseries
+from .aggregates import capacity_summary
+from .cache import (
+  ALL_SCENARIOS,
+  accepted_encodings,
+  bump_dataset_version,
+  cached_response,
+  compress_response,
+  get_dataset_version,
+  make_etag,
+  not_modified
+)
+from .frames import BATCH_ROWS, LOADING_STEPS, NO_DATA, copy_rows, quantize
+from .filters import QueryParameterError, WEB_MERCATOR_EXTENT, apply_pagination, parse_bbox, pixel_size
+from .loader import NoRowsError, upsert_chunks
+from .models import NominalStorageCapacity
+from .scenarios import (
+  DEFAULT_SCENARIO,
+  PARTITIONED_TABLES,
+  SCENARIO_PATTERN,
+  ensure_partition,
+  list_scenarios,
+  parse_scenario,
+  partition_name,
+  scenario_table,
+  validate_scenario
+)
+from .timeseries import copy_text, downsample, lttb, minmax, read_timeseries
+
+#########################################################################################
+# Scenarios
+#########################################################################################
+
+VALID_SCENARIOS = ('default', 'ssp2_2050', '2030', 'a' * 40)
+INVALID_SCENARIOS = ('', 'SSP2', '_base', 'a' * 41, 'ssp2-2050', 'base\n', 'base;drop', 'b\u00e9')
+
+
+class ScenarioTests(SimpleTestCase):
+    def test_scenario_pattern(self):
+        for scenario in VALID_SCENARIOS:
+            with self.subTest(scenario=scenario):
+                self.assertTrue(re.match(SCENARIO_PATTERN, scenario))
+                validate_scenario(scenario)
+        for scenario in INVALID_SCENARIOS:
+            with self.subTest(scenario=scenario):
+                self.assertFalse(re.match(SCENARIO_PATTERN, scenario))
+                with self.assertRaises(ValidationError):
+                    validate_scenario(scenario)
+
+    def test_parse_scenario(self):
+        factory = RequestFactory()
+        self.assertEqual(parse_scenario(factory.get('/api/line-data/')), DEFAULT_SCENARIO)
+        self.assertEqual(parse_scenario(factory.get('/api/line-data/', {'scenario': 'ssp2_2050'})), 'ssp2_2050')
+        with self.assertRaises(QueryParameterError):
+            parse_scenario(factory.get('/api/line-data/', {'scenario': 'base\n'}))
+
+    def test_scenario_table(self):
+        self.assertEqual(scenario_table('json_lines', DEFAULT_SCENARIO), 'json_lines')
+        self.assertEqual(scenario_table('json_lines', 'ssp2_2050'), 'json_lines__ssp2_2050')
+
+    def test_partition_names_fit_identifiers(self):
+        for table in PARTITIONED_TABLES:
+            with self.subTest(table=table):
+                self.assertLessEqual(len(partition_name(table, 'a' * 40)), 63)
+        self.assertEqual(partition_name('network_lines_view', 'ssp2_2050'), 'lines_view__ssp2_2050')
+
+
+@override_settings(API_CACHE_ALIAS='default',
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DatasetVersionTests(SimpleTestCase):
+    def test_versions_are_kept_per_scenario(self):
+        self.assertEqual(get_dataset_version(ALL_SCENARIOS), 1)
+        self.assertEqual(get_dataset_version(DEFAULT_SCENARIO), 1)
+        self.assertEqual(get_dataset_version('ssp2_2050'), 1)
+        self.assertEqual(bump_dataset_version('ssp2_2050'), 2)
+        self.assertEqual(get_dataset_version('ssp2_2050'), 2)
+        self.assertEqual(get_dataset_version(DEFAULT_SCENARIO), 1)
+        # Every bump also moves the state of the responses spanning all scenarios.
+        bump_dataset_version(DEFAULT_SCENARIO)
+        self.assertEqual(get_dataset_version(DEFAULT_SCENARIO), 2)
+        self.assertEqual(get_dataset_version(ALL_SCENARIOS), 3)
+
+
+class ScenarioPartitionTests(TestCase):
+    def test_list_scenarios(self):
+        with connection.cursor() as cursor:
+            ensure_partition(cursor, 'network_lines_view', 'ssp2_2050')
+            # Creating it again leaves the existing partition.
+            self.assertEqual(ensure_partition(cursor, 'network_lines_view', 'ssp2_2050'), 'lines_view__ssp2_2050')
+            ensure_partition(cursor, 'timeseries', 'timeseries_only')
+        self.assertEqual(list_scenarios(), [DEFAULT_SCENARIO, 'ssp2_2050'])
+
+#########################################################################################
+# Capacity summaries
+#########################################################################################
+
+@override_settings(API_REGIONS_TABLE='missing_regions')
+class CapacitySummaryTests(TestCase):
+    def summary(self, **params):
+        return capacity_summary(RequestFactory().get('/api/capacity/summary', params))
+
+    def test_summary_by_carrier(self):
+        summary = self.summary(group_by='carrier')
+        self.assertEqual((summary['scenario'], summary['group_by']), (DEFAULT_SCENARIO, ['carrier']))
+        self.assertEqual(summary['results'], [])
+
+    def test_missing_tables_are_a_bad_request(self):
+        with self.assertRaisesMessage(QueryParameterError, 'missing_regions is not loaded'):
+            self.summary(group_by='region')
+        with self.assertRaisesMessage(QueryParameterError, 'statistics_json__ssp2_2050'):
+            self.summary(component='statistics', scenario='ssp2_2050')
+
+#########################################################################################
+# Spatial filter
+#########################################################################################
+
+@override_settings(API_BBOX_BUFFER_PIXELS=16)
+class BboxTests(SimpleTestCase):
+    def parse(self, **params):
+        return parse_bbox(RequestFactory().get('/api/line-data/', params))
+
+    def test_pixel_size(self):
+        self.assertEqual(pixel_size(0, 3857), WEB_MERCATOR_EXTENT / 256)
+        self.assertEqual(pixel_size(0, 900913), pixel_size(0, 3857))
+        self.assertEqual(pixel_size(1, 4326), 360.0 / 512)
+        self.assertEqual(pixel_size(10, 4326) * 2, pixel_size(9, 4326))
+        self.assertIsNone(pixel_size(5, 2056))
+
+    def test_bbox_without_zoom_is_not_padded(self):
+        self.assertIsNone(self.parse())
+        polygon = self.parse(bbox='-10,20,30,40')
+        self.assertEqual(polygon.srid, 4326)
+        self.assertEqual(polygon.extent, (-10.0, 20.0, 30.0, 40.0))
+
+    def test_bbox_is_padded_at_zoom(self):
+        buffer = 16 * pixel_size(5, 3857)
+        polygon = self.parse(bbox='0,0,1000,1000', srid='3857', zoom='5')
+        self.assertEqual(polygon.srid, 3857)
+        for value, expected in zip(polygon.extent, (-buffer, -buffer, 1000 + buffer, 1000 + buffer)):
+            self.assertAlmostEqual(value, expected)
+        # Unknown grids have no pixel size, their bbox is used as given.
+        self.assertEqual(self.parse(bbox='0,0,1,1', srid='2056', zoom='5').extent, (0.0, 0.0, 1.0, 1.0))
+
+    def test_invalid_bbox(self):
+        for params in ({'bbox': '1,2,3'}, {'bbox': '1,2,x,4'}, {'bbox': '3,0,1,1'},
+                       {'bbox': '0,0,1,1', 'srid': 'web'}, {'bbox': '0,0,1,1', 'zoom': '1.5'},
+                       {'bbox': '0,0,1,1', 'zoom': '25'}):
+            with self.subTest(**params), self.assertRaises(QueryParameterError):
+                self.parse(**params)
+
+#########################################################################################
+# Keyset pagination
+#########################################################################################
+
+@override_settings(API_MAX_PAGE_SIZE=100)
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            ensure_partition(cursor, NominalStorageCapacity._meta.db_table, 'other')
+        rows = [(DEFAULT_SCENARIO, f'B{number}') for number in range(5)] + [('other', 'B0'), ('other', 'B1')]
+        NominalStorageCapacity.objects.bulk_create(
+            NominalStorageCapacity(scenario=scenario, uid=f'{scenario}/{bus}/battery', Bus=bus,
+                                   geom=Point(number, number, srid=4326), carrier='battery', p_nom=1.0)
+            for number, (scenario, bus) in enumerate(rows)
+        )
+
+    def paginate(self, **params):
+        queryset = NominalStorageCapacity.objects.filter(scenario=DEFAULT_SCENARIO)
+        return apply_pagination(RequestFactory().get('/api/nominal-storage-capacity/', params), queryset)
+
+    def test_without_limit_or_cursor(self):
+        page, next_after = self.paginate()
+        self.assertEqual(page.count(), 5)
+        self.assertIsNone(next_after)
+
+    def test_cursors_walk_every_row_once(self):
+        pages = []
+        page, next_after = self.paginate(limit='2')
+        pages.append([row.Bus for row in page])
+        while next_after is not None:
+            page, next_after = self.paginate(limit='2', after=next_after)
+            pages.append([row.Bus for row in page])
+        self.assertEqual(pages, [['B0', 'B1'], ['B2', 'B3'], ['B4']])
+
+    def test_cursor_of_a_full_last_page(self):
+        page, next_after = self.paginate(limit='2', after='B2/battery')
+        self.assertEqual([row.Bus for row in page], ['B3', 'B4'])
+        self.assertIsNone(next_after)
+        page, next_after = self.paginate(limit='5')
+        self.assertEqual(len(page), 5)
+        self.assertIsNone(next_after)
+
+    def test_next_cursor_is_the_last_key_of_the_page(self):
+        page, next_after = self.paginate(limit='3')
+        self.assertEqual(list(page)[-1].pk, f'{DEFAULT_SCENARIO}/B2/battery')
+        self.assertEqual(next_after, 'B2/battery')
+
+    def test_cursor_within_another_scenario(self):
+        queryset = NominalStorageCapacity.objects.filter(scenario='other')
+        request = RequestFactory().get('/api/nominal-storage-capacity/', {'scenario': 'other', 'limit': '1'})
+        page, next_after = apply_pagination(request, queryset)
+        self.assertEqual(([row.Bus for row in page], next_after), (['B0'], 'B0/battery'))
+
+    def test_invalid_limit(self):
+        for limit in ('0', '101', 'ten'):
+            with self.subTest(limit=limit), self.assertRaises(QueryParameterError):
+                self.paginate(limit=limit)
+
+#########################################################################################
+# Conditional requests
+#########################################################################################
+
+@override_settings(METRICS_ENABLED=False)
+class ConditionalRequestTests(SimpleTestCase):
+    etag = make_etag('line_data_json', 3, 'a' * 40)
+    last_modified = 1700000000
+
+    def request(self, **headers):
+        return RequestFactory().get('/api/line-data/', headers=headers)
+
+    def test_etag(self):
+        self.assertEqual(self.etag, '"line_data_json-3-aaaaaaaaaaaaaaaa"')
+
+    def test_if_none_match(self):
+        compressed = f'{self.etag[:-1]}-gzip"'
+        for header, expected in ((self.etag, True), (compressed, True), (f'{self.etag[:-1]}-br"', True),
+                                 (f'W/{self.etag}', True), (f'"other", {compressed}', True), ('*', True),
+                                 ('"other"', False), (f'{self.etag[:-1]}-zstd"', False)):
+            with self.subTest(header=header):
+                self.assertIs(not_modified(self.request(If_None_Match=header), self.etag, self.last_modified),
+                              expected)
+
+    def test_if_modified_since(self):
+        for since, expected in ((self.last_modified, True), (self.last_modified + 60, True),
+                                (self.last_modified - 60, False)):
+            with self.subTest(since=since):
+                request = self.request(If_Modified_Since=formatdate(since, usegmt=True))
+                self.assertIs(not_modified(request, self.etag, self.last_modified), expected)
+        # If-None-Match takes precedence over the date.
+        request = self.request(If_None_Match='"other"', If_Modified_Since=formatdate(self.last_modified, usegmt=True))
+        self.assertFalse(not_modified(request, self.etag, self.last_modified))
+        self.assertFalse(not_modified(self.request(), self.etag, self.last_modified))
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings(self.request(Accept_Encoding='gzip, br;q=0, deflate')), {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings(self.request()), set())
+
+    def test_compressed_variants_revalidate(self):
+        entry = compress_response(HttpResponse(b'{"Line": "L0"}', content_type='application/json'))
+        plain = cached_response(self.request(), entry, self.etag, self.last_modified)
+        compressed = cached_response(self.request(Accept_Encoding='gzip'), entry, self.etag, self.last_modified)
+        self.assertEqual(plain.content, b'{"Line": "L0"}')
+        self.assertEqual(plain['ETag'], self.etag)
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['ETag'], f'{self.etag[:-1]}-gzip"')
+        # The tag of the variant the client holds validates against the plain one.
+        request = self.request(If_None_Match=compressed['ETag'])
+        self.assertTrue(not_modified(request, self.etag, self.last_modified))
+
+#########################################################################################
+# Time series downsampling
+#########################################################################################
+
+class DownsamplingTests(SimpleTestCase):
+    def series(self, n=1000):
+        import numpy as np
+
+        # A flat series with one peak and one dip, which any downsampling must keep.
+        y = np.sin(np.arange(n) / 50.0)
+        y[500], y[700] = 10.0, -10.0
+        return np.arange(n, dtype=np.float64), y
+
+    def test_lttb(self):
+        import numpy as np
+
+        x, y = self.series()
+        selected = lttb(x, y, 50)
+        self.assertEqual(len(selected), 50)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(500, selected)
+        self.assertIn(700, selected)
+
+    def test_lttb_keeps_short_series(self):
+        x, y = self.series(40)
+        self.assertEqual(list(lttb(x, y, 50)), list(range(40)))
+        self.assertEqual(list(lttb(x, y, 2)), list(range(40)))
+
+    def test_minmax(self):
+        import numpy as np
+
+        _, y = self.series()
+        selected = minmax(y, 50)
+        self.assertLessEqual(len(selected), 50)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(500, selected)
+        self.assertIn(700, selected)
+        # Each of the 25 buckets keeps its extremes.
+        for bucket in np.array_split(np.arange(1000), 25):
+            kept = [position for position in selected if position in bucket]
+            self.assertIn(bucket[np.argmax(y[bucket])], kept)
+            self.assertIn(bucket[np.argmin(y[bucket])], kept)
+
+    def test_minmax_of_a_constant_bucket(self):
+        import numpy as np
+
+        self.assertEqual(list(minmax(np.zeros(100), 10)), [0, 20, 40, 60, 80])
+        self.assertEqual(list(minmax(np.zeros(5), 10)), list(range(5)))
+
+    def test_downsample_skips_missing_values(self):
+        _, y = self.series()
+        y[[0, 500, 999]] = float('nan')
+        for method in ('lttb', 'minmax'):
+            with self.subTest(method=method):
+                selected = downsample(y, 50, method)
+                self.assertLessEqual(len(selected), 50)
+                self.assertFalse({0, 500, 999} & set(selected))
+                self.assertIn(700, selected)
+        self.assertEqual(downsample(y, 50, 'none'), list(range(1000)))
+
+
+class ReadTimeseriesTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'lines_t_p0.json')
+        with open(self.path, 'w') as file:
+            file.write('{"columns": ["a", "b", "c"], "index": ["2013-01-01 00:00", "2013-01-01 01:00"], '
+                       '"data": [[1, 2, null], [4, 5, 6]]}')
+        self.addCleanup(setattr, timeseries, 'BATCH_SERIES', timeseries.BATCH_SERIES)
+        timeseries.BATCH_SERIES = 2
+
+    def test_batches_of_series(self):
+        import numpy as np
+
+        snapshots, names, batches = read_timeseries(self.path)
+        self.assertEqual([snapshot.hour for snapshot in snapshots], [0, 1])
+        self.assertEqual(names, ['a', 'b', 'c'])
+        batches = list(batches)
+        self.assertEqual([batch_names for batch_names, _ in batches], [['a', 'b'], ['c']])
+        self.assertEqual(batches[0][1].tolist(), [[1, 2], [4, 5]])
+        self.assertEqual(batches[1][1].dtype, np.float32)
+        self.assertTrue(np.isnan(batches[1][1][0, 0]))
+        self.assertEqual(batches[1][1][1, 0], 6)
+
+#########################################################################################
+# Line loading frames
+#########################################################################################
+
+class RecordingCursor:
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, file):
+        self.copies.append((sql, file.read()))
+
+
+@override_settings(LINE_LOADING_MAX=1.5)
+class FrameTests(SimpleTestCase):
+    def test_quantize(self):
+        import numpy as np
+
+        loading = np.array([[0.0, 0.75, 1.5], [3.0, -0.5, np.nan], [np.inf, 0.002, 1.499]])
+        frames = quantize(loading)
+        self.assertEqual(frames.dtype, np.uint8)
+        self.assertEqual(frames.tolist(), [[0, LOADING_STEPS // 2, LOADING_STEPS],
+                                           [LOADING_STEPS, 0, NO_DATA],
+                                           [NO_DATA, 0, LOADING_STEPS]])
+
+    def test_copy_rows_in_batches(self):
+        cursor = RecordingCursor()
+        rows = (f'default\t{position}\tL{position}\n' for position in range(2 * BATCH_ROWS + 1))
+        copy_rows(cursor, 'line_loading_lines_default', 'scenario, position, "Line"', rows)
+        self.assertEqual([data.count('\n') for _, data in cursor.copies], [BATCH_ROWS, BATCH_ROWS, 1])
+        self.assertEqual(cursor.copies[0][0],
+                         'COPY public.line_loading_lines_default (scenario, position, "Line") FROM STDIN')
+        self.assertTrue(cursor.copies[2][1].startswith(f'default\t{2 * BATCH_ROWS}\t'))
+
+    def test_copy_rows_without_rows(self):
+        cursor = RecordingCursor()
+        copy_rows(cursor, 'line_loading_lines_default', 'scenario', iter(()))
+        self.assertEqual(cursor.copies, [])
+
+    def test_copy_text(self):
+        self.assertEqual(copy_text('a\tb\nc\\d'), 'a\\tb\\nc\\\\d')
+
+#########################################################################################
+# Incremental upserts
+#########################################################################################
+
+class UpsertTests(TransactionTestCase):
+    table = 'test_upsert_lines'
+
+    def setUp(self):
+        from sqlalchemy.engine import make_url
+
+        # The loader has its own pool; point it at the test database for the test.
+        url = make_url(settings.SQLALCHEMY_DATABASE_URL).set(database=connection.settings_dict['NAME'])
+        override = override_settings(SQLALCHEMY_DATABASE_URL=url.render_as_string(hide_password=False))
+        override.enable()
+        self.addCleanup(override.disable)
+        previous = db._engines.pop(os.getpid(), None)
+        self.addCleanup(self.restore_engine, previous)
+        self.addCleanup(self.drop_table)
+
+    def restore_engine(self, previous):
+        engine = db._engines.pop(os.getpid(), None)
+        if engine is not None:
+            engine.dispose()
+        if previous is not None:
+            db._engines[os.getpid()] = previous
+
+    def drop_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS public.{self.table}')
+
+    def frame(self, rows, **extra):
+        import pandas as pd
+
+        df = pd.DataFrame(rows, columns=['name', 'carrier', 's_nom'])
+        for column, value in extra.items():
+            df[column] = value
+        return df
+
+    def upsert(self, *frames):
+        return upsert_chunks(frames, self.table, 'name')
+
+    def rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT name, carrier, s_nom FROM public.{self.table} ORDER BY name')
+            return cursor.fetchall()
+
+    def test_change_counts(self):
+        changes = self.upsert(self.frame([('L0', 'AC', 100.0), ('L1', 'AC', 200.0)]),
+                              self.frame([('L2', 'DC', 300.0)]))
+        self.assertEqual(changes, {'inserted': 3, 'updated': 0, 'deleted': 0, 'created': True})
+
+        # L0 is unchanged, L1 changes, L2 is gone and L3 is new.
+        changes = self.upsert(self.frame([('L0', 'AC', 100.0), ('L1', 'AC', 250.0), ('L3', None, None)]))
+        self.assertEqual(changes, {'inserted': 1, 'updated': 1, 'deleted': 1, 'created': False})
+        self.assertEqual(self.rows(), [('L0', 'AC', 100.0), ('L1', 'AC', 250.0), ('L3', None, None)])
+
+        changes = self.upsert(self.frame([('L0', 'AC', 100.0), ('L1', 'AC', 250.0), ('L3', None, None)]))
+        self.assertEqual(changes, {'inserted': 0, 'updated': 0, 'deleted': 0, 'created': False})
+
+    def test_changed_columns_replace_the_table(self):
+        self.upsert(self.frame([('L0', 'AC', 100.0)]))
+        changes = self.upsert(self.frame([('L0', 'AC', 100.0), ('L1', 'AC', 200.0)], length=1.0))
+        self.assertEqual(changes, {'inserted': 2, 'updated': 0, 'deleted': 0, 'created': True})
+
+    def test_invalid_uploads_leave_the_table(self):
+        self.upsert(self.frame([('L0', 'AC', 100.0)]))
+        with self.assertRaisesMessage(ValueError, 'not unique'):
+            self.upsert(self.frame([('L1', 'AC', 100.0)]), self.frame([('L1', 'DC', 200.0)]))
+        with self.assertRaisesMessage(ValueError, 'not in the upload'):
+            upsert_chunks([self.frame([('L1', 'AC', 100.0)])], self.table, 'Line')
+        with self.assertRaises(NoRowsError):
+            self.upsert()
+        self.assertEqual(self.rows(), [('L0', 'AC', 100.0)])
+
+#########################################################################################
+# OWS proxy
+#########################################################################################
+
+class StubGeoServer(BaseHTTPRequestHandler):
+    # Answers like GeoServer: GetMap renders a PNG tile filled with a colour derived
+    # from its bbox, GetFeature returns a body of FEATURE_SIZE bytes, the layer named
+    # 'broken' a ServiceException with a 200 status and the layer named 'truncated' a
+    # body cut short of its Content-Length. Requests are recorded.
+    FEATURE_SIZE = 3000
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name.upper(): value for name, value in parse_qsl(url.query)}
+        self.server.requests.append((url.path, params))
+        request = params.get('REQUEST', '').upper()
+        if request == 'GETMAP':
+            self.reply('image/png', self.tile(params))
+        elif params.get('TYPENAMES') == 'broken' or params.get('TYPENAME') == 'broken':
+            self.reply('text/xml', b'<?xml version="1.0"?><ows:ExceptionReport/>')
+        elif params.get('TYPENAMES') == 'truncated':
+            self.reply('application/json', b'{"features": [', length=100)
+        elif request == 'GETFEATURE':
+            self.reply('application/json', b'{' + b' ' * (self.FEATURE_SIZE - 2) + b'}')
+        elif request == 'GETCAPABILITIES':
+            self.reply('application/xml', b'<WMS_Capabilities/>')
+        else:
+            self.reply('application/json', b'{"features": []}')
+
+    def tile(self, params):
+        from PIL import Image
+
+        size = (int(params['WIDTH']), int(params['HEIGHT']))
+        colour = tuple(hash(params['BBOX']).to_bytes(8, 'little', signed=True)[:3]) + (255,)
+        output = io.BytesIO()
+        Image.new('RGBA', size, colour).save(output, 'PNG')
+        return output.getvalue()
+
+    def reply(self, content_type, body, length=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length or len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(METRICS_ENABLED=False, OWS_PROXY=True, OWS_TILE_SIZE=256, OWS_MAX_TILES=64,
+                   OWS_MAX_ZOOM=22, OWS_CACHE_MAX_MB=2048, OWS_CACHE_SCAN_INTERVAL=300)
+class OwsProxyTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeoServer)
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        upstream = override_settings(OWS_CACHE_DIR=self.cache_dir,
+                                     OWS_UPSTREAM_URL=f'http://127.0.0.1:{self.server.server_port}/geoserver')
+        upstream.enable()
+        self.addCleanup(upstream.disable)
+        self.server.requests.clear()
+        ows._cache_state.update(size=None, scanned=0.0)
+
+    def proxy(self, service='wms', **params):
+        query = QueryDict(mutable=True)
+        query.update(params)
+        return ows.proxy_request(settings.GEOSERVER_WORKSPACE, service, query)
+
+    def get_feature(self, layer, bbox='10,10,11,11'):
+        return self.proxy('wfs', service='WFS', request='GetFeature', typeNames=layer, bbox=bbox)
+
+    def get_map(self, bbox, size=256):
+        return self.proxy(service='WMS', request='GetMap', version='1.1.1', layers='buses', styles='',
+                          format='image/png', srs='EPSG:3857', bbox=bbox, width=str(size), height=str(size))
+
+    def upstream_getmaps(self):
+        return [params for _, params in self.server.requests if params.get('REQUEST') == 'GetMap']
+
+    def bucket_entries(self, bucket):
+        return sorted(os.path.join(root, name)
+                      for root, _, names in os.walk(os.path.join(self.cache_dir, bucket)) for name in names)
+
+    def test_tile_zoom_and_range(self):
+        grid = ows.TILE_GRIDS['EPSG:3857']
+        span = grid[2] / 2
+        # A 256 pixel tile of zoom 1, exactly and slightly inside its edges.
+        self.assertEqual(ows.tile_zoom(grid, span / 256), 1)
+        self.assertEqual(ows.tile_range(grid, 1, [grid[0], 0.0, 0.0, grid[1]]), (0, 0, 0, 0))
+        self.assertEqual(ows.tile_range(grid, 1, [grid[0] + 1, 1.0, -1.0, grid[1] - 1]), (0, 0, 0, 0))
+        # Crossing the origin touches all four tiles of zoom 1.
+        self.assertEqual(ows.tile_range(grid, 1, [-1.0, -1.0, 1.0, 1.0]), (0, 1, 0, 1))
+
+    def test_snap_bbox_shares_nearby_viewports(self):
+        first = ows.snap_bbox('10.1,10.1,10.9,10.9', 'EPSG:4326')
+        second = ows.snap_bbox('10.2,10.3,10.8,10.7', 'EPSG:4326')
+        self.assertEqual(first, second)
+        minx, miny, maxx, maxy = (float(number) for number in first.split(','))
+        self.assertTrue(minx <= 10.1 and miny <= 10.1 and maxx >= 10.9 and maxy >= 10.9)
+        # Unknown CRS and invalid boxes are passed on unchanged.
+        self.assertEqual(ows.snap_bbox('1,2,3,4', 'EPSG:2056'), '1,2,3,4')
+        self.assertEqual(ows.snap_bbox('1,2,x,4', 'EPSG:4326'), '1,2,x,4')
+
+    def test_grid_tile_is_answered_as_rendered(self):
+        half = ows.TILE_GRIDS['EPSG:3857'][2] / 2
+        bbox = f'{-half!r},0.0,0.0,{half!r}'
+        status, content_type, body, state = self.get_map(bbox)
+        self.assertEqual((status, content_type, state), (200, 'image/png', 'MISS'))
+        requests = self.upstream_getmaps()
+        self.assertEqual(len(requests), 1)
+        for number, expected in zip(requests[0]['BBOX'].split(','), (-half, 0.0, 0.0, half)):
+            self.assertAlmostEqual(float(number), expected, delta=1e-3)
+        self.assertEqual(self.get_map(bbox)[2], body)
+
+    def test_mosaic_of_tiles(self):
+        from PIL import Image
+
+        # Centred on the origin, the request covers a corner of each tile of zoom 1.
+        quarter = ows.TILE_GRIDS['EPSG:3857'][2] / 4
+        status, content_type, body, state = self.get_map(f'{-quarter!r},{-quarter!r},{quarter!r},{quarter!r}')
+        self.assertEqual((status, content_type, state), (200, 'image/png', 'MISS'))
+        requests = self.upstream_getmaps()
+        self.assertEqual(len(requests), 4)
+        self.assertTrue(all((params['WIDTH'], params['HEIGHT']) == ('256', '256') for params in requests))
+        with Image.open(io.BytesIO(body)) as image:
+            self.assertEqual(image.size, (256, 256))
+            # Each quadrant of the image comes from a different upstream tile.
+            corners = {image.getpixel(point) for point in ((10, 10), (245, 10), (10, 245), (245, 245))}
+        self.assertEqual(len(corners), 4)
+
+    def test_cache_states(self):
+        half = ows.TILE_GRIDS['EPSG:3857'][2] / 2
+        bbox = f'{-half!r},0.0,0.0,{half!r}'
+        self.assertEqual(self.get_map(bbox)[3], 'MISS')
+        self.assertEqual(self.get_map(bbox)[3], 'HIT')
+        self.assertEqual(len(self.upstream_getmaps()), 1)
+
+        # Nearby WFS viewports share the snapped bbox and its entry.
+        self.assertEqual(self.get_feature('lines', '10.1,10.1,10.9,10.9')[3], 'MISS')
+        self.assertEqual(self.get_feature('lines', '10.2,10.3,10.8,10.7')[3], 'HIT')
+
+        # Requests without a cache go to GeoServer every time.
+        info = dict(service='WMS', request='GetFeatureInfo', layers='buses', query_layers='buses')
+        self.assertEqual(self.proxy(**info)[3], 'BYPASS')
+        self.assertEqual(self.proxy(**info)[3], 'BYPASS')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_view_reports_cache_state(self):
+        path = f'/geoserver/{settings.GEOSERVER_WORKSPACE}/wms'
+        query = {'service': 'WMS', 'request': 'GetCapabilities'}
+        first = self.client.get(path, query)
+        second = self.client.get(path, query)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.content, b'<WMS_Capabilities/>')
+        self.assertEqual(second['Cache-Control'], settings.OWS_CACHE_CONTROL)
+        bypass = self.client.get(path, {'service': 'WMS', 'request': 'GetFeatureInfo'})
+        self.assertEqual(bypass['X-Cache'], 'BYPASS')
+        self.assertFalse(bypass.has_header('Cache-Control'))
+
+    def test_truncated_upstream_response_is_a_bad_gateway(self):
+        path = f'/geoserver/{settings.GEOSERVER_WORKSPACE}/wfs'
+        response = self.client.get(path, {'service': 'WFS', 'request': 'GetFeature', 'typeNames': 'truncated'})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.bucket_entries('truncated'), [])
+
+    def test_wms_version_axis_order(self):
+        params = {'SRS': 'EPSG:4326', 'BBOX': '10,20,30,40'}
+        self.assertEqual(ows.map_bbox(params), ('EPSG:4326', [10.0, 20.0, 30.0, 40.0]))
+        # WMS 1.3.0 and later list latitude first; 1.10 is later than 1.3.
+        for version in ('1.3.0', '1.10.0'):
+            with self.subTest(version=version):
+                self.assertEqual(ows.map_bbox(dict(params, VERSION=version))[1], [20.0, 10.0, 40.0, 30.0])
+        self.assertEqual(ows.map_bbox(dict(params, VERSION='1.1'))[1], [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(ows.parse_version('x.y'), (1, 1, 1))
+
+    def test_exceptions_are_not_cached(self):
+        self.assertEqual(self.get_feature('broken')[3], 'MISS')
+        self.assertEqual(self.get_feature('broken')[3], 'MISS')
+        self.assertEqual(self.bucket_entries('broken'), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        entry_size = StubGeoServer.FEATURE_SIZE + len('application/json\n')
+        # Room for three entries; a fourth evicts down to 90% of that, removing one.
+        with self.settings(OWS_CACHE_MAX_MB=3.5 * entry_size / 1024 / 1024):
+            for layer in ('a', 'b', 'c'):
+                self.assertEqual(self.get_feature(layer)[3], 'MISS')
+            now = time.time()
+            for age, layer in ((30, 'a'), (20, 'b'), (10, 'c')):
+                path, = self.bucket_entries(layer)
+                os.utime(path, (now - age, now - age))
+
+            # Reading 'a' makes 'b' the least recently used entry.
+            self.assertEqual(self.get_feature('a')[3], 'HIT')
+            self.assertEqual(self.get_feature('d')[3], 'MISS')
+            self.assertEqual(self.bucket_entries('b'), [])
+            for layer in ('a', 'c', 'd'):
+                self.assertEqual(len(self.bucket_entries(layer)), 1)
+
+    def test_purge_layers(self):
+        self.get_feature('buses')
+        self.get_feature('lines')
+        self.proxy(service='WMS', request='GetCapabilities')
+        self.assertTrue(self.bucket_entries(ows.CAPABILITIES_BUCKET))
+
+        # Layers are matched without their workspace prefix.
+        self.get_feature(f'{settings.GEOSERVER_WORKSPACE}:buses,generators')
+        ows.purge_layers(['buses'])
+        self.assertEqual(self.bucket_entries('buses'), [])
+        self.assertEqual(self.bucket_entries('buses,generators'), [])
+        self.assertEqual(self.bucket_entries(ows.CAPABILITIES_BUCKET), [])
+        self.assertEqual(len(self.bucket_entries('lines')), 1)
+        self.assertIsNone(ows._cache_state['size'])
+        self.assertEqual(self.get_feature('buses')[3], 'MISS')
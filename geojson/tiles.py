@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+from django.db import connection
+
+from .filters import MAX_ZOOM, QueryParameterError
+from .lod import LINE_LOD_TABLE, line_lod_for_zoom
+from .scenarios import DEFAULT_SCENARIO
+
+# Tile coordinate space and the margin, in tile units, kept around each tile so
+# that lines and point symbols crossing tile borders are drawn seamlessly.
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+
+#########################################################################################
+# Vector tile layers
+#########################################################################################
+
+# Each layer only carries the attributes the map styles and popups need.
+TILE_LAYERS = {
+    'lines': {
+        'table': 'network_lines_view',
+        'geom': 'line_geom',
+        'attributes': ['Line', 'bus0', 'bus1', 'carrier', 'v_nom', 's_nom', 's_nom_opt'],
+        'lod': True,
+    },
+    'nominal-generator-capacity': {
+        'table': 'view_nominal_generator_capacity_with_geom',
+        'geom': 'geom',
+        'attributes': ['id', 'Bus', 'carrier', 'p_nom'],
+    },
+    'optimal-generator-capacity': {
+        'table': 'view_optimal_generator_capacity_with_geom',
+        'geom': 'geom',
+        'attributes': ['id', 'Bus', 'carrier', 'p_nom_opt'],
+    },
+    'nominal-storage-capacity': {
+        'table': 'view_nominal_storage_unit_capacity_with_geom',
+        'geom': 'geom',
+        'attributes': ['Bus', 'carrier', 'p_nom'],
+    },
+    'optimal-storage-capacity': {
+        'table': 'view_optimal_storage_unit_capacity_with_geom',
+        'geom': 'geom',
+        'attributes': ['Bus', 'carrier', 'p_nom_opt'],
+    },
+}
+
+#########################################################################################
+# Tile rendering
+#########################################################################################
+
+def validate_tile(z, x, y):
+    if not 0 <= z <= MAX_ZOOM:
+        raise QueryParameterError(f"Tile zoom must be between 0 and {MAX_ZOOM}.")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise QueryParameterError(f"Tile {z}/{x}/{y} is outside the tile grid.")
+
+
+def tile_source(config, lod):
+    # Layers with levels of detail read the simplified geometry of the zoom band
+    # from the LOD table, through that band's own GiST index.
+    if lod is None:
+        return f"public.{config['table']} t", f"t.{config['geom']}", ''
+    source = (
+        f"public.{LINE_LOD_TABLE} l "
+        f"JOIN public.{config['table']} t ON t.scenario = l.scenario AND t.\"Line\" = l.\"Line\""
+    )
+    return source, 'l.line_geom', 'AND l.scenario = %(scenario)s AND l.lod = %(lod)s'
+
+
+def tile_sql(layer, lod=None):
+    config = TILE_LAYERS[layer]
+    columns = ', '.join(f't."{column}"' for column in config['attributes'])
+    source, geom, lod_filter = tile_source(config, lod)
+    # The && test runs against the geometry in its stored srid (4326), so PostGIS can
+    # use the GiST index before clipping and transforming the matches to the tile.
+    return f"""
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+        ),
+        mvtgeom AS (
+            SELECT ST_AsMVTGeom(ST_Transform({geom}, 3857), bounds.geom,
+                                %(extent)s, %(buffer)s, true) AS geom,
+                   {columns}
+            FROM {source}, bounds
+            WHERE t.scenario = %(scenario)s AND {geom} && ST_Transform(bounds.geom, 4326) {lod_filter}
+        )
+        SELECT ST_AsMVT(mvtgeom.*, %(name)s, %(extent)s, 'geom')
+        FROM mvtgeom
+        WHERE mvtgeom.geom IS NOT NULL
+    """
+
+
+def render_tile(layer, z, x, y, scenario=DEFAULT_SCENARIO):
+    validate_tile(z, x, y)
+    lod = line_lod_for_zoom(z) if TILE_LAYERS[layer].get('lod') else None
+    params = {
+        'z': z, 'x': x, 'y': y,
+        'lod': lod,
+        'scenario': scenario,
+        'extent': MVT_EXTENT,
+        'buffer': MVT_BUFFER,
+        'name': layer.replace('-', '_'),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(tile_sql(layer, lod), params)
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
@@ -0,0 +1,277 @@
+# SPDX-FileCopyrightText: 2024 Bryan Ramirez <bryan.ramirez@openenergytransition.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+import io
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from .db import raw_connection
+from .filters import QueryParameterError
+from .scenarios import DEFAULT_SCENARIO, ensure_partition, parse_scenario
+
+logger = logging.getLogger(__name__)
+
+# Time series are stored one row per component and attribute, with the values of
+# all snapshots in a real[] array, and the snapshot axis of each component and
+# attribute once in timeseries_snapshots. Arrays are 1-based in PostgreSQL.
+SERIES_TABLE = 'timeseries'
+SNAPSHOTS_TABLE = 'timeseries_snapshots'
+# JSON uploads named like PyPSA's dynamic data, e.g. lines_t, lines_t_p0, generators_t_p.
+TIMESERIES_NAME = re.compile(r'^(?P<component>.+?)_t(?:_(?P<attribute>.+))?$')
+DEFAULT_ATTRIBUTE = 'value'
+# Columns that hold the snapshot of each row when the export has no 'index'.
+INDEX_COLUMNS = ('Index', 'snapshot', 'snapshots')
+DOWNSAMPLE_METHODS = ('lttb', 'minmax', 'none')
+# Series read from a time series upload per pass over the file, and written per COPY.
+BATCH_SERIES = 1000
+
+#########################################################################################
+# Ingestion
+#########################################################################################
+
+def timeseries_key(name):
+    # (component, attribute) of a JSON upload holding time series, None otherwise.
+    match = TIMESERIES_NAME.match(name)
+    if not match:
+        return None
+    return match['component'].lower(), (match['attribute'] or DEFAULT_ATTRIBUTE).lower()
+
+
+def read_timeseries(path):
+    # Reads a pandas 'split' export (rows are snapshots, columns are components).
+    # Returns the snapshots, the names of the series and an iterator over batches of
+    # (names, float32 snapshots x names matrix): the file is read again for each
+    # batch of BATCH_SERIES columns, so only one batch of series is held in memory.
+    import ijson
+    import pandas as pd
+
+    from .readers import iter_json_chunks
+
+    with open(path, 'rb') as file:
+        index = list(ijson.items(file, 'index.item'))
+
+    columns = None
+    rows = 0
+    for df in iter_json_chunks(path):
+        index_column = next((name for name in INDEX_COLUMNS if name in df.columns), None)
+        if index_column:
+            index += df[index_column].tolist()
+        columns = [name for name in df.columns if name != index_column]
+        rows += len(df)
+    if columns is None:
+        return [], [], iter(())
+    if len(index) != rows:
+        raise ValueError("The time series has no snapshot index.")
+    snapshots = pd.to_datetime(pd.Series(index).astype(str)).dt.tz_localize(None)
+    return list(snapshots.dt.to_pydatetime()), [str(name) for name in columns], read_batches(path, columns)
+
+
+def read_batches(path, columns):
+    import numpy as np
+    import pandas as pd
+
+    from .readers import iter_json_chunks
+
+    for start in range(0, len(columns), BATCH_SERIES):
+        batch = columns[start:start + BATCH_SERIES]
+        values = np.vstack([
+            df[batch].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32)
+            for df in iter_json_chunks(path)
+        ])
+        yield [str(name) for name in batch], values
+
+
+def array_literal(values):
+    return '{' + ','.join(map(str, values.tolist())).replace('nan', 'NULL') + '}'
+
+
+def copy_text(value):
+    # Escapes a value for COPY ... FROM STDIN in the text format.
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def store_timeseries(component, attribute, snapshots, batches, scenario=DEFAULT_SCENARIO):
+    # The previous series of the component and attribute are replaced in one
+    # transaction. batches yields (names, snapshots x names matrix), each batch of
+    # arrays is written with its own COPY straight into the partition of the
+    # scenario, so the text of only one batch is built at a time.
+    start = time.monotonic()
+    axis = io.StringIO(''.join(
+        f'{scenario}\t{component}\t{attribute}\t{position}\t{snapshot.isoformat()}\n'
+        for position, snapshot in enumerate(snapshots, start=1)
+    ))
+
+    stored = 0
+    db = raw_connection()
+    try:
+        with db.cursor() as cursor:
+            partitions = {table: ensure_partition(cursor, table, scenario) for table in (SERIES_TABLE, SNAPSHOTS_TABLE)}
+            for partition in partitions.values():
+                cursor.execute(f'DELETE FROM public.{partition} WHERE component = %s AND attribute = %s',
+                               [component, attribute])
+            cursor.copy_expert(
+                f'COPY public.{partitions[SNAPSHOTS_TABLE]} (scenario, component, attribute, position, snapshot) '
+                f'FROM STDIN', axis
+            )
+            for names, values in batches:
+                series = io.StringIO()
+                for position, name in enumerate(names):
+                    series.write(f'{scenario}\t{component}\t{attribute}\t{copy_text(name)}\t'
+                                 f'{array_literal(values[:, position])}\n')
+                series.seek(0)
+                cursor.copy_expert(
+                    f'COPY public.{partitions[SERIES_TABLE]} (scenario, component, attribute, name, "values") '
+                    f'FROM STDIN', series
+                )
+                stored += len(names)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Stored {stored} series of {len(snapshots)} snapshots for "
+                f"{component}.{attribute} of scenario '{scenario}' in {time.monotonic() - start:.2f}s")
+    return stored
+
+#########################################################################################
+# Downsampling
+#########################################################################################
+
+def lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets: keeps the first and last sample and, in each
+    # bucket in between, the sample forming the largest triangle with the sample kept
+    # in the previous bucket and the mean of the next bucket. Preserves the visual
+    # shape (peaks included) of the series far better than averaging.
+    import numpy as np
+
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = [0]
+    for bucket in range(points - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], max(edges[bucket + 2], edges[bucket + 1] + 1)
+        else:
+            next_start, next_end = n - 1, n
+        mean_x, mean_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        previous = selected[-1]
+        area = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        selected.append(start + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.asarray(selected)
+
+
+def minmax(y, points):
+    # The minimum and the maximum of each of points / 2 buckets, in time order.
+    import numpy as np
+
+    n = len(y)
+    buckets = points // 2
+    if points >= n or buckets < 1:
+        return np.arange(n)
+    selected = []
+    for bucket in np.array_split(np.arange(n), buckets):
+        low, high = bucket[np.argmin(y[bucket])], bucket[np.argmax(y[bucket])]
+        selected += sorted({low, high})
+    return np.asarray(selected)
+
+
+def downsample(values, points, method):
+    import numpy as np
+
+    y = np.asarray(values, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if method == 'lttb':
+        selected = valid[lttb(valid.astype(np.float64), y[valid], points)]
+    elif method == 'minmax':
+        selected = valid[minmax(y[valid], points)]
+    else:
+        selected = np.arange(len(y))
+    return selected.tolist()
+
+#########################################################################################
+# Range queries
+#########################################################################################
+
+def parse_time(request, name):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise QueryParameterError(f"Invalid {name} '{value}', expected an ISO 8601 date and time.")
+    return parsed.replace(tzinfo=None)
+
+
+def parse_points(request):
+    points = request.GET.get('points') or settings.TIMESERIES_DEFAULT_POINTS
+    try:
+        points = int(points)
+    except ValueError:
+        raise QueryParameterError(f"Invalid points '{points}', expected an integer.")
+    if not 3 <= points <= settings.TIMESERIES_MAX_POINTS:
+        raise QueryParameterError(f"points must be between 3 and {settings.TIMESERIES_MAX_POINTS}.")
+    return points
+
+
+def parse_method(request):
+    method = request.GET.get('method') or 'lttb'
+    if method not in DOWNSAMPLE_METHODS:
+        raise QueryParameterError(f"Unknown method '{method}', expected {', '.join(DOWNSAMPLE_METHODS)}.")
+    return method
+
+
+def timeseries_range(request, component, attribute, name):
+    start, end = parse_time(request, 'start'), parse_time(request, 'end')
+    points = parse_points(request)
+    method = parse_method(request)
+    scenario = parse_scenario(request)
+
+    # Only the slice of the array covering the requested range is read.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT position, snapshot FROM public.{SNAPSHOTS_TABLE}
+            WHERE scenario = %s AND component = %s AND attribute = %s
+              AND (%s::timestamp IS NULL OR snapshot >= %s::timestamp)
+              AND (%s::timestamp IS NULL OR snapshot <= %s::timestamp)
+            ORDER BY position
+            """,
+            [scenario, component, attribute, start, start, end, end],
+        )
+        axis = cursor.fetchall()
+        # An empty range reads the empty slice [1:0].
+        first, last = (axis[0][0], axis[-1][0]) if axis else (1, 0)
+        cursor.execute(
+            f'SELECT "values"[%s:%s] FROM public.{SERIES_TABLE} '
+            f'WHERE scenario = %s AND component = %s AND attribute = %s AND name = %s',
+            [first, last, scenario, component, attribute, name],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    values = [value if value is not None else float('nan') for value in row[0]]
+
+    selected = downsample(values, points, method) if values else []
+    return {
+        'scenario': scenario,
+        'component': component,
+        'attribute': attribute,
+        'name': name,
+        'method': method,
+        'snapshots': [axis[index][1].isoformat() for index in selected],
+        'values': [None if values[index] != values[index] else values[index] for index in selected],
+    }
@@ -3,10 +3,36 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 #
 
+from functools import wraps
+from http.client import HTTPException
+
 from django.shortcuts import render
 from django.conf import settings 
-from django.http import JsonResponse
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.views.decorators.http import require_safe
+from .aggregates import capacity_summary
+from .cache import cached_api_response
+from .clusters import CLUSTER_LAYERS, clusters_response
+from .frames import frame_index, read_frame
+from .filters import (
+  QueryParameterError,
+  apply_attribute_filters,
+  apply_pagination,
+  apply_spatial_filter,
+  parse_fields,
+  parse_zoom
+)
+from .db import has_engine, pool_stats
+from .lod import line_lod_for_zoom, line_lod_geometry
+from .metrics import render_metrics, scrape_allowed
+from .ows import proxy_request
+from .responses import api_response
+from .scenarios import list_scenarios, parse_scenario
+from .tiles import TILE_LAYERS, render_tile
+from .timeseries import timeseries_range
 from .models import (
+  IngestionJob,
   Lines,
   NominalGeneratorCapacity,
   OptimalGeneratorCapacity,
@@ -14,74 +40,184 @@ from .models import (
   OptimalStorageCapacity
 )
 
+# Columns returned by the API endpoints.
+NOMINAL_GENERATOR_FIELDS = (
+    'id', 'Bus', 'v_nom', 'country', 'x', 'y', 'control', 'generator',
+    'type', 'unit', 'v_mag_pu_set', 'v_mag_pu_min', 'sub_network', 'geom',
+    'carrier', 'p_nom'
+)
+OPTIMAL_GENERATOR_FIELDS = NOMINAL_GENERATOR_FIELDS[:-1] + ('p_nom_opt',)
+NOMINAL_STORAGE_FIELDS = ('Bus', 'geom', 'carrier', 'p_nom')
+OPTIMAL_STORAGE_FIELDS = ('Bus', 'geom', 'carrier', 'p_nom_opt')
+LINE_FIELDS = (
+    'Line', 'bus0', 'bus1', 'length', 'num_parallel', 'carrier', 'type',
+    's_max_pu', 's_nom', 'capital_cost', 's_nom_extendable', 's_nom_min',
+    'x', 'r', 'b', 'build_year', 'x_pu_eff', 'r_pu_eff', 's_nom_opt',
+    'v_nom', 'g', 's_nom_max', 'lifetime', 'terrain_factor',
+    'v_ang_min', 'v_ang_max', 'sub_network', 'x_pu', 'r_pu', 'g_pu', 'b_pu', 'line_geom'
+)
+
 # Views are here.
 def index(request):
     context = {
-        'geoserver_url': settings.GEOSERVER_URL,
+        # Behind the proxy the map requests /geoserver/... from this site.
+        'geoserver_url': '' if settings.OWS_PROXY else settings.GEOSERVER_URL,
         'geoserver_workspace': settings.GEOSERVER_WORKSPACE,
     }
     return render(request, 'index.html', context)
 
+# Turns invalid query parameters into a 400 response instead of a server error.
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except QueryParameterError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return wrapper
+
+
+def filtered_response(request, queryset, fields, geom_field, annotate=None, geom_source=None):
+    # Shared by the /api/ endpoints: spatial and attribute filters, field projection
+    # and keyset pagination, then serialization in the requested format.
+    queryset = apply_spatial_filter(request, queryset, geom_field)
+    queryset = apply_attribute_filters(request, queryset)
+    fields = parse_fields(request, queryset, fields, geom_field)
+    if annotate:
+        queryset = queryset.annotate(**annotate)
+    page, next_after = apply_pagination(request, queryset)
+    response = api_response(request, page, fields, geom_field, geom_source=geom_source)
+    if next_after is not None:
+        query = request.GET.copy()
+        query['after'] = next_after
+        response['X-Next-After'] = next_after
+        response['Link'] = f'<{request.path}?{query.urlencode()}>; rel="next"'
+    return response
+
+
+@api_view
+@cached_api_response
 def nominal_generator_capacity_json(request):
-    capacities = NominalGeneratorCapacity.objects.all().values(
-        'id', 'Bus', 'v_nom', 'country', 'x', 'y', 'control', 'generator',
-        'type', 'unit', 'v_mag_pu_set', 'v_mag_pu_min', 'sub_network', 'geom',
-        'carrier', 'p_nom'
-    )
-    # Convert the QuerySet to a list of dictionaries
-    capacity_list = list(capacities)
-    # Convert geometric fields to a JSON-friendly format
-    for capacity in capacity_list:
-        capacity['geom'] = str(capacity['geom'])  # Convert geometric value to string if necessary
-    return JsonResponse(capacity_list, safe=False)
+    capacities = NominalGeneratorCapacity.objects.filter(scenario=parse_scenario(request))
+    return filtered_response(request, capacities, NOMINAL_GENERATOR_FIELDS, 'geom')
 
 
+@api_view
+@cached_api_response
 def optimal_generator_capacity_json(request):
-    capacities = OptimalGeneratorCapacity.objects.all().values(
-        'id', 'Bus', 'v_nom', 'country', 'x', 'y', 'control', 'generator',
-        'type', 'unit', 'v_mag_pu_set', 'v_mag_pu_min', 'sub_network', 'geom',
-        'carrier', 'p_nom_opt'
-    )
-    # Convert the QuerySet to a list of dictionaries
-    capacity_list = list(capacities)
-    # Convert geometric fields to a JSON-friendly format
-    for capacity in capacity_list:
-        capacity['geom'] = str(capacity['geom'])  # Convert geometric value to string if necessary
-    return JsonResponse(capacity_list, safe=False)
-    
+    capacities = OptimalGeneratorCapacity.objects.filter(scenario=parse_scenario(request))
+    return filtered_response(request, capacities, OPTIMAL_GENERATOR_FIELDS, 'geom')
+
+
+@api_view
+@cached_api_response
 def nominal_storage_capacity_json(request):
-    capacities = NominalStorageCapacity.objects.all().values(
-        'Bus', 'geom', 'carrier', 'p_nom'
-    )
-    # Convert the QuerySet to a list of dictionaries
-    capacity_list = list(capacities)
-    # Convert geometric value to string if necessary
-    for capacity in capacity_list:
-        capacity['geom'] = str(capacity['geom'])
-    return JsonResponse(capacity_list, safe=False)
-  
+    capacities = NominalStorageCapacity.objects.filter(scenario=parse_scenario(request))
+    return filtered_response(request, capacities, NOMINAL_STORAGE_FIELDS, 'geom')
+
+
+@api_view
+@cached_api_response
 def optimal_storage_capacity_json(request):
-    capacities = OptimalStorageCapacity.objects.all().values(
-        'Bus', 'geom', 'carrier', 'p_nom_opt'
-    )
-    # Convert the QuerySet to a list of dictionaries
-    capacity_list = list(capacities)
-    # Convert geometric value to string if necessary
-    for capacity in capacity_list:
-        capacity['geom'] = str(capacity['geom'])
-    return JsonResponse(capacity_list, safe=False)  
-  
+    capacities = OptimalStorageCapacity.objects.filter(scenario=parse_scenario(request))
+    return filtered_response(request, capacities, OPTIMAL_STORAGE_FIELDS, 'geom')
+
+
+@api_view
+@cached_api_response
 def line_data_json(request):
-    line_data = Lines.objects.all().values(
-        'Line', 'bus0', 'bus1', 'length', 'num_parallel', 'carrier', 'type',
-        's_max_pu', 's_nom', 'capital_cost', 's_nom_extendable', 's_nom_min',
-        'x', 'r', 'b', 'build_year', 'x_pu_eff', 'r_pu_eff', 's_nom_opt',
-        'v_nom', 'g', 's_nom_max', 'lifetime', 'terrain_factor', 
-        'v_ang_min', 'v_ang_max', 'sub_network', 'x_pu', 'r_pu', 'g_pu', 'b_pu', 'line_geom'
-    )
-    # Convert the QuerySet to a list of dictionaries
-    line_list = list(line_data)
-    # Convert geometric value to string if necessary
-    for line in line_list:
-        line['line_geom'] = str(line['line_geom'])
-    return JsonResponse(line_list, safe=False)
\ No newline at end of file
+    scenario = parse_scenario(request)
+    line_data = Lines.objects.filter(scenario=scenario)
+    # Serve simplified geometries when the requested zoom has a level of detail.
+    lod = line_lod_for_zoom(parse_zoom(request))
+    if lod is None:
+        return filtered_response(request, line_data, LINE_FIELDS, 'line_geom')
+    return filtered_response(request, line_data, LINE_FIELDS, 'line_geom',
+                             annotate={'lod_geom': line_lod_geometry(lod, scenario)},
+                             geom_source='lod_geom')
+
+
+@api_view
+def vector_tile(request, layer, z, x, y):
+    if layer not in TILE_LAYERS:
+        raise Http404(f"Unknown tile layer '{layer}'")
+    tile = render_tile(layer, z, x, y, parse_scenario(request))
+    return HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+
+
+@api_view
+@cached_api_response
+def capacity_summary_json(request):
+    return JsonResponse(capacity_summary(request))
+
+
+@api_view
+@cached_api_response
+def capacity_clusters_json(request, layer):
+    if layer not in CLUSTER_LAYERS:
+        raise Http404(f"Unknown cluster layer '{layer}'")
+    return clusters_response(request, layer)
+
+
+@api_view
+@cached_api_response
+def timeseries_json(request, component, attribute, name):
+    series = timeseries_range(request, component, attribute, name)
+    if series is None:
+        raise Http404(f"No time series '{name}' for {component}.{attribute}")
+    return JsonResponse(series)
+
+
+@api_view
+@cached_api_response(scoped=False)
+def scenarios_json(request):
+    return JsonResponse({'scenarios': list_scenarios()})
+
+
+@api_view
+@cached_api_response
+def line_loading_index_json(request):
+    return JsonResponse(frame_index(request))
+
+
+@api_view
+@cached_api_response
+def line_loading_frame(request, position):
+    frame = read_frame(request, position)
+    if frame is None:
+        raise Http404(f"No line loading frame {position}")
+    snapshot, data = frame
+    response = HttpResponse(data, content_type='application/octet-stream')
+    response['X-Snapshot'] = snapshot.isoformat()
+    return response
+
+
+@require_safe
+def ows_proxy(request, workspace, service):
+    # Only the dashboard workspace is proxied, this is not an open proxy to GeoServer.
+    if workspace != settings.GEOSERVER_WORKSPACE or service not in ('wms', 'wfs', 'ows'):
+        raise Http404(f"Unknown OWS endpoint '{workspace}/{service}'")
+    try:
+        status, content_type, body, cache_state = proxy_request(workspace, service, request.GET)
+    except (OSError, HTTPException) as e:
+        return JsonResponse({'error': f"GeoServer is unavailable: {e}"}, status=502)
+    response = HttpResponse(body, status=status, content_type=content_type or None)
+    response['X-Cache'] = cache_state
+    if cache_state != 'BYPASS' and status == 200:
+        response['Cache-Control'] = settings.OWS_CACHE_CONTROL
+    return response
+
+
+def metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404("Metrics are disabled")
+    if not scrape_allowed(request):
+        return HttpResponseForbidden("Metrics are restricted to METRICS_ALLOWED_IPS or METRICS_TOKEN")
+    jobs = dict(IngestionJob.objects.order_by().values_list('status').annotate(count=Count('id')))
+    gauges = [('dashboard_ingestion_jobs', "Ingestion jobs by status.",
+               [({'status': status}, jobs.get(status, 0)) for status, _ in IngestionJob.STATUS_CHOICES])]
+    if has_engine():
+        # Only a process that has loaded data holds a pool, web workers usually do not.
+        gauges += [(f'dashboard_db_pool_{name}', f"SQLAlchemy pool {name.replace('_', ' ')} of this process.",
+                    [({}, value)]) for name, value in pool_stats().items()]
+    return HttpResponse(render_metrics(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -483,6 +483,7 @@ async function init() {
   //*****************************************************************************
   if (map) {
     map.on("moveend", updateUrlWithCurrentView);
+    map.on("moveend", loadViewportCharts);
     map.on("singleclick", updateUrlWithCurrentView);
   } else {
     console.error('"map" not difined.');
@@ -1060,6 +1061,32 @@ function initChart(
   });
 }
 
+// Restrict an API request to the current map view: the view extent in lon/lat and
+// the zoom, which the API uses to pad the bbox so symbols on the edges are kept
+function viewportUrl(url) {
+  if (!map || !map.getSize()) {
+    return url;
+  }
+  const view = map.getView();
+  const [minLon, minLat, maxLon, maxLat] = ol.proj.transformExtent(
+    view.calculateExtent(map.getSize()),
+    view.getProjection(),
+    "EPSG:4326"
+  );
+  // At low zooms the view reaches past the edges of the world
+  const bbox = [
+    Math.max(minLon, -180),
+    Math.max(minLat, -90),
+    Math.min(maxLon, 180),
+    Math.min(maxLat, 90),
+  ];
+  const queryParams = new URLSearchParams({
+    bbox: bbox.map((value) => value.toFixed(5)).join(","),
+    zoom: Math.round(view.getZoom()).toString(),
+  });
+  return `${url}?${queryParams.toString()}`;
+}
+
 // Fetch data from a specified API endpoint
 function fetchData(url) {
   return fetch(url).then((response) => {
@@ -1072,7 +1099,7 @@ function fetchData(url) {
 
 // Load and visualize nominal generator capacity data
 function loadNominalGeneratorCapacityData(selectedBusId = null) {
-  fetchData("/api/nominal-generator-capacity/")
+  fetchData(viewportUrl("/api/nominal-generator-capacity/"))
     .then((data) => {
       if (selectedBusId) {
         // Filters the data to obtain only that of the selected bus and excludes 'load'
@@ -1189,7 +1216,7 @@ function createPieChart(chartId, pieChartData, chartTitle) {
 
 // Load and visualize optimal generator capacity data
 function loadOptimalGeneratorCapacityData(selectedBusId = null) {
-  fetchData("/api/optimal-generator-capacity/")
+  fetchData(viewportUrl("/api/optimal-generator-capacity/"))
     .then((data) => {
       if (selectedBusId) {
         // Filters the data to obtain only that of the selected bus and excludes 'load'
@@ -1263,7 +1290,7 @@ function updateChartOrShowMessage(chartId, data, pieChartDataFunction, title) {
 
 // Load and visualize nominal generator capacity data
 function loadNominalStorageCapacityData(selectedBusId = null) {
-  fetchData("/api/nominal-storage-capacity/")
+  fetchData(viewportUrl("/api/nominal-storage-capacity/"))
     .then((data) => {
       let busData;
       if (selectedBusId) {
@@ -1304,7 +1331,7 @@ function loadNominalStorageCapacityData(selectedBusId = null) {
 
 // Load and visualize optimal generator capacity data
 function loadOptimalStorageCapacityData(selectedBusId = null) {
-  fetchData("/api/optimal-storage-capacity/")
+  fetchData(viewportUrl("/api/optimal-storage-capacity/"))
     .then((data) => {
       let busData;
       if (selectedBusId) {
@@ -1345,7 +1372,7 @@ function loadOptimalStorageCapacityData(selectedBusId = null) {
 
 // Load and visualize line data for nominal vs. optimal capacities
 function loadLineData(selectedLineId = null) {
-  fetchData("/api/line-data/")
+  fetchData(viewportUrl("/api/line-data/"))
     .then((data) => {
       if (selectedLineId) {
         const lineData = data.find((item) => item.Line === selectedLineId);
@@ -1407,15 +1434,21 @@ function createDualDatasets(sNomData, sNomOptData) {
   };
 }
 
-// Initialize data loading and visualization once the DOM content is fully loaded
-document.addEventListener("DOMContentLoaded", function () {
-  // init();
+// Load the charts for the features in view each time the map stops moving, the
+// first time once it is rendered; a selected bus or line keeps its charts
+function loadViewportCharts() {
+  const selected = ["map-label", "line-map-label"].some(
+    (id) => document.getElementById(id).style.display !== "none"
+  );
+  if (selected) {
+    return;
+  }
   loadNominalGeneratorCapacityData();
   loadOptimalGeneratorCapacityData();
   loadNominalStorageCapacityData();
   loadOptimalStorageCapacityData();
   loadLineData();
-});
+}
 
 function updateUrlWithCurrentView() {
   const view = map.getView();